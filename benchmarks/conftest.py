@@ -0,0 +1,115 @@
+"""Synthetic catalogues, PSF images and stand-in tools for the benchmarks"""
+
+from __future__ import print_function
+
+import os
+import stat
+import sys
+
+import numpy as np
+import pytest
+
+import matplotlib
+matplotlib.use('Agg')
+
+# Antennas per synthetic catalogue
+NANTS = [64, 1024, 10240]
+# Pixels per side of the synthetic PSF images, e.g. MKATSIM_BENCH_PIXELS=1024
+PIXELS = [int(npix) for npix in os.environ.get('MKATSIM_BENCH_PIXELS', '1024,4096,7168').split(',')]  # noqa
+# MeerKAT reference location (LAT, LON, ALT) as given on the command line
+REFERENCE = ['-30:42:39.8', '21:26:38.0', '1035.']
+# PSF pixel size [asec] and fitted beam (bmaj [asec], bmin [asec], bpa [deg])
+SCALE = 0.5
+BEAM = [6., 4., 30.]
+
+# Stand-in for makems: write the measurement set parts with an ANTENNA dir
+MAKEMS = '''#!%s
+import os, shutil, sys
+lines = [line.strip() for line in open(sys.argv[1]) if '=' in line]
+cfg = dict(line.split('=', 1) for line in lines)
+for part in range(int(cfg.get('NParts', 1))):
+    msname = '%%s_p%%d' %% (cfg['MSName'], part)
+    shutil.rmtree(msname, ignore_errors=True)
+    os.makedirs(os.path.join(msname, 'ANTENNA'))
+    open(os.path.join(msname, 'table.dat'), 'w').close()
+'''
+# Stand-in for wsclean: write an empty PSF product named after -name
+WSCLEAN = '''#!%s
+import sys
+name = sys.argv[sys.argv.index('-name') + 1]
+open('%%s-psf.fits' %% name, 'w').close()
+'''
+
+
+def write_catalog(
+                  filename,
+                  nants,
+                  seed=1,
+                 ):
+    """ENU antenna catalogue with a dense core out to 8 km, as MeerKAT."""
+    rng = np.random.RandomState(seed)
+    radius = 8000.*rng.rand(nants)**2
+    angle = 2.*np.pi*rng.rand(nants)
+    east = radius*np.sin(angle)
+    north = radius*np.cos(angle)
+    up = rng.normal(scale=0.2, size=nants)
+    with open(filename, 'w') as fout:
+        fout.write('#E N U dish_diam station mount\n')
+        for idx in range(nants):
+            fout.write('%.3f %.3f %.3f 13.5 m%05d ALT-AZ\n' % (east[idx], north[idx], up[idx], idx))  # noqa
+    return filename
+
+
+def write_psf(
+              filename,
+              npix,
+              scale=SCALE,
+              beam=BEAM,
+             ):
+    """PSF image of npix x npix pixels, a Gaussian main lobe over ripples."""
+    from mkatsim.psf import imager
+    offsets = (np.arange(npix, dtype=np.float32) - npix//2)*scale
+    [bmaj, bmin] = [width/(2.*np.sqrt(2.*np.log(2.))) for width in beam[:2]]
+    # separable terms keep a 7k image within a few image sized buffers
+    image = np.outer(np.exp(-0.5*(offsets/bmaj)**2), np.exp(-0.5*(offsets/bmin)**2))  # noqa
+    image += 0.05*np.outer(np.cos(offsets/bmaj), np.cos(offsets/bmin))
+    imager.write_fits(filename, image, 0., np.deg2rad(-30.), 1.284e9, 8.56e8, scale=scale, beam=beam)  # noqa
+    return filename
+
+
+@pytest.fixture(scope='session')
+def ref_location():
+    from mkatsim.common import coordinates
+    return coordinates.location(*REFERENCE)
+
+
+@pytest.fixture(scope='session', params=NANTS, ids=['%dants' % nants for nants in NANTS])  # noqa
+def catalog(request, tmpdir_factory):
+    filename = str(tmpdir_factory.mktemp('catalogs').join('synthetic_%d.enu' % request.param))  # noqa
+    return write_catalog(filename, request.param)
+
+
+@pytest.fixture(scope='session')
+def array(catalog, ref_location):
+    from mkatsim.common import coordinates
+    return coordinates.read(catalog, ref_location, enu=True)[0]
+
+
+@pytest.fixture(scope='session', params=PIXELS, ids=['%dpix' % npix for npix in PIXELS])  # noqa
+def psf_fits(request, tmpdir_factory):
+    filename = str(tmpdir_factory.mktemp('psfs').join('synthetic_%d-psf.fits' % request.param))  # noqa
+    return write_psf(filename, request.param)
+
+
+@pytest.fixture
+def stand_ins(tmpdir, monkeypatch):
+    """Directory with makems and wsclean stand-ins, first on the PATH."""
+    bindir = tmpdir.mkdir('bin')
+    for [name, script] in [['makems', MAKEMS], ['wsclean', WSCLEAN]]:
+        tool = bindir.join(name)
+        tool.write(script % sys.executable)
+        os.chmod(str(tool), os.stat(str(tool)).st_mode | stat.S_IXUSR)
+    monkeypatch.setenv('PATH', '%s%s%s' % (bindir, os.pathsep, os.environ['PATH']))  # noqa
+    return str(bindir)
+
+# -fin-
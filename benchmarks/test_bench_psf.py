@@ -0,0 +1,143 @@
+"""Throughput of PSF simulation, imaging and post-processing steps"""
+
+from __future__ import print_function
+
+import itertools
+import os
+from optparse import Values
+
+import numpy as np
+import pytest
+
+pytest.importorskip('pytest_benchmark')
+
+from mkatsim.psf import fits2png  # noqa
+
+# Rounds of the slow single shot benchmarks
+ROUNDS = 3
+# Rows of the synthetic measurement sets, scatter and density plot paths
+MS_ROWS = [2**16, 2**22]
+
+
+def read_image(fitsfile):
+    import pyfits
+    with pyfits.open(fitsfile) as hdus:
+        return np.array(hdus[0].data[0, 0], dtype=float)
+
+
+@pytest.fixture(scope='module')
+def psf_image(psf_fits):
+    return read_image(psf_fits)
+
+
+@pytest.fixture(scope='module', params=MS_ROWS, ids=['%drows' % nrows for nrows in MS_ROWS])  # noqa
+def measurement_set(request, tmpdir_factory):
+    """Measurement set with random UVW rows and a 64 antenna ANTENNA table."""
+    tables = pytest.importorskip('casacore.tables')
+    msname = str(tmpdir_factory.mktemp('ms').join('synthetic_%d.ms' % request.param))  # noqa
+    rng = np.random.RandomState(1)
+    tab = tables.default_ms(msname)
+    try:
+        tab.addrows(request.param)
+        tab.putcol('UVW', rng.normal(scale=2000., size=(request.param, 3)))
+    finally:
+        tab.close()
+    anttab = tables.table(os.path.join(msname, 'ANTENNA'), readonly=False, ack=False)  # noqa
+    try:
+        anttab.addrows(64)
+        anttab.putcol('POSITION', 5109000. + rng.normal(scale=2000., size=(64, 3)))  # noqa
+    finally:
+        anttab.close()
+    return msname
+
+
+def test_make_tbl(benchmark, array, tmpdir):
+    pytest.importorskip('casacore.tables')
+    from mkatsim.psf import anttbl
+    counter = itertools.count()
+
+    # a new table per round
+    def setup():
+        return ((str(tmpdir.join('ANTENNAS%d' % next(counter))), array), {})
+    benchmark.pedantic(anttbl.make_tbl, setup=setup, rounds=ROUNDS)
+
+
+def test_zscale(benchmark, psf_image):
+    benchmark(fits2png.zscale, psf_image, nsamples=100000, contrast=0.05)
+
+
+@pytest.mark.parametrize('fast', [False, True], ids=['figure', 'fast'])
+def test_write_png(benchmark, psf_image, tmpdir, fast):
+    import matplotlib.pyplot as plt
+    filename = str(tmpdir.join('psf'))
+
+    def write():
+        fits2png.write_png(psf_image, filename, contrast=0.05, cmap='jet', fast=fast)  # noqa
+        plt.close('all')
+    benchmark.pedantic(write, rounds=ROUNDS)
+
+
+def test_along_axes(benchmark, psf_fits, tmpdir):
+    import matplotlib.pyplot as plt
+    from mkatsim.psf import plot
+    output = str(tmpdir.join('slice.png'))
+
+    def along_axes():
+        plot.along_axes(psf_fits, output=output)
+        plt.close('all')
+    benchmark.pedantic(along_axes, rounds=ROUNDS)
+
+
+@pytest.mark.parametrize('density', [False, True], ids=['scatter', 'density'])
+def test_uv(benchmark, measurement_set, tmpdir, density):
+    import matplotlib.pyplot as plt
+    from mkatsim.psf import plot
+    output = str(tmpdir.join('uv.png'))
+
+    def uv():
+        plot.uv(measurement_set, output=output, density=density)
+        plt.close('all')
+    benchmark.pedantic(uv, rounds=ROUNDS)
+
+
+# Options of a single scan, as mkspsf would parse them
+def scan_opts(tmpdir):
+    tblname = tmpdir.mkdir('ANTENNAS')
+    tblname.join('table.dat').write('')
+    return Values({
+                   'cfg': os.path.join(os.path.dirname(__file__), '..', 'config', 'makems.cfg'),  # noqa
+                   'array': 'synthetic',
+                   'declination': '-30d00m00.0s',
+                   'rightascension': '00h00m00.0s',
+                   'stime': '2014/01/01/15:00:00',
+                   'synthesis': 1.,
+                   'dt': 8.,
+                   'dtime': 12.,
+                   'nparts': 1,
+                   'nbands': 1,
+                   'nfreqs': 1,
+                   'sfreq': 1.284e9,
+                   'stepfreq': 2.09e5,
+                   'msname': None,
+                   'tblname': str(tblname),
+                   'imager': 'wsclean',
+                   'no_cache': True,
+                   'timeout': None,
+                   'debug': False,
+                  })
+
+
+def test_makems(benchmark, stand_ins, tmpdir, monkeypatch):
+    from mkatsim.psf import makems
+    monkeypatch.chdir(tmpdir)
+    opts = scan_opts(tmpdir)
+    benchmark.pedantic(makems.ms_make, args=(opts,), rounds=10)
+
+
+def test_wsclean(benchmark, stand_ins, tmpdir, monkeypatch):
+    from mkatsim.psf import main
+    monkeypatch.chdir(tmpdir)
+    opts = scan_opts(tmpdir)
+    benchmark.pedantic(main.image, args=(opts, 'synthetic.ms', []), rounds=10)
+
+# -fin-
@@ -0,0 +1,60 @@
+"""Throughput of catalogue reading and array layout plotting"""
+
+from __future__ import print_function
+
+import numpy as np
+import pytest
+
+pytest.importorskip('pytest_benchmark')
+
+from mkatsim.common import coordinates  # noqa
+from mkatsim.common.antennas import AntennaArray  # noqa
+from mkatsim.subarray import telescopearray  # noqa
+from mkatsim.subarray.projection import Mercator  # noqa
+
+# Radius of the circles shot around every antenna [km]
+RADIUS = 1.
+
+
+def test_read_catalog(benchmark, catalog):
+    # parse the text catalogue, no binary sidecar
+    benchmark(coordinates.read_arrays, catalog, sidecar=False)
+
+
+def test_read(benchmark, catalog, ref_location):
+    # first read writes the sidecar, the timed reads reuse it
+    coordinates.read(catalog, ref_location, enu=True)
+    benchmark(coordinates.read, catalog, ref_location, enu=True)
+
+
+def test_build_array(benchmark, array):
+    # a new array per round, the geodetic conversion is not cached yet
+    def setup():
+        return ((AntennaArray(array.names, array.xyz),), {})
+    benchmark.pedantic(telescopearray.build_array, setup=setup, rounds=20)
+
+
+def test_shoot(benchmark, array):
+    azimuth = np.arange(360.)
+    benchmark(
+              telescopearray.shoot,
+              array.longitude[:, np.newaxis],
+              array.latitude[:, np.newaxis],
+              azimuth[np.newaxis, :],
+              RADIUS,
+             )
+
+
+def test_equi(benchmark, array):
+    import matplotlib.pyplot as plt
+    proj = Mercator(np.mean(array.longitude), np.mean(array.latitude))
+    lon = array.longitude[:64]
+    lat = array.latitude[:64]
+
+    def circles():
+        for centerlon, centerlat in zip(lon, lat):
+            telescopearray.equi(proj, centerlon, centerlat, RADIUS)
+    benchmark(circles)
+    plt.close('all')
+
+# -fin-
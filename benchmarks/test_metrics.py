@@ -0,0 +1,42 @@
+"""First null and sidelobe metrics of PSFs with a known radial profile"""
+
+from __future__ import print_function
+
+import numpy as np
+import pytest
+
+from mkatsim.psf import metrics
+
+# Image size [pixels] and radius [pixels] of the first null
+SIZE = 61
+NULL = 5
+
+
+# Circular PSF with the given radial profile, peak at the image centre
+def radial_psf(profile):
+    radius = np.hypot(*np.ogrid[-(SIZE//2):SIZE//2 + 1, -(SIZE//2):SIZE//2 + 1])  # noqa
+    # damped, so that the outer rings stay below the peak
+    return [radius, (profile(radius)*np.exp(-radius/SIZE))[np.newaxis]]
+
+
+def test_first_null_at_minimum():
+    # never crosses zero, minimum of 0.2 in the annulus at NULL pixels
+    [radius, images] = radial_psf(lambda radius: 0.6 + 0.4*np.cos(np.pi*radius/NULL))  # noqa
+    values = metrics.stack_metrics(images, 1., np.zeros(1))
+    profile = values['radial_profile'][0]
+    assert np.argmin(profile[:2*NULL]) == NULL
+    assert values['first_null'][0] == NULL
+    # the sidelobes start just outside the minimum
+    sidelobes = images[0][radius > NULL]
+    assert values['peak_sidelobe'][0] == pytest.approx(sidelobes.max())
+    assert values['rms_sidelobe'][0] == pytest.approx(np.sqrt(np.mean(sidelobes**2)))  # noqa
+
+
+def test_first_null_at_zero_crossing():
+    [radius, images] = radial_psf(lambda radius: np.cos(np.pi*radius/(2.*NULL)))  # noqa
+    values = metrics.stack_metrics(images, 2., np.zeros(1))
+    # interpolated between the annuli on either side of the crossing, within
+    # a quarter pixel of the crossing of the profile
+    assert values['first_null'][0] == pytest.approx(2.*NULL, abs=2.*0.25)
+
+# -fin-
@@ -0,0 +1,59 @@
+"""Startup time budget of the command line tools"""
+
+from __future__ import print_function
+
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+# Wall time budget per CLI call [sec], override for slow machines
+BUDGET = float(os.environ.get('MKATSIM_STARTUP_BUDGET', 1.0))
+# Dependencies only the simulation and plotting paths may import
+HEAVY = ['astropy', 'casacore', 'matplotlib', 'mpl_toolkits.basemap', 'pyfits', 'scipy']  # noqa
+
+# Run a CLI in a fresh interpreter, report the heavy modules it imported
+DRIVER = '''
+import sys
+sys.argv = %r
+from %s import cli
+try:
+    cli()
+except SystemExit:
+    pass
+sys.stdout.write('\\nHEAVY:' + ','.join(m for m in %r if m in sys.modules))
+'''
+
+CALLS = [
+         ['mkatsim.subarray.__main__', ['mksarray', '--help']],
+         ['mkatsim.subarray.__main__', ['mksarray', '--sub', '?']],
+         ['mkatsim.psf.__main__', ['mkspsf', '--help']],
+         ['mkatsim.psf.fits2png', ['mkspng', '--help']],
+        ]
+
+
+def run_cli(module, argv):
+    script = DRIVER % (argv, module, HEAVY)
+    start = time.time()
+    output = subprocess.check_output([sys.executable, '-c', script], cwd=ROOT)
+    elapsed = time.time() - start
+    heavy = output.decode('utf-8').rsplit('HEAVY:', 1)[1].strip()
+    return [elapsed, [name for name in heavy.split(',') if name]]
+
+
+@pytest.mark.parametrize('module,argv', CALLS[:3])
+def test_no_heavy_imports(module, argv):
+    [elapsed, heavy] = run_cli(module, argv)
+    assert heavy == [], '%s imports %s' % (' '.join(argv), ', '.join(heavy))
+
+
+@pytest.mark.parametrize('module,argv', CALLS)
+def test_startup_budget(module, argv):
+    # best of a few runs, the first may pay for cold disk caches
+    elapsed = min(run_cli(module, argv)[0] for _ in range(3))
+    assert elapsed < BUDGET, '%s took %.2f sec, budget %.2f sec' % (' '.join(argv), elapsed, BUDGET)  # noqa
+
+# -fin-
@@ -0,0 +1,216 @@
+"""Struct-of-arrays container for antenna positions"""
+
+from __future__ import print_function
+
+import numpy as np
+
+# WGS84 ellipsoid
+WGS84_A = 6378137.0  # m
+WGS84_F = 1./298.257223563
+
+
+# Geocentric XYZ [m] to geodetic (lat [deg], lon [deg], height [m]) on WGS84
+def geodetic(xyz, niter=5):
+    xyz = np.asarray(xyz, dtype=float)
+    x, y, z = xyz[..., 0], xyz[..., 1], xyz[..., 2]
+    e2 = WGS84_F*(2. - WGS84_F)
+    lon = np.arctan2(y, x)
+    p = np.hypot(x, y)
+    lat = np.arctan2(z, p*(1. - e2))
+    for _ in range(niter):
+        n = WGS84_A / np.sqrt(1. - e2*np.sin(lat)**2)
+        height = p/np.cos(lat) - n
+        lat = np.arctan2(z, p*(1. - e2*n/(n + height)))
+    n = WGS84_A / np.sqrt(1. - e2*np.sin(lat)**2)
+    height = p/np.cos(lat) - n
+    return [np.rad2deg(lat), np.rad2deg(lon), height]
+
+
+# Rotate geocentric offsets [m] to local ENU at (lat, lon) in degrees
+def xyz_to_enu(dxyz, lat, lon):
+    lat = np.deg2rad(lat)
+    lon = np.deg2rad(lon)
+    rot = np.array([
+                    [-np.sin(lon), np.cos(lon), 0.],
+                    [-np.sin(lat)*np.cos(lon), -np.sin(lat)*np.sin(lon), np.cos(lat)],  # noqa
+                    [np.cos(lat)*np.cos(lon), np.cos(lat)*np.sin(lon), np.sin(lat)],  # noqa
+                   ])
+    return np.dot(np.asarray(dxyz, dtype=float), rot.T)
+
+
+class AntennaArray(object):
+    """
+    Antenna positions, diameters and mounts held in contiguous arrays.
+
+    Subarrays are views that share the storage of the full array and only
+    keep the indices of their antennas.  For backward compatibility the
+    array behaves as the read-only dict of name -> EarthLocation that was
+    passed around before.
+    """
+
+    def __init__(
+                 self,
+                 names,             # antenna names
+                 xyz,               # (nants, 3) geocentric positions [m]
+                 diameters=13.5,    # dish diameter(s) [m]
+                 mounts='ALT-AZ',   # mount type(s)
+                 ref_location=None,  # EarthLocation of the array centre
+                 catalog=None,       # antenna file, for the baseline sidecar
+                ):
+        names = np.array([str(name) for name in names])
+        nants = names.size
+        self._data = {
+                      'names': names,
+                      'xyz': np.ascontiguousarray(xyz, dtype=float).reshape(nants, 3),  # noqa
+                      'diameters': np.ascontiguousarray(np.broadcast_to(diameters, (nants,)), dtype=float),  # noqa
+                      'mounts': np.array(np.broadcast_to(mounts, (nants,)), dtype=str),  # noqa
+                      'lookup': dict((name, idx) for idx, name in enumerate(names)),  # noqa
+                     }
+        if len(self._data['lookup']) != nants:
+            raise RuntimeError('Duplicate antenna names in array')
+        self._index = slice(None)
+        self.ref_location = ref_location
+        self.catalog = catalog
+
+    # Subarray sharing the storage of this array
+    def _view(self, index):
+        view = object.__new__(AntennaArray)
+        view._data = self._data
+        view._index = index
+        view.ref_location = self.ref_location
+        view.catalog = self.catalog
+        return view
+
+    @property
+    def indices(self):
+        """Indices of the antennas in the storage of the full array."""
+        return np.arange(self._data['names'].size)[self._index]
+
+    @property
+    def names(self):
+        return self._data['names'][self._index]
+
+    @property
+    def xyz(self):
+        return self._data['xyz'][self._index]
+
+    @property
+    def diameters(self):
+        return self._data['diameters'][self._index]
+
+    @property
+    def mounts(self):
+        return self._data['mounts'][self._index]
+
+    # Geodetic coordinates are converted once for the full array
+    def _geodetic(self):
+        if 'geodetic' not in self._data:
+            self._data['geodetic'] = np.vstack(geodetic(self._data['xyz']))
+        return self._data['geodetic']
+
+    @property
+    def latitude(self):
+        return self._geodetic()[0][self._index]
+
+    @property
+    def longitude(self):
+        return self._geodetic()[1][self._index]
+
+    @property
+    def height(self):
+        return self._geodetic()[2][self._index]
+
+    @property
+    def enu(self):
+        """Local ENU offsets [m] from the array reference location."""
+        if self.ref_location is None:
+            raise RuntimeError('Array reference location needed for ENU coordinates')  # noqa
+        ref_xyz = np.array([coord.value for coord in self.ref_location.to_geocentric()])  # noqa
+        return xyz_to_enu(
+                          self.xyz - ref_xyz,
+                          self.ref_location.latitude.value,
+                          self.ref_location.longitude.value,
+                         )
+
+    def index(self, names):
+        """Positions of the named antennas in this (sub)array."""
+        lookup = self._data['lookup']
+        storage = np.array([lookup[str(name).strip()] for name in names], dtype=int)  # noqa
+        if isinstance(self._index, slice):
+            return storage
+        position = np.full(self._data['names'].size, -1, dtype=int)
+        position[self._index] = np.arange(len(self))
+        storage = position[storage]
+        if np.any(storage < 0):
+            raise KeyError('Antenna not in subarray')
+        return storage
+
+    def subarray(self, names):
+        """Subarray view of the named antennas, in the given order."""
+        return self._view(self.indices[self.index(names)])
+
+    def select(self, mask):
+        """Subarray view of the antennas where mask is True."""
+        return self._view(self.indices[np.asarray(mask, dtype=bool)])
+
+    def baselines(self):
+        """BaselineTable of this (sub)array, built once for the full array."""
+        from . import baselines
+        if 'baselines' not in self._data:
+            full = self._view(slice(None))
+            if self.catalog is not None:
+                table = baselines.read(self.catalog, full)
+            else:
+                table = baselines.BaselineTable.from_array(full)
+            self._data['baselines'] = table
+        if isinstance(self._index, slice):
+            return self._data['baselines']
+        return self._data['baselines'].take(self.indices)
+
+    def ant_list(self):
+        """Antenna parameter dicts as used for the CASA ANTENNA table."""
+        ant_list = []
+        for name, xyz, diameter in zip(self.names, self.xyz, self.diameters):
+            ant_list.append({
+                             'POSITION': list(xyz),
+                             'NAME': str(name),
+                             'DISH_DIAMETER': float(diameter),
+                            })
+        return ant_list
+
+    # read-only dict interface
+    def __len__(self):
+        return self.names.size
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __contains__(self, name):
+        if str(name) not in self._data['lookup']:
+            return False
+        if isinstance(self._index, slice):
+            return True
+        return self._data['lookup'][str(name)] in self.indices
+
+    def keys(self):
+        return [str(name) for name in self.names]
+
+    def __getitem__(self, name):
+        from astropy import units as u
+        from astropy.coordinates import EarthLocation
+        [x, y, z] = self.xyz[self.index([name])[0]]
+        return EarthLocation.from_geocentric(x, y, z, unit=u.m)
+
+    def __repr__(self):
+        return '<AntennaArray of %d antennas>' % len(self)
+
+
+# Accept an AntennaArray or the older dict of name -> EarthLocation
+def as_array(array, ref_location=None):
+    if isinstance(array, AntennaArray):
+        return array
+    names = list(array.keys())
+    xyz = [[array[name].x.value, array[name].y.value, array[name].z.value] for name in names]  # noqa
+    return AntennaArray(names, xyz, ref_location=ref_location)
+
+# -fin-
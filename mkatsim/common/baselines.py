@@ -0,0 +1,165 @@
+"""Baseline index of an antenna array, built once per catalogue"""
+
+from __future__ import print_function
+
+import hashlib
+import os
+
+import numpy as np
+
+from .sidecar import write as write_sidecar
+
+# Bump when the layout of the '.baselines.npz' sidecar changes
+SIDECAR_VERSION = 1
+COLUMNS = ['ant1', 'ant2', 'xyz', 'enu']
+# Largest sidecar written [bytes], bigger tables are built on every read
+MAX_SIDECAR_BYTES = 2**28
+
+
+class BaselineTable(object):
+    """
+    Antenna pair indices and baseline vectors of an array as numpy arrays.
+
+    Baselines run from ant1 to ant2 with ant1 < ant2, vectors are
+    position[ant2] - position[ant1] in geocentric XYZ and, when the array
+    reference location is known, local ENU coordinates.
+    """
+
+    def __init__(
+                 self,
+                 ant1,       # (nbl,) first antenna index
+                 ant2,       # (nbl,) second antenna index
+                 xyz,        # (nbl, 3) geocentric baseline vectors [m]
+                 enu=None,   # (nbl, 3) local ENU baseline vectors [m]
+                 nants=None,  # nr of antennas indexed by ant1/ant2
+                ):
+        self.ant1 = np.asarray(ant1, dtype=np.int32)
+        self.ant2 = np.asarray(ant2, dtype=np.int32)
+        self.xyz = np.asarray(xyz, dtype=float).reshape(-1, 3)
+        self.enu = None if enu is None else np.asarray(enu, dtype=float).reshape(-1, 3)  # noqa
+        if nants is None:
+            nants = int(self.ant2.max()) + 1 if self.ant2.size else 0
+        self.nants = nants
+
+    @classmethod
+    def from_positions(
+                       cls,
+                       xyz,             # (nants, 3) geocentric positions [m]
+                       enu=None,        # (nants, 3) local ENU positions [m]
+                       autocorr=False,  # include zero length baselines
+                      ):
+        """Baselines between all antenna pairs."""
+        xyz = np.asarray(xyz, dtype=float).reshape(-1, 3)
+        nants = xyz.shape[0]
+        ant1, ant2 = np.triu_indices(nants, k=0 if autocorr else 1)
+        if enu is not None:
+            enu = np.asarray(enu, dtype=float)
+            enu = enu[ant2] - enu[ant1]
+        return cls(ant1, ant2, xyz[ant2] - xyz[ant1], enu=enu, nants=nants)
+
+    @classmethod
+    def from_array(cls, array):
+        """Baselines of an AntennaArray, with ENU vectors if it has a reference location."""  # noqa
+        enu = array.enu if array.ref_location is not None else None
+        return cls.from_positions(array.xyz, enu=enu)
+
+    def __len__(self):
+        return self.ant1.size
+
+    @property
+    def length(self):
+        """Baseline lengths [m]."""
+        return np.sqrt(np.einsum('ij,ij->i', self.xyz, self.xyz))
+
+    @property
+    def nbytes(self):
+        """Size of the table columns [bytes]."""
+        return sum(getattr(self, col).nbytes for col in COLUMNS if getattr(self, col) is not None)  # noqa
+
+    @property
+    def azimuth(self):
+        """Baseline azimuth east of north [deg] from the ENU vectors."""
+        if self.enu is None:
+            raise RuntimeError('Array reference location needed for baseline azimuths')  # noqa
+        return np.rad2deg(np.arctan2(self.enu[:, 0], self.enu[:, 1])) % 360.
+
+    def take(self, indices):
+        """
+        Baselines among the antennas at indices, numbered in the given order.
+
+        Baselines of which the antennas swap order are reversed, so that
+        ant1 < ant2 still holds.
+        """
+        indices = np.asarray(indices, dtype=int)
+        position = np.full(self.nants, -1, dtype=int)
+        position[indices] = np.arange(indices.size)
+        ant1 = position[self.ant1]
+        ant2 = position[self.ant2]
+        rows = np.nonzero((ant1 >= 0) & (ant2 >= 0))[0]
+        ant1 = ant1[rows]
+        ant2 = ant2[rows]
+        sign = np.where(ant1 < ant2, 1., -1.)[:, np.newaxis]
+        subset = BaselineTable(
+                               np.minimum(ant1, ant2),
+                               np.maximum(ant1, ant2),
+                               self.xyz[rows]*sign,
+                               enu=None if self.enu is None else self.enu[rows]*sign,  # noqa
+                               nants=indices.size,
+                              )
+        subset.rows = rows
+        return subset
+
+    def select(self, mask):
+        """Baselines among the antennas where mask is True."""
+        return self.take(np.nonzero(np.asarray(mask, dtype=bool))[0])
+
+    def save(self, npzfile, **keywords):
+        """Write the table to an npz file, replaced in a single rename."""
+        columns = dict((col, getattr(self, col)) for col in COLUMNS if getattr(self, col) is not None)  # noqa
+        columns.update(keywords)
+        return write_sidecar(npzfile, nants=self.nants, **columns)
+
+
+# Digest of the antenna positions a baseline table was built from
+def positions_digest(array):
+    digest = hashlib.sha1(np.ascontiguousarray(array.xyz, dtype=float).tostring())  # noqa
+    if array.ref_location is not None:
+        ref_xyz = [coord.value for coord in array.ref_location.to_geocentric()]
+        digest.update(np.array(ref_xyz, dtype=float).tostring())
+    return digest.hexdigest()
+
+
+def read(
+         ant_pos_file,  # antenna catalogue the array was read from
+         array,         # AntennaArray of all antennas in the catalogue
+         sidecar=True,  # read/write '<ant_pos_file>.baselines.npz'
+        ):
+    """BaselineTable of the catalogue array, reusing a binary sidecar."""
+    npzfile = '%s.baselines.npz' % ant_pos_file
+    digest = positions_digest(array)
+    if sidecar and os.path.isfile(npzfile):
+        try:
+            cached = np.load(npzfile)
+            if (cached['version'] == SIDECAR_VERSION and
+                    str(cached['digest']) == digest):
+                return BaselineTable(
+                                     cached['ant1'],
+                                     cached['ant2'],
+                                     cached['xyz'],
+                                     enu=cached['enu'] if 'enu' in cached.files else None,  # noqa
+                                     nants=int(cached['nants']),
+                                    )
+        except (IOError, KeyError, ValueError):
+            pass  # unreadable sidecar, build the table again
+
+    table = BaselineTable.from_array(array)
+    if sidecar and table.nbytes > MAX_SIDECAR_BYTES:
+        print('Baseline table of %s not cached: %d MB sidecar too large' % (ant_pos_file, table.nbytes//2**20))  # noqa
+    elif sidecar:
+        try:
+            table.save(npzfile, version=SIDECAR_VERSION, digest=digest)
+        except (IOError, OSError):
+            pass  # read-only location, build again next time
+    return table
+
+# -fin-
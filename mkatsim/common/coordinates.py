@@ -2,11 +2,76 @@
 
 from __future__ import print_function
 
-from astropy import units as u
-from astropy.coordinates import Longitude, Latitude, EarthLocation
-
+import numpy as np
+import os
 import string
 
+from .antennas import AntennaArray
+from .sidecar import write as write_sidecar
+
+# Bump when the layout of the '.npz' antenna sidecar changes
+SIDECAR_VERSION = 1
+
+
+# Parse whole antenna position file into arrays, reusing a binary sidecar
+def read_arrays(
+                ant_pos_file,  # Antenna coord file
+                sidecar=True,  # Read/write '<ant_pos_file>.npz' cache
+               ):
+    """
+    Read the 6 column antenna position file (ENU or ITRF) in one step.
+
+    Returns [names, coords, diameters, mounts] as numpy arrays, with coords
+    the (nants, 3) array of the first three columns as given in the file.
+    """
+    npzfile = '%s.npz' % ant_pos_file
+    stat = os.stat(ant_pos_file)
+    if sidecar and os.path.isfile(npzfile):
+        try:
+            cached = np.load(npzfile)
+            if (cached['version'] == SIDECAR_VERSION and
+                    cached['mtime'] == stat.st_mtime and
+                    cached['size'] == stat.st_size):
+                return [
+                        cached['names'],
+                        cached['coords'],
+                        cached['diameters'],
+                        cached['mounts'],
+                       ]
+        except (IOError, KeyError, ValueError):
+            pass  # unreadable sidecar, parse the source file
+
+    with open(ant_pos_file, 'r') as fin:
+        # ignore header line
+        fin.readline()
+        fields = fin.read().split()
+    if len(fields) % 6 > 0:
+        raise RuntimeError('Antenna position file %s needs 6 columns per line' % ant_pos_file)  # noqa
+    fields = np.array(fields).reshape(-1, 6)
+    coords = fields[:, :3].astype(float)
+    diameters = fields[:, 3].astype(float)
+    names = fields[:, 4]
+    mounts = fields[:, 5]
+    unique_names, counts = np.unique(names, return_counts=True)
+    if np.any(counts > 1):
+        raise RuntimeError('Duplicate antenna name: Exiting %s' % unique_names[counts > 1][0])  # noqa
+
+    if sidecar:
+        try:
+            write_sidecar(
+                          npzfile,
+                          version=SIDECAR_VERSION,
+                          mtime=stat.st_mtime,
+                          size=stat.st_size,
+                          names=names,
+                          coords=coords,
+                          diameters=diameters,
+                          mounts=mounts,
+                         )
+        except (IOError, OSError):
+            pass  # read-only location, parse again next time
+    return [names, coords, diameters, mounts]
+
 
 #Read antenna position file
 def read(
@@ -15,57 +80,35 @@ def read(
         antennas=None,  # CS list of selected antennas
         enu=False,      # Coord file has ENU coords
         ):
-    [x, y, z] = ref_location.to_geocentric()
-
-    fin = open(ant_pos_file, 'r')
-    # ignore header line
-    fin.readline()
-    data = fin.readlines()
-    fin.close()
-
-    array = {}
-    ant_list = []
-    for idx, line in enumerate(data):
-        if enu:
-            # ENU file
-            # E N U dish_diam station mount
-            [delta_North, delta_East, delta_Up, diameter, name, mount] = line.strip().split()
-            # Antenna location
-            if name in array:  # .has_key(name):
-                raise RuntimeError('Duplicate antenna name: Exiting %s' % name)
-            ant_location = EarthLocation((x.value+float(delta_North))*u.m, (y.value+float(delta_East))*u.m, (z.value+float(delta_Up))*u.m)
-        else:
-            # default assume ITRF coords
-            # X Y Z diameter station mount
-            [x, y, z, diameter, name, mount] = line.strip().split()
-            # Antenna location
-            if name in array:  # .has_key(name):
-                raise RuntimeError('Duplicate antenna name: Exiting %s' % name)
-            ant_location = EarthLocation((float(x))*u.m, (float(y))*u.m, (float(z))*u.m)
-        array[name] = ant_location
-
-        # Antenna list
-        ant_parms = {}
-        ant_parms['POSITION'] = [ant_location.x.value, ant_location.y.value, ant_location.z.value]
-        ant_parms['NAME'] = name
-        ant_parms['DISH_DIAMETER'] = float(diameter)
-        ant_list.append(ant_parms)
-
-    if antennas is None:
-        return [array, ant_list]
-
-    antennas = [string.lower(ant.strip()) for ant in antennas.split(',')]
-    subarray = {}
-    subant_list = []
-    for ant in ant_list:
-        if string.lower(ant['NAME']) in antennas:
-            subarray[ant['NAME']] = array[ant['NAME']]
-            subant_list.append(ant)
-    return [subarray, subant_list]
+    [names, coords, diameters, mounts] = read_arrays(ant_pos_file)
+    if enu:
+        # ENU file
+        # E N U dish_diam station mount
+        [x, y, z] = ref_location.to_geocentric()
+        positions = coords + np.array([x.value, y.value, z.value])
+    else:
+        # default assume ITRF coords
+        # X Y Z diameter station mount
+        positions = coords
+
+    array = AntennaArray(
+                         names,
+                         positions,
+                         diameters=diameters,
+                         mounts=mounts,
+                         ref_location=ref_location,
+                         catalog=ant_pos_file,
+                        )
+    if antennas is not None:
+        antennas = [string.lower(ant.strip()) for ant in antennas.split(',')]
+        array = array.select(np.in1d(np.char.lower(names), antennas))
+    return [array, array.ant_list()]
 
 
 # Telescope reference position
 def location(lat, lon, alt):
+    from astropy import units as u
+    from astropy.coordinates import Longitude, Latitude, EarthLocation
 
     # Reference location
     lon = Longitude(lon.strip(), u.degree, wrap_angle=180*u.degree, copy=False)  # noqa
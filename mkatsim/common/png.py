@@ -0,0 +1,36 @@
+"""Write RGBA images straight to PNG files, without matplotlib"""
+
+from __future__ import print_function
+
+import struct
+import zlib
+
+import numpy as np
+
+# zlib level of the PNG writer, favour speed over file size
+COMPRESSION = 1
+
+
+# PNG chunk with its length and CRC
+def _chunk(tag, payload):
+    return struct.pack('>I', len(payload)) + tag + payload + struct.pack('>I', zlib.crc32(tag + payload) & 0xffffffff)  # noqa
+
+
+def write_rgba_png(
+                   rgba,                     # (ny, nx, 4) uint8, first row at the top  # noqa
+                   filename,
+                   compression=COMPRESSION,  # zlib level
+                  ):
+    """Write an RGBA image to a PNG file."""
+    [ny, nx] = rgba.shape[:2]
+    # every scanline starts with filter type 0 (none)
+    raw = np.zeros((ny, 1 + 4*nx), dtype=np.uint8)
+    raw[:, 1:] = rgba.reshape(ny, 4*nx)
+    with open(filename, 'wb') as fout:
+        fout.write(b'\x89PNG\r\n\x1a\n')
+        fout.write(_chunk(b'IHDR', struct.pack('>IIBBBBB', nx, ny, 8, 6, 0, 0, 0)))  # noqa
+        fout.write(_chunk(b'IDAT', zlib.compress(raw.tostring(), compression)))
+        fout.write(_chunk(b'IEND', b''))
+    return filename
+
+# -fin-
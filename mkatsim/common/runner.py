@@ -0,0 +1,290 @@
+"""Run external tools concurrently from a single thread"""
+
+from __future__ import print_function
+
+import errno
+import os
+import select
+import subprocess
+import sys
+import time
+
+# Max wait [sec] between checks of the running tools
+POLL_INTERVAL = 0.1
+# Bytes of stderr kept per tool for error messages
+STDERR_TAIL = 2**16
+# Lines of stderr quoted in error messages
+ERROR_LINES = 20
+
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+
+
+class ToolError(RuntimeError):
+    """An external tool failed or timed out, the task is in .task"""
+
+
+class Task(object):
+    """External tool run, started once the tasks it runs after are done"""
+
+    def __init__(
+                 self,
+                 name,          # unique task name, prefix of streamed stderr
+                 cmd,           # command line as a list of arguments
+                 after=(),      # names of the tasks that must finish first
+                 timeout=None,  # max run time [sec], None for no limit
+                 cwd=None,      # working directory of the tool
+                ):
+        self.name = name
+        self.cmd = [str(arg) for arg in cmd]
+        self.after = list(after)
+        self.timeout = timeout
+        self.cwd = cwd
+        self.state = PENDING
+        self.returncode = None
+        self.stderr = b''
+        self.elapsed = None
+        self.timed_out = False
+        self.cause = None  # task that got this one cancelled
+        self.proc = None
+        self._start = None
+        self._line = b''   # stderr up to the next newline, for streaming
+
+    def __repr__(self):
+        return '<Task %s %s>' % (self.name, self.state)
+
+
+# Error message with the command line and the tail of its stderr
+def _message(task):
+    if task.timed_out:
+        reason = 'timed out after %g sec' % task.timeout
+    elif task.returncode is None:
+        reason = 'could not be started'
+    else:
+        reason = 'failed with exit status %d' % task.returncode
+    lines = task.stderr.decode('utf-8', 'replace').rstrip().splitlines()[-ERROR_LINES:]  # noqa
+    message = '%s %s: %s' % (task.name, reason, ' '.join(task.cmd))
+    if lines:
+        message += '\n' + '\n'.join('    %s' % line for line in lines)
+    if not isinstance(message, str):
+        # python 2 exceptions print as encoded text
+        message = message.encode('utf-8')
+    return message
+
+
+class Runner(object):
+    """
+    Run external tools as child processes, up to jobs at a time.
+
+    One thread waits on the stderr pipes of all running tools with select.
+    stderr is captured, and streamed line by line with the task name as
+    prefix.  A failed tool cancels the tasks that run after it; with
+    fail_fast no new tools are started and the running ones are
+    terminated, so that the run stops at the first failure.
+    """
+
+    def __init__(
+                 self,
+                 jobs=1,           # max nr of tools running at once
+                 timeout=None,     # default max run time per tool [sec]
+                 stream=True,      # copy stderr to stream as it arrives
+                 fail_fast=True,   # stop all tasks at the first failure
+                 stream_to=None,   # default sys.stderr
+                ):
+        self.jobs = max(int(jobs), 1)
+        self.timeout = timeout
+        self.stream = stream
+        self.fail_fast = fail_fast
+        self.stream_to = stream_to
+        self.tasks = {}
+        self.order = []
+
+    def add(
+            self,
+            name,
+            cmd,
+            after=(),
+            timeout=None,  # default the timeout of the runner
+            cwd=None,
+           ):
+        """Add a task, the tasks it runs after must have been added first."""
+        if name in self.tasks:
+            raise RuntimeError('Duplicate task name %s' % name)
+        for dep in after:
+            if dep not in self.tasks:
+                raise RuntimeError('Task %s runs after unknown task %s' % (name, dep))  # noqa
+        task = Task(name, cmd, after=after, timeout=self.timeout if timeout is None else timeout, cwd=cwd)  # noqa
+        self.tasks[name] = task
+        self.order.append(name)
+        return task
+
+    def _tasks(self, *states):
+        return [self.tasks[name] for name in self.order if self.tasks[name].state in states]  # noqa
+
+    def _ready(self):
+        return [task for task in self._tasks(PENDING) if all(self.tasks[dep].state == DONE for dep in task.after)]  # noqa
+
+    def _start(self, task):
+        task.state = RUNNING
+        task._start = time.time()
+        try:
+            task.proc = subprocess.Popen(task.cmd, stderr=subprocess.PIPE, cwd=task.cwd, close_fds=True)  # noqa
+        except OSError as err:
+            task.stderr = str(err).encode('utf-8')
+            self._failed(task)
+
+    def _write(self, data):
+        fout = sys.stderr if self.stream_to is None else self.stream_to
+        if not isinstance(data, str):
+            # python 2 streams take encoded text
+            data = data.encode('utf-8')
+        fout.write(data)
+        fout.flush()
+
+    def _read(self, task):
+        try:
+            data = os.read(task.proc.stderr.fileno(), 2**16)
+        except OSError as err:
+            if err.errno == errno.EINTR:
+                return
+            raise
+        if not data:
+            task.proc.stderr.close()
+            if self.stream and task._line:
+                self._write(u'[%s] %s\n' % (task.name, task._line.decode('utf-8', 'replace')))  # noqa
+            task._line = b''
+            return
+        task.stderr = (task.stderr + data)[-STDERR_TAIL:]
+        if self.stream:
+            lines = (task._line + data).split(b'\n')
+            task._line = lines.pop()
+            for line in lines:
+                self._write(u'[%s] %s\n' % (task.name, line.decode('utf-8', 'replace')))  # noqa
+
+    def _finished(self, task, returncode):
+        task.returncode = returncode
+        task.elapsed = time.time() - task._start
+        if task.state == CANCELLED:
+            return
+        if returncode == 0 and not task.timed_out:
+            task.state = DONE
+        else:
+            self._failed(task)
+
+    def _cancel(self, task, cause):
+        task.cause = cause.name
+        if task.state == RUNNING:
+            task.proc.terminate()
+        task.state = CANCELLED
+
+    def _failed(self, task):
+        task.state = FAILED
+        if task.elapsed is None:
+            task.elapsed = time.time() - task._start
+        # everything that runs after the failed task, directly or not
+        failed = set([task.name])
+        for other in [self.tasks[name] for name in self.order]:
+            if other.state == PENDING and failed.intersection(other.after):
+                failed.add(other.name)
+                self._cancel(other, task)
+        if self.fail_fast:
+            for other in self._tasks(PENDING, RUNNING):
+                self._cancel(other, task)
+
+    def _wait(self, running):
+        now = time.time()
+        wait = POLL_INTERVAL
+        for task in running:
+            if task.timeout is not None:
+                wait = min(wait, max(task._start + task.timeout - now, 0.))
+        pipes = [task.proc.stderr for task in running if not task.proc.stderr.closed]  # noqa
+        if not pipes:
+            time.sleep(wait)
+            return []
+        try:
+            return select.select(pipes, [], [], wait)[0]
+        except select.error as err:
+            if err.args[0] == errno.EINTR:
+                return []
+            raise
+
+    # Running tools, and cancelled ones that have not exited yet
+    def _running(self):
+        return self._tasks(RUNNING) + [task for task in self._tasks(CANCELLED) if task.proc is not None and task.returncode is None]  # noqa
+
+    # Start ready tasks up to the jobs limit, returns the started tasks
+    def _start_ready(self):
+        started = []
+        for task in self._ready()[:max(self.jobs - len(self._tasks(RUNNING)), 0)]:  # noqa
+            self._start(task)
+            if task.state == RUNNING:
+                started.append(task)
+        return started
+
+    # Finish the tools that closed stderr and exited
+    def _reap(self, running):
+        for task in running:
+            if task.proc.stderr.closed:
+                returncode = task.proc.poll()
+                if returncode is not None:
+                    self._finished(task, returncode)
+
+    # Kill the tools that ran past their timeout
+    def _check_timeouts(self, running):
+        now = time.time()
+        for task in running:
+            if (task.state == RUNNING and task.timeout is not None and
+                    now - task._start > task.timeout):
+                task.timed_out = True
+                task.proc.kill()
+
+    # Leave no tool running, e.g. when interrupted by Ctrl-C
+    def _kill_all(self):
+        for task in self._tasks(RUNNING, CANCELLED):
+            if task.proc is not None and task.proc.poll() is None:
+                task.proc.kill()
+                task.proc.wait()
+
+    def run(self):
+        """Run all tasks, raise ToolError for the first failed tool."""
+        try:
+            while True:
+                running = self._running() + self._start_ready()
+                if not running:
+                    break
+                readable = self._wait(running)
+                for task in running:
+                    if task.proc.stderr in readable:
+                        self._read(task)
+                self._reap(running)
+                self._check_timeouts(running)
+        finally:
+            self._kill_all()
+
+        # tasks waiting on a failed task that were never started
+        for task in self._tasks(PENDING):
+            task.state = CANCELLED
+        failed = self._tasks(FAILED)
+        if failed:
+            error = ToolError(_message(failed[0]))
+            error.task = failed[0]
+            raise error
+        return [self.tasks[name] for name in self.order]
+
+
+def run(
+        cmd,           # command line as a list of arguments
+        timeout=None,  # max run time [sec]
+        cwd=None,
+        stream=True,   # copy stderr to sys.stderr as it arrives
+       ):
+    """Run a single tool, raise ToolError if it fails or times out."""
+    runner = Runner(timeout=timeout, stream=stream)
+    task = runner.add(os.path.basename(str(cmd[0])), cmd, cwd=cwd)
+    runner.run()
+    return task
+
+# -fin-
@@ -0,0 +1,40 @@
+"""Binary '.npz' sidecar files written next to antenna catalogues"""
+
+from __future__ import print_function
+
+import os
+import tempfile
+
+import numpy as np
+
+
+# File mode of new files under the current umask
+def _file_mode():
+    umask = os.umask(0)
+    os.umask(umask)
+    return 0o666 & ~umask
+
+
+def write(
+          npzfile,   # sidecar file name
+          **arrays   # arrays stored in the npz file
+         ):
+    """
+    Write arrays to an npz file, replaced in a single rename.
+
+    The file is written to a temporary file next to npzfile first, so that
+    concurrent readers never see a partially written sidecar.  Temporary
+    files are private, the mode is set to that of any new file before the
+    rename so that other users can share the sidecar.
+    """
+    with tempfile.NamedTemporaryFile(dir=os.path.dirname(os.path.abspath(npzfile)), suffix='.npz', delete=False) as fout:  # noqa
+        try:
+            np.savez(fout, **arrays)
+            os.chmod(fout.name, _file_mode())
+        except BaseException:
+            os.remove(fout.name)
+            raise
+    os.rename(fout.name, npzfile)
+    return npzfile
+
+# -fin-
@@ -1,6 +1,7 @@
 from optparse import OptionGroup
 
 from ..common import option
+from . import cache
 from .main import main
 
 
@@ -46,6 +47,15 @@ Antenna table name, else ANTENNA table will be generated')
                      default=None,
                      help='\
 Name of the measurement set to create')
+    group.add_option('--simulator',
+                     action='store',
+                     dest='simulator',
+                     type='choice',
+                     choices=['makems', 'native'],
+                     default='makems',
+                     help='\
+Simulate with makems per scan, or compute all UVW tracks in-process \
+and write a single measurement set (default %default)')
     group.add_option('--stime',
                      action='store',
                      dest='stime',
@@ -212,6 +222,105 @@ Set the min/max uv distance in lambda (--minuv-l <lambda>).')
 Only make the psf, no images are made.')
     parser.add_option_group(group)
 
+    # pipeline options
+    group = OptionGroup(parser, 'Pipeline Options')
+    group.add_option('--imager',
+                     action='store',
+                     dest='imager',
+                     type='choice',
+                     choices=['wsclean', 'native'],
+                     default='wsclean',
+                     help='\
+Make the PSF with wsclean, or grid and FFT the uv coverage in-process \
+(default %default)')
+    group.add_option('--jobs',
+                     action='store',
+                     dest='jobs',
+                     type=int,
+                     default=1,
+                     help='\
+Nr of declinations simulated in parallel, each in its own process \
+and working directory (default %default)')
+    group.add_option('--pipeline',
+                     action='store',
+                     dest='pipeline',
+                     type=str,
+                     default=None,
+                     metavar='SIM,IMAGE,POST',
+                     help='\
+Overlap the stages of a declination sweep, with separate pools of \
+SIM simulation, IMAGE imaging and POST post-processing processes, \
+e.g. 1,1,2')
+    group.add_option('--scan-jobs',
+                     action='store',
+                     dest='scan_jobs',
+                     type=int,
+                     default=1,
+                     help='\
+Nr of concurrent makems runs generating the scans of a declination \
+(default %default)')
+    group.add_option('--timeout',
+                     action='store',
+                     dest='timeout',
+                     type=float,
+                     default=None,
+                     help='\
+Max run time in seconds of every makems and wsclean run, the pipeline \
+stops when a tool fails or times out (default no limit)')
+    group.add_option('--no-cache',
+                     dest='no_cache',
+                     action='store_true',
+                     default=False,
+                     help='\
+Always simulate and image, do not reuse cached measurement sets and PSFs')
+    group.add_option('--cache-dir',
+                     action='store',
+                     dest='cache_dir',
+                     type=str,
+                     default=cache.DEFAULT_DIR,
+                     help='\
+Directory of the simulation product cache (default %default)')
+    group.add_option('--cache-size',
+                     action='store',
+                     dest='cache_size',
+                     type=float,
+                     default=cache.DEFAULT_SIZE,
+                     help='\
+Max size of the cache in GB, least recently used products are evicted \
+(default %default)')
+    group.add_option('--metrics',
+                     action='store',
+                     dest='metrics',
+                     type=str,
+                     default=None,
+                     help='\
+Write PSF metrics (FWHM, sidelobe levels, first null) of all simulated \
+PSFs to a CSV, or JSON (.json) table')
+    group.add_option('--metrics-size',
+                     action='store',
+                     dest='metrics_size',
+                     type=int,
+                     default=None,
+                     help='\
+Only use the central size x size pixels of every PSF for the metrics, \
+limiting their memory use on large images (default the whole image)')
+    group.add_option('--report',
+                     action='store',
+                     dest='report',
+                     type=str,
+                     default=None,
+                     help='\
+Write wall time, CPU time, peak memory and bytes written per pipeline \
+stage and declination to a JSON file')
+    group.add_option('--profile',
+                     dest='profile',
+                     action='store_true',
+                     default=False,
+                     help='\
+Run every pipeline stage under cProfile and write a \
+<array>_<stage>_<declination>.prof dump per stage')
+    parser.add_option_group(group)
+
     # PSF slice options
     group = OptionGroup(parser, 'PSF slice')
     group.add_option('--beamwidth',
@@ -225,6 +334,13 @@ Only make the psf, no images are made.')
                      action='store_true',
                      default=False,
                      help='Crop the PSF to size')
+    group.add_option('--fast-png',
+                     dest='fast_png',
+                     action='store_true',
+                     default=False,
+                     help='\
+Write the PSF PNGs at full resolution through a colormap lookup table, \
+without a matplotlib figure or colorbar labels')
     parser.add_option_group(group)
     (opts, args) = parser.parse_args()
 
@@ -236,7 +352,7 @@ Only make the psf, no images are made.')
         print('Simulations using multiple antenna position files not supported currently')  # noqa
         parser.print_usage()
         raise SystemExit
-    if opts.cfg is None and not opts.ant_table:
+    if opts.cfg is None and not opts.ant_table and opts.simulator == 'makems':
         print('Cannot simulate PSF: Need makems config file')
         parser.print_usage()
         raise SystemExit
@@ -265,10 +381,14 @@ Only make the psf, no images are made.')
     # ensure that (ra,dec) coordinates in correct format for makems
     from astropy.coordinates import SkyCoord
     from astropy import units as u
-    coord_str = '%s %s' % (opts.rightascension, opts.declination)
-    c = SkyCoord(coord_str, unit=(u.hourangle, u.deg))
+    # a comma separated list of declinations gives a declination sweep
+    declinations = []
+    for declination in opts.declination.split(','):
+        coord_str = '%s %s' % (opts.rightascension, declination.strip())
+        c = SkyCoord(coord_str, unit=(u.hourangle, u.deg))
+        declinations.append('%.3fdeg' % c.dec.deg)
     opts.rightascension = '%.3fdeg' % c.ra.deg
-    opts.declination = '%.3fdeg' % c.dec.deg
+    opts.declination = ','.join(declinations)
 
     main(parser, opts, args)
 
@@ -0,0 +1,167 @@
+"""Content addressed cache for simulated measurement sets and PSF images"""
+
+from __future__ import print_function
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+DEFAULT_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'mkatsim')
+DEFAULT_SIZE = 10.  # GB
+TMP_PREFIX = '.tmp-'
+
+
+# Hash of any JSON serialisable description of a product
+def key(*items):
+    text = json.dumps(items, sort_keys=True, default=str)
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+# Hash of all file contents below a path, e.g. a CASA table directory
+def tree_digest(
+                path,
+                exclude=('table.lock',),  # volatile files to ignore
+               ):
+    digest = hashlib.sha1()
+    if os.path.isfile(path):
+        paths = [path]
+    else:
+        paths = []
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            paths.extend(os.path.join(root, name) for name in sorted(files) if name not in exclude)  # noqa
+    for filename in paths:
+        digest.update(os.path.relpath(filename, path).encode('utf-8'))
+        with open(filename, 'rb') as fin:
+            for block in iter(lambda: fin.read(2**20), b''):
+                digest.update(block)
+    return digest.hexdigest()
+
+
+# Disk usage of a file or directory tree in bytes
+def disk_usage(path):
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    size = 0
+    for root, dirs, files in os.walk(path):
+        for name in files:
+            try:
+                size += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass  # removed by a concurrent eviction
+    return size
+
+
+def _remove(path):
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path, ignore_errors=True)
+    elif os.path.lexists(path):
+        os.remove(path)
+
+
+def _copy(src, dst):
+    _remove(dst)
+    if os.path.isdir(src):
+        shutil.copytree(src, dst)
+    else:
+        shutil.copy2(src, dst)
+
+
+class Cache(object):
+    """
+    Store of simulation products, one directory per key.
+
+    The least recently used entries are evicted once the total size of
+    the cache exceeds maxsize.
+    """
+
+    def __init__(
+                 self,
+                 cachedir=DEFAULT_DIR,
+                 maxsize=DEFAULT_SIZE,  # GB
+                 verbose=False,
+                ):
+        self.cachedir = cachedir
+        self.maxsize = int(maxsize*2**30)
+        self.verbose = verbose
+        if not os.path.isdir(self.cachedir):
+            try:
+                os.makedirs(self.cachedir)
+            except OSError:
+                if not os.path.isdir(self.cachedir):
+                    raise
+
+    def _entry(self, key):
+        return os.path.join(self.cachedir, key)
+
+    def fetch(self, key, dest='.'):
+        """Copy the products stored under key into dest, None on a miss."""
+        entry = self._entry(key)
+        if not os.path.isdir(entry):
+            return None
+        products = []
+        try:
+            for name in sorted(os.listdir(entry)):
+                _copy(os.path.join(entry, name), os.path.join(dest, name))
+                products.append(os.path.join(dest, name))
+            # mark as recently used
+            os.utime(entry, None)
+        except (IOError, OSError):
+            # evicted while copying
+            return None
+        if self.verbose:
+            print('Cache hit %s: %s' % (key, ', '.join(products)))
+        return products
+
+    def store(self, key, paths):
+        """Copy the product files or directories in paths into the cache."""
+        entry = self._entry(key)
+        if os.path.isdir(entry):
+            os.utime(entry, None)
+            return
+        tmpdir = tempfile.mkdtemp(prefix=TMP_PREFIX, dir=self.cachedir)
+        try:
+            for path in paths:
+                _copy(path, os.path.join(tmpdir, os.path.basename(path)))
+            os.rename(tmpdir, entry)
+        except OSError:
+            # stored concurrently by another process
+            if not os.path.isdir(entry):
+                raise
+        finally:
+            _remove(tmpdir)
+        self.evict()
+
+    def evict(self):
+        """Remove least recently used entries until within maxsize."""
+        entries = []
+        total = 0
+        for name in os.listdir(self.cachedir):
+            entry = os.path.join(self.cachedir, name)
+            if name.startswith(TMP_PREFIX) or not os.path.isdir(entry):
+                continue
+            size = disk_usage(entry)
+            entries.append((os.path.getmtime(entry), size, entry))
+            total += size
+        for mtime, size, entry in sorted(entries):
+            if total <= self.maxsize:
+                break
+            if self.verbose:
+                print('Cache evict %s' % entry)
+            _remove(entry)
+            total -= size
+
+
+# Cache selected by the mkspsf options, None if caching is disabled
+def from_opts(opts):
+    if opts.no_cache:
+        return None
+    return Cache(
+                 cachedir=opts.cache_dir,
+                 maxsize=opts.cache_size,
+                 verbose=opts.debug,
+                )
+
+# -fin-
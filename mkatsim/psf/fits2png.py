@@ -1,7 +1,6 @@
 """Convert fits file to .png file with useful contrast scaling options."""
 
 import matplotlib.pyplot as plt
-from matplotlib.colors import BoundaryNorm
 from matplotlib import ticker
 import numpy as np
 import math
@@ -12,6 +11,8 @@ GOOD_PIXEL = 0
 BAD_PIXEL = 1
 KREJ = 2.5
 MAX_ITERATIONS = 5
+# Max nr of channel planes held in memory per render task
+RENDER_CHUNK = 16
 
 def zscale(
            image,
@@ -27,35 +28,45 @@ def zscale(
     image is a 2-d numpy array
     returns (z1, z2)
     """
-    # Sample the image 
-    samples = zsc_sample(image, nsamples, bpmask, zmask)
-    npix = len(samples)
-    samples.sort()
-    zmin = samples[0]
-    zmax = samples[-1]
+    z1, z2 = zscale_cube(image[np.newaxis], nsamples=nsamples, contrast=contrast)
+    return z1[0], z2[0]
+
+def zscale_cube(
+                cube,
+                nsamples = 1000,
+                contrast = 0.5,
+               ):
+    """
+    IRAF zscale of every plane in a cube, all planes processed together
+    cube is a 3-d (nplanes, ny, nx) numpy or masked array
+    NaN and masked pixels are not sampled
+    returns (z1, z2) arrays with a value per plane
+    """
+    # Sample the planes, invalid samples are sorted to the end
+    samples = zsc_sample(cube, nsamples)
+    samples.sort(axis=1)
+    nplanes = samples.shape[0]
+    planes = np.arange(nplanes)
+    npix = np.isfinite(samples).sum(axis=1)
+    zmin = samples[:, 0]
+    zmax = samples[planes, np.maximum(npix - 1, 0)]
     # For a zero-indexed array 
-    center_pixel = (npix - 1) // 2
-    if npix%2 == 1:
-        median = samples[center_pixel]
-    else:
-        median = 0.5 * (samples[center_pixel] + samples[center_pixel + 1])
+    center_pixel = np.maximum((npix - 1) // 2, 0)
+    upper_pixel = np.minimum(center_pixel + 1 - npix%2, np.maximum(npix - 1, 0))
+    median = 0.5 * (samples[planes, center_pixel] + samples[planes, upper_pixel])
 
     # Fit a line to the sorted array of samples
-    minpix = max(MIN_NPIXELS, int(npix * MAX_REJECT))
-    ngrow = max (1, int (npix * 0.01))
+    minpix = np.maximum(MIN_NPIXELS, (npix * MAX_REJECT).astype(int))
+    ngrow = np.maximum(1, (npix * 0.01).astype(int))
     ngoodpix, zstart, zslope = zsc_fit_line (samples, npix, KREJ, ngrow, MAX_ITERATIONS)
 
-    if ngoodpix < minpix:
-        z1 = zmin
-        z2 = zmax
-    else:
-        if contrast > 0: zslope = zslope / contrast
-        z1 = max (zmin, median - (center_pixel - 1) * zslope)
-        z2 = min (zmax, median + (npix - center_pixel) * zslope)
+    if contrast > 0: zslope = zslope / contrast
+    z1 = np.where(ngoodpix < minpix, zmin, np.maximum(zmin, median - (center_pixel - 1) * zslope))
+    z2 = np.where(ngoodpix < minpix, zmax, np.minimum(zmax, median + (npix - center_pixel) * zslope))
     return z1, z2
 
 def zsc_sample(
-               image,
+               cube,
                maxpix,
                bpmask=None,
                zmask=None,
@@ -63,16 +74,36 @@ def zsc_sample(
 
     """
     Figure out which pixels to use for the zscale algorithm
-    Returns the 1-d array samples
+    Returns the 2-d (nplanes, maxpix) array of samples, NaN if not valid
     Don't worry about the bad pixel mask or zmask for the moment
     """
     # Sample in a square grid, and return the first maxpix in the sample
-    nc = image.shape[0]
-    nl = image.shape[1]
+    nc = cube.shape[1]
+    nl = cube.shape[2]
     stride = max (1.0, math.sqrt((nc - 1) * (nl - 1) / float(maxpix)))
     stride = int (stride)
-    samples = image[::stride,::stride].flatten()
-    return samples[:maxpix]
+    samples = np.ma.filled(cube[:, ::stride, ::stride], np.nan)
+    samples = np.array(samples.reshape(cube.shape[0], -1)[:, :maxpix], dtype=float)
+    samples[~np.isfinite(samples)] = np.nan
+    return samples
+
+def zsc_grow(
+             badpix,
+             ngrow,
+            ):
+    """
+    Flag all pixels within a window of length ngrow around a bad pixel
+    Same as a convolution of every row of badpix with np.ones(ngrow)
+    ngrow is an array with a window length per row
+    """
+    npix = badpix.shape[1]
+    counts = np.zeros((badpix.shape[0], npix + 1), dtype="int32")
+    np.cumsum(badpix, axis=1, out=counts[:, 1:])
+    index = np.arange(npix)
+    start = np.clip(index - (ngrow//2)[:, np.newaxis], 0, npix)
+    stop = np.clip(index + ((ngrow - 1)//2)[:, np.newaxis] + 1, 0, npix)
+    rows = np.arange(badpix.shape[0])[:, np.newaxis]
+    return (counts[rows, stop] - counts[rows, start]) > 0
 
 def zsc_fit_line(
                  samples,
@@ -81,59 +112,60 @@ def zsc_fit_line(
                  ngrow,
                  maxiter,
                 ):
+    """
+    Fit straight lines to the rows of sorted samples with k-sigma clipping
+    samples is a 2-d array with the npix valid samples of each row first
+    """
     # First re-map indices from -1.0 to 1.0
-    xscale = 2.0 / (npix - 1)
-    xnorm = np.arange(npix)
-    xnorm = xnorm * xscale - 1.0
+    xscale = 2.0 / np.maximum(npix - 1, 1)
+    xnorm = np.arange(samples.shape[1]) * xscale[:, np.newaxis] - 1.0
+    valid = np.arange(samples.shape[1]) < npix[:, np.newaxis]
+    samples = np.where(valid, samples, 0.)
 
-    ngoodpix = npix
-    minpix = max (MIN_NPIXELS, int (npix*MAX_REJECT))
-    last_ngoodpix = npix + 1
+    ngoodpix = npix.copy()
+    minpix = np.maximum(MIN_NPIXELS, (npix*MAX_REJECT).astype(int))
+    intercept = np.zeros(npix.shape)
+    slope = np.zeros(npix.shape)
 
-    # This is the mask used in k-sigma clipping.  0 is good, 1 is bad
-    badpix = np.zeros(npix, dtype="int32")
+    # This is the mask used in k-sigma clipping.  True is bad
+    badpix = ~valid
 
-    #  Iterate
+    #  Iterate, rows stop once too few good pixels are left
+    active = np.ones(npix.shape, dtype=bool)
     for niter in range(maxiter):
-        if (ngoodpix >= last_ngoodpix) or (ngoodpix < minpix):
+        active &= ngoodpix >= minpix
+        if not active.any():
             break
 
-        # Accumulate sums to calculate straight line fit
-        goodpixels = np.where(badpix == GOOD_PIXEL)
-        sumx = xnorm[goodpixels].sum()
-        sumxx = (xnorm[goodpixels]*xnorm[goodpixels]).sum()
-        sumxy = (xnorm[goodpixels]*samples[goodpixels]).sum()
-        sumy = samples[goodpixels].sum()
-        sum = len(goodpixels[0])
+        # Accumulate masked sums to calculate straight line fit
+        good = ~badpix
+        sumx = np.where(good, xnorm, 0.).sum(axis=1)
+        sumxx = np.where(good, xnorm*xnorm, 0.).sum(axis=1)
+        sumxy = np.where(good, xnorm*samples, 0.).sum(axis=1)
+        sumy = np.where(good, samples, 0.).sum(axis=1)
+        sum = good.sum(axis=1)
 
         delta = sum * sumxx - sumx * sumx
+        delta = np.where(delta != 0, delta, 1.)
         # Slope and intercept
-        intercept = (sumxx * sumy - sumx * sumxy) / delta
-        slope = (sum * sumxy - sumx * sumy) / delta
+        intercept = np.where(active, (sumxx * sumy - sumx * sumxy) / delta, intercept)
+        slope = np.where(active, (sum * sumxy - sumx * sumy) / delta, slope)
 
         # Subtract fitted line from the data array
-        fitted = xnorm*slope + intercept
+        fitted = xnorm*slope[:, np.newaxis] + intercept[:, np.newaxis]
         flat = samples - fitted
 
         # Compute the k-sigma rejection threshold
-        ngoodpix, mean, sigma = zsc_compute_sigma (flat, badpix, npix)
+        ngood, mean, sigma = zsc_compute_sigma (flat, badpix)
         threshold = sigma * krej
 
-        # Detect and reject pixels further than k*sigma from the fitted line
-        lcut = -threshold
-        hcut = threshold
-        below = np.where(flat < lcut)
-        above = np.where(flat > hcut)
-
-        badpix[below] = BAD_PIXEL
-        badpix[above] = BAD_PIXEL
-
-        # Convolve with a kernel of length ngrow
-        kernel = np.ones(ngrow,dtype="int32")
-        badpix = np.convolve(badpix, kernel, mode='same')
+        # Reject pixels further than k*sigma from the fitted line, and grow
+        # the rejected regions with a window of length ngrow
+        reject = np.abs(flat) > threshold[:, np.newaxis]
+        grown = zsc_grow(badpix | (reject & valid), ngrow)
+        badpix = np.where(active[:, np.newaxis], grown & valid, badpix) | ~valid
 
-        ngoodpix = len(np.where(badpix == GOOD_PIXEL)[0])
-        niter += 1
+        ngoodpix = np.where(active, (~badpix).sum(axis=1), ngoodpix)
 
     # Transform the line coefficients back to the X range [0:npix-1]
     zstart = intercept - slope
@@ -144,31 +176,20 @@ def zsc_fit_line(
 def zsc_compute_sigma(
                       flat,
                       badpix,
-                      npix,
                      ):
     """
-    Compute the rms deviation from the mean of a flattened array.
+    Compute the rms deviation from the mean of the rows of a flattened array.
     Ignore rejected pixels
     """
 
     # Accumulate sum and sum of squares
-    goodpixels = np.where(badpix == GOOD_PIXEL)
-    sumz = flat[goodpixels].sum()
-    sumsq = (flat[goodpixels]*flat[goodpixels]).sum()
-    ngoodpix = len(goodpixels[0])
-    if ngoodpix == 0:
-        mean = None
-        sigma = None
-    elif ngoodpix == 1:
-        mean = sumz
-        sigma = None
-    else:
-        mean = sumz / ngoodpix
-        temp = sumsq / (ngoodpix - 1) - sumz*sumz / (ngoodpix * (ngoodpix - 1))
-        if temp < 0:
-            sigma = 0.0
-        else:
-            sigma = math.sqrt (temp)
+    good = ~badpix
+    sumz = np.where(good, flat, 0.).sum(axis=1)
+    sumsq = np.where(good, flat*flat, 0.).sum(axis=1)
+    ngoodpix = good.sum(axis=1)
+    mean = sumz / np.maximum(ngoodpix, 1)
+    temp = sumsq / np.maximum(ngoodpix - 1, 1) - sumz*sumz / np.maximum(ngoodpix * (ngoodpix - 1), 1)
+    sigma = np.sqrt(np.maximum(temp, 0.0))
 
     return ngoodpix, mean, sigma
 
@@ -188,22 +209,140 @@ def get_background_variance(
     @return variance - Float: The final background variance in the sigma clipped image
     """
 
-    #Initialise diff and data_clip and mean and std
+    #Clip by masking, the data is not copied on every iteration
+    data = np.asanyarray(data).ravel()
+    keep = np.isfinite(np.ma.getdata(data)) & ~np.ma.getmaskarray(data)
+    values = np.where(keep, np.ma.getdata(data), 0.)
+    deviation = np.empty_like(values)
+    ngood = keep.sum()
+
+    #Initialise diff and mean
     diff = 1
-    mean = data.mean()
-    data_clip = data
+    mean = values.sum()/ngood
     while diff > tolerance:
-        data_clip = data_clip[np.abs(data_clip)<mean+sigma_clip*data_clip.std()]
-        newmean = data_clip.mean()
+        #rms about the mean of the pixels kept so far
+        np.subtract(values, mean, out=deviation)
+        deviation *= keep
+        std = np.sqrt(np.dot(deviation, deviation)/ngood)
+        keep &= np.abs(values) < mean+sigma_clip*std
+        values *= keep
+        ngood = keep.sum()
+        newmean = values.sum()/ngood
         diff = np.abs(mean-newmean)/(mean+newmean)
         mean = newmean
-    return np.var(data_clip)
+    np.subtract(values, mean, out=deviation)
+    deviation *= keep
+    return np.dot(deviation, deviation)/ngood
+
+def average_planes(
+                   cube,
+                   planes,
+                   window,
+                   weightaverage = False,
+                  ):
+    """
+    Weighted average of cube planes, reading one plane at a time.
+
+    @param cube          - Object: 3D (memmap) array of image planes
+    @param planes        - List: Indices of the planes to average
+    @param window        - Tuple: Slices of the area to average
+    @param weightaverage - Boolean: Weight the planes by their background variance
+
+    @return avdata - Object: 2D masked array, masked where no plane has a valid pixel
+    """
+    num = None
+    for plane in planes:
+        data = np.array(cube[plane][window], dtype=float)
+        valid = np.isfinite(data)
+        data[~valid] = 0.
+        # Use the variance as weight if the user askes for it
+        weight = 1.
+        if weightaverage==True : weight = get_background_variance(np.ma.masked_array(data, ~valid, copy=False))
+        if num is None:
+            num = np.zeros(data.shape)
+            den = np.zeros(data.shape)
+        data *= weight
+        num += data
+        den += weight*valid
+    valid = den != 0
+    num[valid] /= den[valid]
+    return np.ma.masked_array(num, ~valid)
+
+# Colormap lookup tables and colorbar strips, made once per process
+_LUTS = {}
+_COLORBARS = {}
+LUT_SIZE = 256
+COLORBAR_WIDTH = 16
+COLORBAR_GAP = 4
+
+def colormap_lut(cmap):
+    """
+    RGBA lookup table of a matplotlib colormap.
+
+    @param cmap - String: The matplotlib colormap name
+
+    @return lut - Object: (LUT_SIZE+1, 4) uint8 array, the last entry is the colour for bad pixels
+    """
+    if cmap not in _LUTS:
+        cmapin = plt.get_cmap(cmap)
+        lut = np.zeros((LUT_SIZE+1, 4), dtype=np.uint8)
+        lut[:LUT_SIZE] = cmapin(np.linspace(0., 1., LUT_SIZE), bytes=True)
+        lut[LUT_SIZE] = cmapin(np.ma.masked_invalid([np.nan]), bytes=True)[0]
+        _LUTS[cmap] = lut
+    return _LUTS[cmap]
+
+def colorbar_strip(cmap, height):
+    """
+    Unlabelled colorbar strip, highest value at the top, with a transparent gap on the left.
+    """
+    key = (cmap, height)
+    if key not in _COLORBARS:
+        lut = colormap_lut(cmap)[:LUT_SIZE]
+        strip = np.zeros((height, COLORBAR_GAP+COLORBAR_WIDTH, 4), dtype=np.uint8)
+        index = np.linspace(LUT_SIZE-1, 0, height).astype(int)
+        strip[:, COLORBAR_GAP:] = lut[index][:, np.newaxis]
+        _COLORBARS[key] = strip
+    return _COLORBARS[key]
+
+def write_png_fast(
+                   data,
+                   filename,
+                   limits,
+                   cmap='jet',
+                   colorbar=True,
+                  ):
+    """
+    Write a 2D array of data to a PNG, one image pixel per data pixel, using a colormap lookup table.
+
+    @param data     - Object: 2D numpy or masked array of data values
+    @param filename - String: Name of output PNG file (.png will be appended to the name)
+    @param limits   - Tuple: The (lowcut, highcut) contrast limits
+    @param cmap     - String: The desired colourmap to be input to matplotlib
+    @param colorbar - Boolean: Add an unlabelled colorbar strip on the right
+
+    @return None
+    """
+    # absolute import, the module also runs as a standalone script
+    from mkatsim.common.png import write_rgba_png
+    lut = colormap_lut(cmap)
+    lowcut,highcut = limits
+    data = np.ma.filled(data, np.nan).astype(float)
+    scale = (LUT_SIZE-1)/float(highcut-lowcut) if highcut > lowcut else 0.
+    index = np.clip((data-lowcut)*scale + 0.5, 0, LUT_SIZE-1)
+    index[~np.isfinite(data)] = LUT_SIZE
+    # first data row at the bottom, as in the figure
+    rgba = lut[index[::-1].astype(np.intp)]
+    if colorbar:
+        rgba = np.concatenate((rgba, colorbar_strip(cmap, rgba.shape[0])), axis=1)
+    write_rgba_png(rgba, filename+'.png')
 
 def write_png(
              data,
              filename,
              contrast=0.05,
-             cmap='Jet',
+             cmap='jet',
+             limits=None,
+             fast=False,
             ):
     """
     Write a 2D array of data to a PNG with contrast scaling.
@@ -212,20 +351,18 @@ def write_png(
     @param filename - String: Name of output PNG file (.png will be appended to the name)
     @param contrast - Float: Between 0 and 100 that selects the fraction of the pixel distribution to scale into the colormap
     @param cmap     - String: The desired colourmap to be input to matplotlib
+    @param limits   - Tuple: Precomputed (lowcut, highcut), else zscale of data
+    @param fast     - Boolean: Write the pixels through a colormap lookup table, no matplotlib figure
 
     @return None
     """
 
-    # Get grid size
-    # Make a grid for the x,y coordinate values (just an integer grid)- again this should be reworked one day for a full WCS treatment
-    y,x = np.mgrid[slice(1, data.shape[0]+1, 1), slice(1, data.shape[1]+1, 1)]
     # Get the values for the contrast scaling
-    lowcut,highcut = zscale(data,nsamples=100000,contrast=contrast)
-    # make a lookup table for colour scaling (todo- change the colour scaling from linear to other functions))
-    levels = np.linspace(lowcut,highcut, num=150)
-    # Colormap selection (todo- make the colormap a kwarg)
-    cmapin = plt.get_cmap(cmap)
-    norm = BoundaryNorm(levels, ncolors=cmapin.N, clip=True)  # noqa
+    if limits is None: limits = zscale(data,nsamples=100000,contrast=contrast)
+    if fast:
+        write_png_fast(data,filename,limits,cmap=cmap)
+        return
+    lowcut,highcut = limits
     im=plt.figure(figsize=(6,5))
     ax=im.add_subplot(111)
     image=plt.imshow(data,cmap=cmap)
@@ -233,14 +370,119 @@ def write_png(
     image.norm.vmax = highcut
     bar=plt.colorbar()
 
-    #Axis size
-    plt.axis([x.min(), x.max(), y.min(), y.max()])
+    #Axis size, pixel coordinates (just an integer grid)- again this should be reworked one day for a full WCS treatment
+    plt.axis([1, data.shape[1], 1, data.shape[0]])
     plt.axis('off')
     ax.set_aspect('equal')
     plt.tight_layout()
     plt.savefig(filename+'.png')
     plt.close(im)
 
+def fits2png_plan(
+                  fitsfilename,
+                  contrast = 0.03,
+                  cmap = 'jet',
+                  chans = 1,
+                  imchans = False,
+                  forceaverage = False,
+                  weightaverage = False,
+                  area = 0.5,
+                  chunk = None,
+                  fast = False,
+                 ):
+    """
+    Work out which PNG files fits2png writes for a FITS file.
+
+    Parameters are those of fits2png, and
+
+    @param chunk - Integer: Max nr of channel planes rendered per task, default all
+
+    @return tasks - List: [fitsfilename, outnames, planes, average, options] per render task
+    """
+    import os
+    import pyfits
+
+    #only the header is needed to plan the output
+    try:
+        imageheader = pyfits.getheader(fitsfilename)
+    except IOError:
+        raise RuntimeError('Cannot op file %s'%fitsfilename)
+
+    outname = os.path.splitext(fitsfilename)[0]
+    options = {'contrast':contrast, 'cmap':cmap, 'area':area, 'weightaverage':weightaverage, 'fast':fast}
+    allplanes = range(imageheader['NAXIS3'])
+
+    chan_range = chans
+    if not chan_range:
+        chan_range='1,'+str(len(allplanes))
+    chan_range = str(chan_range).split(',')
+    # Get the desired subset of the fits file to converty to png
+    if len(chan_range)==1: planes = allplanes[int(chan_range[0])-1:int(chan_range[0])]
+    else: planes = allplanes[int(chan_range[0])-1:int(chan_range[1])-1]
+    if len(planes) == 0:
+        raise RuntimeError('No channels %s in file %s'%(chans,fitsfilename))
+
+    # outputs in the order fits2png has always written them
+    outputs = []
+    if imchans==True or imageheader['CTYPE3'] != 'FREQ':
+        if len(chan_range)>1:
+            outputs.extend([[outname+'_'+str(num+int(chan_range[0]))],[plane],False] for num,plane in enumerate(planes))
+        else:
+            outputs.append([[outname],planes[:1],False])
+    if forceaverage==True or imageheader['CTYPE3'] == 'FREQ':
+        outputs.append([[outname],planes,True])
+
+    # a later output of the same name overwrote the earlier one
+    final = dict((output[0][0],idx) for idx,output in enumerate(outputs))
+    outputs = [output for idx,output in enumerate(outputs) if final[output[0][0]]==idx]
+
+    # group the single plane outputs into tasks of up to chunk planes
+    tasks = []
+    for [outnames,planes,average] in outputs:
+        if not average and tasks and not tasks[-1][3] and (chunk is None or len(tasks[-1][2])<chunk):
+            tasks[-1][1].extend(outnames)
+            tasks[-1][2].extend(planes)
+        else:
+            tasks.append([fitsfilename,list(outnames),list(planes),average,options])
+    return tasks
+
+def fits2png_render(task):
+    """
+    Write the PNG files of a render task from fits2png_plan.
+
+    @return outnames - List: The PNG files written, without the .png
+    """
+    import pyfits
+
+    [fitsfilename,outnames,planes,average,options] = task
+    try:
+        datahdu = pyfits.open(fitsfilename, memmap=True)
+    except IOError:
+        raise RuntimeError('Cannot op file %s'%fitsfilename)
+    try:
+        allimagedata = datahdu[0].data[0]
+        #Cut selected area
+        xpixels = int(0.5*allimagedata.shape[1]*(1-options['area']))
+        ypixels = int(0.5*allimagedata.shape[2]*(1-options['area']))
+        window = (slice(xpixels,allimagedata.shape[1]-xpixels),slice(ypixels,allimagedata.shape[2]-ypixels))
+        contrast = options['contrast']
+        cmap = options['cmap']
+        if not average:
+            imagedata = np.array(allimagedata[(planes,)+window])
+            #make a masked array to remove nans
+            imagedata = np.ma.masked_array(imagedata, np.isnan(imagedata))
+            # Contrast limits of all channels in one pass
+            lowcuts,highcuts = zscale_cube(imagedata,nsamples=100000,contrast=float(contrast))
+            [write_png(imageplane,outnames[num],float(contrast),cmap,limits=(lowcuts[num],highcuts[num]),fast=options['fast']) for num,imageplane in enumerate(imagedata)]
+            return outnames
+        #Compute the average, streaming over the planes
+        avdata = average_planes(allimagedata,planes,window,weightaverage=options['weightaverage'])
+    finally:
+        datahdu.close()
+    #Write out the averaged image
+    write_png(avdata,outnames[0],contrast,cmap,fast=options['fast'])
+    return outnames
+
 def fits2png(
              fitsfilename,
              contrast = 0.03,
@@ -250,6 +492,7 @@ def fits2png(
              forceaverage = False,
              weightaverage = False,
              area = 0.5,
+             fast = False,
             ):
     """
     Convert FITS files to PNG using matplotlib.
@@ -262,61 +505,71 @@ def fits2png(
     @param forceaverage  - Boolean: Produce an average of the range of channels in chans
     @param weightaverage - Boolean: Weight the averages
     @param area          - Float: Fraction of image (centered) to display
+    @param fast          - Boolean: Write pixels through a colormap lookup table instead of a matplotlib figure
 
     @return None
     """
-    import os
-    import pyfits
-
-    #open file in pyfits. And get the image plane(s) and the header
-    try:
-        datahdu = pyfits.open(fitsfilename)
-    except IOError:
-        raise RuntimeError('Cannot op file %s'%fitsfilename)
-
-    outname = os.path.splitext(fitsfilename)[0]
-
-    imageheader = datahdu[0].header
-    allimagedata = datahdu[0].data[0]
-    #make a masked array to remove nans
-    allimagedata = np.ma.masked_array(allimagedata, np.isnan(allimagedata))
-    #Cut selected area
-    xpixels = int(0.5*allimagedata.shape[1]*(1-area))
-    ypixels = int(0.5*allimagedata.shape[2]*(1-area))
-    allimagedata=allimagedata[:,xpixels:allimagedata.shape[1]-xpixels,ypixels:allimagedata.shape[2]-ypixels]
-    #cut out desired area
-    chan_range = chans
-    if not chan_range: 
-        imagedata=allimagedata
-        chan_range='1,'+str(imagedata.shape[0])
-    chan_range = str(chan_range).split(',')
-    # Get the desired subset of the fits file to converty to png
-    if len(chan_range)==1: imagedata = allimagedata[int(chan_range[0])-1:int(chan_range[0])]
-    else: imagedata = allimagedata[int(chan_range[0])-1:int(chan_range[1])-1]    
     # This will work on pipeline images- but needs to be reworked to work on any image you want
-    # Loop over every channel and produce a png for each one if the user asks
-    if len(chan_range)>1:
-        if imchans==True or imageheader['CTYPE3'] != 'FREQ':
-            [write_png(imageplane,outname+'_'+str(num+int(chan_range[0])),float(contrast),cmap) for num,imageplane in enumerate(imagedata)]
-    if len(chan_range)==1:
-        if imchans==True or imageheader['CTYPE3'] != 'FREQ':
-            write_png(imagedata[0],outname,float(contrast),cmap)
-    # Do a weighted or straight average image only if image cube or forced average 
-    if forceaverage==True or imageheader['CTYPE3'] == 'FREQ':
-        # Set a dummy weight array if not doing weights
-        weightarray = np.ones(imagedata.shape[0])
-        # Recompute weights if the user askes for variance weights
-        if weightaverage==True : weightarray = [get_background_variance(imageplane.flatten()) for imageplane in imagedata]
-        #Compute the average
-        avdata = np.average(imagedata,axis=0,weights=weightarray)
-        #Write out the averaged image
-        write_png(avdata,outname,contrast,cmap)
-    datahdu.close()
+    for task in fits2png_plan(fitsfilename,contrast,cmap,chans,imchans,forceaverage,weightaverage,area,chunk=RENDER_CHUNK,fast=fast):
+        fits2png_render(task)
+
+def _render_worker(task):
+    plt.switch_backend('Agg')
+    return fits2png_render(task)
+
+def fits2png_batch(
+                   fitsfilenames,
+                   jobs = 1,
+                   chunk = RENDER_CHUNK,
+                   **kwargs
+                  ):
+    """
+    Convert many FITS files to PNG, spreading files and channel planes over a process pool.
 
-if __name__ == '__main__':
-    from optparse import OptionParser, OptionGroup
-    usage='%prog [options] <fitsimage>'
-    parser = OptionParser(usage=usage, description="Plot a fits file as a png", version="%prog 1.0")
+    @param fitsfilenames - List: The names of the input fits files
+    @param jobs          - Integer: Nr of worker processes
+    @param chunk         - Integer: Max nr of channel planes rendered per task
+    @param kwargs        - Options of fits2png
+
+    @return outnames - List: The PNG files written (without .png), in plan order
+    """
+    tasks = []
+    for fitsfilename in fitsfilenames:
+        tasks.extend(fits2png_plan(fitsfilename,chunk=chunk,**kwargs))
+    if jobs <= 1 or len(tasks) <= 1:
+        outnames = [fits2png_render(task) for task in tasks]
+    else:
+        import multiprocessing
+        pool = multiprocessing.Pool(processes=min(jobs,len(tasks)))
+        try:
+            outnames = pool.map(_render_worker,tasks,chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+    return [outname for names in outnames for outname in names]
+
+def cli():
+    from optparse import OptionParser
+    usage='%prog [options] <fitsimage> [<fitsimage> ...]'
+    parser = OptionParser(usage=usage, description="Plot fits files as png", version="%prog 1.0")
+    parser.add_option('--jobs', action='store', dest='jobs', type=int, default=1,
+                      help='Nr of worker processes (default %default)')
+    parser.add_option('--contrast', action='store', dest='contrast', type=float, default=0.05,
+                      help='Fraction of the pixel distribution scaled into the colormap (default %default)')
+    parser.add_option('--cmap', action='store', dest='cmap', type=str, default='jet',
+                      help='Matplotlib colormap (default %default)')
+    parser.add_option('--area', action='store', dest='area', type=float, default=0.04,
+                      help='Fraction of the image (centered) to display (default %default)')
+    parser.add_option('--chans', action='store', dest='chans', type=str, default='1',
+                      help='Channel, or comma separated channel range, to use (default %default)')
+    parser.add_option('--imchans', action='store_true', dest='imchans', default=False,
+                      help='Produce a PNG for each channel')
+    parser.add_option('--average', action='store_true', dest='forceaverage', default=False,
+                      help='Produce an average of the channels')
+    parser.add_option('--weight', action='store_true', dest='weightaverage', default=False,
+                      help='Weight the average by the background variance')
+    parser.add_option('--fast', action='store_true', dest='fast', default=False,
+                      help='Full resolution PNG through a colormap lookup table, no figure or colorbar labels')
     (opts, args) = parser.parse_args()
 
     if len(args) < 1:
@@ -324,6 +577,20 @@ if __name__ == '__main__':
         parser.print_usage()
         raise SystemExit
 
-    fits2png(args[0],area=0.04,contrast=0.05,cmap='jet')
+    fits2png_batch(
+                   args,
+                   jobs=opts.jobs,
+                   contrast=opts.contrast,
+                   cmap=opts.cmap,
+                   chans=opts.chans,
+                   imchans=opts.imchans,
+                   forceaverage=opts.forceaverage,
+                   weightaverage=opts.weightaverage,
+                   area=opts.area,
+                   fast=opts.fast,
+                  )
+
+if __name__ == '__main__':
+    cli()
 
 # -fin-
@@ -0,0 +1,375 @@
+"""FFT based PSF imager as in-process alternative to wsclean"""
+
+from __future__ import print_function
+
+import numpy as np
+
+C = 299792458.  # m/s
+# Image geometry matching the wsclean call in main
+SIZE = 7200  # pixels
+SCALE = 0.5  # asec
+# Max number of uv samples gridded per bincount call
+CHUNK_SIZE = 2**22
+# Fraction of the peak used to select the main lobe for the beam fit
+FIT_LEVEL = 0.35
+
+UNITS = {
+         'asec': 1.,
+         'amin': 60.,
+         'deg': 3600.,
+        }
+
+
+# Convert wsclean style angle string ('2amin', '0.5asec', '10') to asec
+def angle_asec(value):
+    value = str(value).strip()
+    for unit, factor in UNITS.items():
+        if value.endswith(unit):
+            return float(value[:-len(unit)])*factor
+    return float(value)
+
+
+# Optional string option to float
+def _float(value):
+    if value is None:
+        return None
+    return float(value)
+
+
+# Add weights onto a flat grid without a full size temporary per chunk
+def _add(grid, index, weights=None):
+    cells, inverse = np.unique(index, return_inverse=True)
+    grid[cells] += np.bincount(inverse, weights=weights)
+
+
+# Iterate over uv samples in wavelengths, a block of channels at a time
+def _samples(
+             blocks,  # list of (uvw [m], channel frequencies [Hz])
+            ):
+    for uvw, freqs in blocks:
+        uvw = np.asarray(uvw, dtype=float)
+        freqs = np.atleast_1d(np.asarray(freqs, dtype=float))
+        nchans = max(1, CHUNK_SIZE // max(1, uvw.shape[0]))
+        for start in range(0, freqs.size, nchans):
+            scale = freqs[start:start+nchans] / C
+            u = (uvw[:, 0, np.newaxis]*scale[np.newaxis, :]).ravel()
+            v = (uvw[:, 1, np.newaxis]*scale[np.newaxis, :]).ravel()
+            yield u, v
+
+
+class Weighting(object):
+    """Weight and taper uv samples the way wsclean does for the PSF."""
+
+    def __init__(
+                 self,
+                 size=SIZE,               # image size [pixels]
+                 scale=SCALE,             # pixel size [asec]
+                 weight='uniform',        # natural, uniform or briggs
+                 robust=0.,               # briggs robustness
+                 superweight=1.,          # weight gridding box size factor
+                 taper_gaussian=None,     # image plane FWHM, e.g. '2amin'
+                 taper_tukey=None,        # outer tukey transition [lambda]
+                 taper_inner_tukey=None,  # inner tukey transition [lambda]
+                 taper_edge=None,         # grid edge margin [lambda]
+                 taper_edge_tukey=None,   # grid edge tukey transition [lambda]
+                 minuv_l=None,            # min uv distance [lambda]
+                 maxuv_l=None,            # max uv distance [lambda]
+                ):
+        self.size = int(size)
+        # uv cell size [lambda]
+        self.cell = 1. / (self.size*np.deg2rad(scale/3600.))
+        self.uvmax = (self.size//2 - 1)*self.cell
+        self.weight = weight
+        self.robust = float(robust)
+        self.superweight = float(superweight)
+        self.taper_gaussian = None
+        if taper_gaussian is not None:
+            self.taper_gaussian = np.deg2rad(angle_asec(taper_gaussian)/3600.)
+        self.taper_tukey = _float(taper_tukey)
+        self.taper_inner_tukey = _float(taper_inner_tukey)
+        self.taper_edge = _float(taper_edge)
+        self.taper_edge_tukey = _float(taper_edge_tukey)
+        self.minuv_l = _float(minuv_l)
+        self.maxuv_l = _float(maxuv_l)
+        if self.taper_tukey is not None and self.maxuv_l is None:
+            raise RuntimeError('Tukey taper needs a maximum uv distance (maxuv-l)')  # noqa
+        if self.taper_inner_tukey is not None and self.minuv_l is None:
+            raise RuntimeError('Inner tukey taper needs a minimum uv distance (minuv-l)')  # noqa
+        self.density = None
+        self.briggs_f2 = None
+
+    @classmethod
+    def from_opts(cls, opts, size=SIZE, scale=SCALE):
+        return cls(
+                   size=size,
+                   scale=scale,
+                   weight=opts.weight,
+                   robust=opts.robust,
+                   superweight=opts.superweight,
+                   taper_gaussian=opts.taper_gaussian,
+                   taper_tukey=opts.taper_tukey,
+                   taper_inner_tukey=opts.taper_inner_tukey,
+                   taper_edge=opts.taper_edge,
+                   taper_edge_tukey=opts.taper_edge_tukey,
+                   minuv_l=opts.minuv_l,
+                   maxuv_l=opts.maxuv_l,
+                  )
+
+    # Samples inside the uv grid and the min/max uv range
+    def select(self, u, v):
+        keep = (np.abs(u) < self.uvmax) & (np.abs(v) < self.uvmax)
+        if self.minuv_l is not None or self.maxuv_l is not None:
+            uvdist = np.hypot(u, v)
+            if self.minuv_l is not None:
+                keep &= uvdist >= self.minuv_l
+            if self.maxuv_l is not None:
+                keep &= uvdist <= self.maxuv_l
+        return keep
+
+    # Linear weight grid index, both a sample and its conjugate map here
+    def _density_index(self, u, v):
+        cell = self.cell*self.superweight
+        nside = int(np.ceil(self.size/self.superweight))
+        iu = np.mod(np.round(u/cell).astype(np.int64), nside)
+        iv = np.mod(np.round(v/cell).astype(np.int64), nside)
+        return iv*nside + iu, nside
+
+    def _density_add(self, u, v):
+        index, nside = self._density_index(u, v)
+        if self.density is None:
+            self.density = np.zeros(nside*nside)
+        _add(self.density, index)
+
+    # First pass: gridded natural weights for uniform and briggs weighting
+    def accumulate(self, blocks):
+        if self.weight == 'natural':
+            return
+        for u, v in _samples(blocks):
+            keep = self.select(u, v)
+            u, v = u[keep], v[keep]
+            self._density_add(u, v)
+            self._density_add(-u, -v)
+        if self.weight == 'briggs' and self.density is not None:
+            sum_w = self.density.sum()
+            sum_w2 = np.sum(self.density**2)
+            self.briggs_f2 = (5.*10**(-self.robust))**2 / (sum_w2/sum_w)
+
+    def taper(self, u, v):
+        w = np.ones(u.shape)
+        uvdist = np.hypot(u, v)
+        if self.taper_gaussian is not None:
+            w *= np.exp(-(np.pi*self.taper_gaussian*uvdist)**2 / (4.*np.log(2.)))  # noqa
+        if self.taper_tukey is not None:
+            edge = self.maxuv_l - self.taper_tukey
+            inside = uvdist > edge
+            w[inside] *= 0.5*(1. + np.cos(np.pi*(uvdist[inside] - edge)/self.taper_tukey))  # noqa
+        if self.taper_inner_tukey is not None:
+            edge = self.minuv_l + self.taper_inner_tukey
+            inside = uvdist < edge
+            w[inside] *= 0.5*(1. - np.cos(np.pi*(uvdist[inside] - self.minuv_l)/self.taper_inner_tukey))  # noqa
+        if self.taper_edge is not None or self.taper_edge_tukey is not None:
+            limit = self.uvmax - (self.taper_edge or 0.)
+            for coord in (np.abs(u), np.abs(v)):
+                w[coord > limit] = 0.
+                if self.taper_edge_tukey is not None:
+                    edge = limit - self.taper_edge_tukey
+                    inside = (coord > edge) & (coord <= limit)
+                    w[inside] *= 0.5*(1. + np.cos(np.pi*(coord[inside] - edge)/self.taper_edge_tukey))  # noqa
+        return w
+
+    # Second pass: imaging weight per selected sample
+    def __call__(self, u, v):
+        w = self.taper(u, v)
+        if self.weight == 'natural' or self.density is None:
+            return w
+        index, nside = self._density_index(u, v)
+        density = self.density[index]
+        if self.weight == 'uniform':
+            return w / density
+        return w / (1. + density*self.briggs_f2)
+
+
+def psf(
+        blocks,           # list of (uvw [m], channel frequencies [Hz])
+        weighting=None,   # Weighting instance, default uniform
+       ):
+    """
+    Grid uv samples and FFT them to a PSF normalised to a peak of 1.
+
+    The uv plane is Hermitian, so only the u >= 0 half is transformed.
+    Returns the image as a (size, size) array with RA increasing to the left.
+    """
+    if weighting is None:
+        weighting = Weighting()
+    weighting.accumulate(blocks)
+
+    size = weighting.size
+    grid = np.zeros(size*size)
+    for u, v in _samples(blocks):
+        keep = weighting.select(u, v)
+        u, v = u[keep], v[keep]
+        w = weighting(u, v)
+        # u is negated so that RA increases to the left of the image
+        for su in (-1., 1.):
+            iu = np.mod(np.round(su*u/weighting.cell).astype(np.int64), size)
+            iv = np.mod(np.round(-su*v/weighting.cell).astype(np.int64), size)  # noqa
+            _add(grid, iv*size + iu, weights=w)
+    grid = grid.reshape(size, size)
+
+    image = np.fft.irfft2(grid[:, :size//2+1], s=(size, size))
+    del grid
+    image = np.fft.fftshift(image)
+    peak = image[size//2, size//2]
+    if peak != 0:
+        image /= peak
+    return image
+
+
+def fit_beam(
+             image,         # PSF normalised to a peak of 1
+             scale=SCALE,   # pixel size [asec]
+            ):
+    """
+    Fit an elliptical Gaussian to the main lobe of the PSF.
+
+    Returns (bmaj, bmin, bpa) as FWHM in asec and position angle in deg.
+    """
+    from scipy import ndimage
+
+    centre = image.shape[0]//2
+    # grow the fit window until it contains the whole main lobe
+    half = 8
+    while half < centre:
+        box = image[centre-half:centre+half+1, centre-half:centre+half+1]
+        edge = np.concatenate((box[0], box[-1], box[:, 0], box[:, -1]))
+        if np.all(edge < FIT_LEVEL):
+            break
+        half *= 2
+    half = min(half, centre)
+    box = image[centre-half:centre+half+1, centre-half:centre+half+1]
+    labels, nlabels = ndimage.label(box > FIT_LEVEL)
+    lobe = labels == labels[half, half]
+
+    y, x = np.nonzero(lobe)
+    z = np.log(box[lobe])
+    x = x - float(half)
+    y = y - float(half)
+    # log(P) = c - (a x^2 + 2 b x y + c y^2)
+    design = np.vstack((np.ones(x.size), -x*x, -2.*x*y, -y*y)).T
+    coef = np.linalg.lstsq(design, z, rcond=None)[0]
+    quad = np.array([[coef[1], coef[2]], [coef[2], coef[3]]])
+    evals, evecs = np.linalg.eigh(quad)
+    evals = np.clip(evals, 1e-12, None)
+    fwhm = 2.*np.sqrt(2.*np.log(2.)) * np.sqrt(1./(2.*evals)) * scale
+    # major axis has the smallest curvature, pixel x points west
+    major_x, major_y = evecs[:, 0]
+    bpa = np.rad2deg(np.arctan2(-major_x, major_y)) % 180.
+    return [fwhm[0], fwhm[1], bpa]
+
+
+def write_fits(
+               fitsname,
+               image,
+               ra,            # phase centre [rad]
+               dec,           # phase centre [rad]
+               freq,          # reference frequency [Hz]
+               bandwidth,     # [Hz]
+               scale=SCALE,   # pixel size [asec]
+               beam=None,     # (bmaj [asec], bmin [asec], bpa [deg])
+              ):
+    """Write a PSF image with a wsclean compatible 4 axis header."""
+    import pyfits
+
+    size = image.shape[0]
+    hdu = pyfits.PrimaryHDU(image[np.newaxis, np.newaxis].astype(np.float32))
+    header = hdu.header
+    header['BUNIT'] = 'JY/BEAM'
+    header['CTYPE1'] = 'RA---SIN'
+    header['CRPIX1'] = size//2 + 1
+    header['CRVAL1'] = np.rad2deg(ra) % 360.
+    header['CDELT1'] = -scale/3600.
+    header['CUNIT1'] = 'deg'
+    header['CTYPE2'] = 'DEC--SIN'
+    header['CRPIX2'] = size//2 + 1
+    header['CRVAL2'] = np.rad2deg(dec)
+    header['CDELT2'] = scale/3600.
+    header['CUNIT2'] = 'deg'
+    header['CTYPE3'] = 'FREQ'
+    header['CRPIX3'] = 1
+    header['CRVAL3'] = freq
+    header['CDELT3'] = bandwidth
+    header['CUNIT3'] = 'Hz'
+    header['CTYPE4'] = 'STOKES'
+    header['CRPIX4'] = 1
+    header['CRVAL4'] = 1
+    header['CDELT4'] = 1
+    if beam is not None:
+        header['BMAJ'] = beam[0]/3600.
+        header['BMIN'] = beam[1]/3600.
+        header['BPA'] = beam[2]
+    hdu.writeto(fitsname, clobber=True)
+    return fitsname
+
+
+# Read uv samples per spectral window from a measurement set
+def read_ms(msname):
+    import casacore.tables
+
+    tab = casacore.tables.table(msname, ack=False)
+    try:
+        uvw = tab.getcol('UVW')
+        ddid = tab.getcol('DATA_DESC_ID')
+    finally:
+        tab.close()
+    ddtab = casacore.tables.table('%s/DATA_DESCRIPTION' % msname, ack=False)
+    try:
+        spw_ids = ddtab.getcol('SPECTRAL_WINDOW_ID')
+    finally:
+        ddtab.close()
+    spwtab = casacore.tables.table('%s/SPECTRAL_WINDOW' % msname, ack=False)
+    try:
+        chan_freqs = [spwtab.getcell('CHAN_FREQ', spw) for spw in range(spwtab.nrows())]  # noqa
+    finally:
+        spwtab.close()
+    fieldtab = casacore.tables.table('%s/FIELD' % msname, ack=False)
+    try:
+        [ra, dec] = fieldtab.getcell('PHASE_DIR', 0)[0]
+    finally:
+        fieldtab.close()
+
+    blocks = []
+    for dd, spw in enumerate(spw_ids):
+        rows = ddid == dd
+        if np.any(rows):
+            blocks.append((uvw[rows], chan_freqs[spw]))
+    return [blocks, ra, dec]
+
+
+# Make PSF FITS image for measurement set, named as wsclean would
+def make_psf(
+             msname,
+             opts,
+             size=SIZE,
+             scale=SCALE,
+            ):
+    [blocks, ra, dec] = read_ms(msname)
+    weighting = Weighting.from_opts(opts, size=size, scale=scale)
+    image = psf(blocks, weighting=weighting)
+    beam = fit_beam(image, scale=scale)
+    if opts.debug:
+        print('Fitted beam: %.2f x %.2f asec, PA %.1f deg' % tuple(beam))
+
+    freqs = np.concatenate([freqs for uvw, freqs in blocks])
+    fitsname = '%s-psf.fits' % msname
+    return write_fits(
+                      fitsname,
+                      image,
+                      ra,
+                      dec,
+                      freq=freqs.mean(),
+                      bandwidth=freqs.max() - freqs.min(),
+                      scale=scale,
+                      beam=beam,
+                     )
+
+# -fin-
@@ -3,22 +3,28 @@
 from __future__ import print_function
 from datetime import datetime, timedelta
 
+import copy
 import glob
-import matplotlib.pyplot as plt
+import multiprocessing
 import os
-import subprocess
+import sys
 
-import casacore.tables
-
-from makems import ms_make
 from ..common import coordinates
-import plot
+from ..common import runner
+import cache
+import imager
+import makems
+import metrics
+import report
+import uvw
 
 
 def main(parser, opts, args):
     # TODO:
     #   possibly be more explicit about what opts & args are accepted -- would
     #   be helpful info for when one wants to call main() from somewhere else
+    # Resource usage per stage, if requested
+    report.start(opts)
     # Reference location
     ref_location = coordinates.location(
                                         opts.lat,
@@ -28,98 +34,264 @@ def main(parser, opts, args):
 
 ## Create CASA ANTENNA table for antenna positions
     if opts.tblname is None:
-        # Array location
-        [array_geocentric, ant_list] = coordinates.read(
-                                                        args[0],
-                                                        ref_location,
-                                                        antennas=opts.ant_list,
-                                                        enu=opts.enu,
-                                                       )
-        opts.tblname = '%s_ANTENNA' % opts.array
-        import anttbl
-        try:
-            anttbl.make_tbl(opts.tblname, ant_list)
-        except:
-            raise
+        with report.stage('antenna_table'):
+            # Array location
+            [array_geocentric, ant_list] = coordinates.read(
+                                                            args[0],
+                                                            ref_location,
+                                                            antennas=opts.ant_list,  # noqa
+                                                            enu=opts.enu,
+                                                           )
+            opts.tblname = '%s_ANTENNA' % opts.array
+            import anttbl
+            try:
+                anttbl.make_tbl(opts.tblname, ant_list)
+            except:
+                raise
 
     # Only create a CASA antenna table
     if opts.ant_table:
-        import sys
+        report.write(opts)
         sys.exit(0)
 
 ## Make dummy measurement set for simulations
-    nscans = int(12./opts.dtime)  # number scans
-    dintegration = opts.synthesis/nscans  # integration time per scan
     if opts.stime is not None:
         starttime_object = datetime.strptime(opts.stime, "%Y/%m/%d/%H:%M:%S")
     else:
         starttime_object = datetime.now()
+    # imaging arguments are resolved from the parser once, so that worker
+    # processes only need a picklable list
+    wsclean_args = wsclean_options(parser, opts)
 
     declinations_deg = opts.declination.strip().split(',')
-    for opts.declination in declinations_deg:
-        mslist = []
-        for scan in range(nscans):
-            starttime = starttime_object + timedelta(seconds=scan*opts.dtime*3600.)  # noqa
-            opts.stime = starttime.strftime("%Y/%m/%d/%H:%M:%S")
-            mslist.append(ms_make(opts))
-
-        if len(mslist) > 1:
-            msname = '%s_%sdeg_%.2fsec.ms_p0' % (opts.array, opts.declination, opts.synthesis)  # noqa
+    msnames = declination_sweep(opts, declinations_deg, starttime_object, wsclean_args)  # noqa
+
+## Tabulate PSF metrics over all declinations
+    if opts.metrics is not None:
+        tabulate_metrics(opts, msnames)
+    report.write(opts)
+
+    # only show figures if any plotting was done
+    if opts.verbose and 'matplotlib.pyplot' in sys.modules:
+        import matplotlib.pyplot as plt
+        try:
+            plt.show()
+        except:
+            pass  # nothing to show
+
+
+# Measurement sets of all declinations, pipelined, in parallel or serially
+def declination_sweep(
+                      opts,
+                      declinations_deg,
+                      starttime_object,
+                      wsclean_args,
+                     ):
+    if opts.pipeline is not None and len(declinations_deg) > 1:
+        # overlap the stages of consecutive declinations
+        import pipeline
+        return pipeline.run(opts, declinations_deg, starttime_object, wsclean_args)  # noqa
+    if opts.jobs > 1 and len(declinations_deg) > 1:
+        return sweep(opts, declinations_deg, starttime_object, wsclean_args)  # noqa
+    msnames = []
+    for declination in declinations_deg:
+        msnames.append(declination_psf(opts, declination, starttime_object, wsclean_args))  # noqa
+    return msnames
+
+
+# Metrics table of the PSFs of all measurement sets
+def tabulate_metrics(opts, msnames):
+    psfs = []
+    for msname in msnames:
+        psfs.extend(sorted(glob.glob('%s-*psf.fits' % msname)))
+    with report.stage('metrics'):
+        metrics.write_table(metrics.psf_metrics(psfs, size=opts.metrics_size), opts.metrics)  # noqa
+
+
+# Simulate, image and post-process one declination
+def declination_psf(
+                    opts,
+                    declination,
+                    starttime_object,
+                    wsclean_args,
+                   ):
+    # own copy of the options, the declination changes per call
+    opts = copy.copy(opts)
+    opts.declination = declination
+    [msname, sim_key] = simulate(opts, starttime_object)
+    image(opts, msname, wsclean_args, sim_key=sim_key)
+    postprocess(opts, msname)
+    return msname
+
+
+# Worker process entry for a parallel declination sweep
+def _declination_worker(args):
+    [opts, declination, starttime_object, wsclean_args, workdir] = args
+    import matplotlib.pyplot as plt
+    plt.switch_backend('Agg')
+    os.chdir(workdir)
+    # already running in a pool worker, post-process in this process
+    opts = copy.copy(opts)
+    opts.jobs = 1
+    # stages of this worker are returned to the parent report
+    report.start(opts)
+    try:
+        msname = declination_psf(opts, declination, starttime_object, wsclean_args)  # noqa
+        return [msname, report.records()]
+    finally:
+        plt.close('all')
+
+
+# Options and a working directory per declination, for worker processes
+def sweep_dirs(opts, declinations_deg):
+    # workers change directory, so input files are referenced by full path
+    opts = copy.copy(opts)
+    opts.tblname = os.path.abspath(opts.tblname)
+    if opts.cfg is not None:
+        opts.cfg = os.path.abspath(opts.cfg)
+
+    workdirs = []
+    for declination in declinations_deg:
+        workdir = os.path.abspath('%s_%sdeg' % (opts.array, declination))
+        if not os.path.isdir(workdir):
+            os.makedirs(workdir)
+        workdirs.append(workdir)
+    return [opts, workdirs]
+
+
+# Run every declination in its own process and working directory
+def sweep(
+          opts,
+          declinations_deg,
+          starttime_object,
+          wsclean_args,
+         ):
+    [opts, workdirs] = sweep_dirs(opts, declinations_deg)
+    tasks = []
+    for declination, workdir in zip(declinations_deg, workdirs):
+        tasks.append([opts, declination, starttime_object, wsclean_args, workdir])  # noqa
+
+    pool = multiprocessing.Pool(processes=min(opts.jobs, len(tasks)))
+    try:
+        results = pool.map(_declination_worker, tasks)
+    finally:
+        pool.close()
+        pool.join()
+    msnames = []
+    for [msname, records] in results:
+        msnames.append(msname)
+        report.merge(records)
+    return [os.path.join(task[-1], msname) for task, msname in zip(tasks, msnames)]  # noqa
+
+
+# Measurement set with all scans for the current declination and the
+# cache key describing its content (None if caching is disabled)
+def simulate(opts, starttime_object):
+    sim_key = None
+    if opts.simulator == 'native':
+        # all scans in one pass, no makems and no concatenation needed
+        if not opts.no_cache:
+            sim_key = uvw.ms_key(opts, starttime_object)
+        with report.stage('simulate', declination=opts.declination):
+            msname = uvw.ms_make(opts, starttime_object)
+        return [msname, sim_key]
+
+    nscans = int(12./opts.dtime)  # number scans
+    starttimes = [starttime_object + timedelta(seconds=scan*opts.dtime*3600.) for scan in range(nscans)]  # noqa
+    scans = makems.scan_options(opts, starttimes)
+    with report.stage('makems', declination=opts.declination):
+        mslist = makems.ms_make_scans(scans, jobs=opts.scan_jobs, timeout=opts.timeout)  # noqa
+    if not opts.no_cache:
+        sim_key = cache.key(*[makems.ms_key(scan) for scan in scans])
+
+    if len(mslist) > 1:
+        msname = '%s_%sdeg_%.2fsec.ms_p0' % (opts.array, opts.declination, opts.synthesis)  # noqa
+        import casacore.tables
+        with report.stage('msconcat', declination=opts.declination):
             casacore.tables.msconcat(mslist, msname, concatTime=True)
-        else:
-            msname = mslist[0]
+    else:
+        msname = mslist[0]
+    return [msname, sim_key]
+
+
+# Imaging options passed on to wsclean
+def wsclean_options(parser, opts):
+    cmd_array = []
+    if opts.weight == 'briggs':
+        cmd_array.extend(['-weight', opts.weight, str(opts.robust)])
+    else:
+        cmd_array.extend(['-weight', opts.weight])
+    for arg in parser.get_option_group('--robust').option_list[:]:
+        if arg.dest == 'weight' or arg.dest == 'robust':
+            continue
+        arg_val = getattr(opts, str(arg.dest))
+        if arg_val is None:
+            continue
+        if str(arg_val) == 'False':
+            continue
+        if str(arg_val) == 'True':
+            cmd_array.extend(['-%s' % ((arg.dest.replace('_', '-')))])
+            continue
+        cmd_array.extend(['-%s' % ((arg.dest.replace('_', '-'))), str(arg_val)])  # noqa
+    if opts.debug:
+        cmd_array.extend(['-v'])
+    return cmd_array
+
 
 ##Clean simulated data to get psf
-        cmd_array = ['wsclean',
-                     '-j', '4',
-                     '-size', '7200', '7200',
-                     '-scale', '0.5asec',
-                     '-make-psf',
-                     '-fitbeam',  # determine beam shape by fitting the PSF
-                     '-name', msname,
-                    ]
-        if opts.weight == 'briggs':
-            cmd_array.extend(['-weight', opts.weight, str(opts.robust)])
+def image(opts, msname, wsclean_args, sim_key=None):
+    cmd_array = ['wsclean',
+                 '-j', '4',
+                 '-size', '7200', '7200',
+                 '-scale', '0.5asec',
+                 '-make-psf',
+                 '-fitbeam',  # determine beam shape by fitting the PSF
+                 '-name', msname,
+                ]
+    cmd_array.extend(wsclean_args)
+    cmd_array.append(msname)
+
+    # the imaging arguments hold all weighting options for either imager
+    store = None
+    if sim_key is not None:
+        store = cache.from_opts(opts)
+    if store is not None:
+        psf_key = cache.key(sim_key, opts.imager, cmd_array)
+        if store.fetch(psf_key) is not None:
+            return
+
+    with report.stage('image', declination=opts.declination):
+        if opts.imager == 'native':
+            # grid and FFT the uv samples in-process, no wsclean run needed
+            imager.make_psf(msname, opts)
         else:
-            cmd_array.extend(['-weight', opts.weight])
-        for arg in parser.get_option_group('--robust').option_list[:]:
-            if arg.dest == 'weight' or arg.dest == 'robust':
-                continue
-            arg_val = getattr(opts, str(arg.dest))
-            if arg_val is None:
-                continue
-            if str(arg_val) == 'False':
-                continue
-            if str(arg_val) == 'True':
-                cmd_array.extend(['-%s' % ((arg.dest.replace('_', '-')))])
-                continue
-            cmd_array.extend(['-%s' % ((arg.dest.replace('_', '-'))), str(arg_val)])  # noqa
-        if opts.debug:
-            cmd_array.extend(['-v'])
-
-        cmd_array.append(msname)
-        if opts.debug:
-            print(' '.join(cmd_array))
+            if opts.debug:
+                print(' '.join(cmd_array))
+            # a failed or timed out wsclean run stops the pipeline
+            runner.run(cmd_array, timeout=opts.timeout)
+
+    products = glob.glob('%s-*.fits' % msname)
+    if store is not None and products:
+        store.store(psf_key, products)
 
-        try:
-            subprocess.check_call(cmd_array)
-        except subprocess.CalledProcessError as e:  # noqa
-            # TODO: handle or report exception here, maybe
-            pass
 
-    sliceout = None
-    uvout = None
 ## Convert wsclean generated fits files to PNG
+def postprocess(opts, msname):
+    import plot
     # PSF files to PNG
-    from fits2png import fits2png
-    for fitsfile in glob.glob('*psf.fits'):
-        fits2png(fitsfile, area=0.04, contrast=0.05, cmap='jet')
+    from fits2png import fits2png_batch
+    fitsfiles = sorted(glob.glob('%s-*psf.fits' % msname))
+    with report.stage('fits2png', declination=opts.declination):
+        fits2png_batch(fitsfiles, jobs=opts.jobs, area=0.04, contrast=0.05, cmap='jet', fast=opts.fast_png)  # noqa
+    for fitsfile in fitsfiles:
 ## Slice through the major axis of the PSF
         sliceout = '%s-slice.png' % os.path.splitext(os.path.basename(fitsfile))[0]  # noqa
-        plot.slicepsf(fitsfile, beamwidth=opts.beamwidth, crop=opts.crop, output=sliceout)  # noqa
+        with report.stage('slice', declination=opts.declination):
+            plot.slicepsf(fitsfile, beamwidth=opts.beamwidth, crop=opts.crop, output=sliceout)  # noqa
 ## UV coverage of measurement set
         uvout = '%s-uv.png' % os.path.splitext(os.path.basename(msname))[0]
-        plot.uv(msname, output=uvout)
+        with report.stage('uv', declination=opts.declination):
+            plot.uv(msname, output=uvout)
     # # All fits files to PNG
     # if opts.allfits:
     #     for fitsfile in glob.glob('*.fits'):
@@ -128,10 +300,4 @@ def main(parser, opts, args):
     #         except:
     #             pass  # do not care
 
-    if opts.verbose:
-        try:
-            plt.show()
-        except:
-            pass  # nothing to show
-
 # -fin-
@@ -2,11 +2,15 @@
 
 from __future__ import print_function
 
+import copy
+import glob
 import os
 import shutil
-import subprocess
 import tempfile
 
+from ..common import runner
+import cache
+
 
 #Read makems config file into dictionary
 def cfg_read(
@@ -33,8 +37,8 @@ def cfg_write_ms(cfg_file, cfg_dict, verbose=False):
             print('='.join((key, str(value))))
 
 
-#Make empty measurement set
-def ms_make(opts):
+#Effective makems config and MS name for the scan in opts
+def ms_config(opts):
     cfg_dict = cfg_read(opts.cfg)
     ntimesteps = (opts.synthesis/opts.dt) / (12./opts.dtime)
     if opts.msname is None:
@@ -58,23 +62,39 @@ def ms_make(opts):
        'AntennaTableName': opts.tblname,
        'MSName': msname,
        })
+    return [msname, cfg_dict]
+
+
+#Cache key of the measurement set makems generates for opts
+def ms_key(opts):
+    [msname, cfg_dict] = ms_config(opts)
+    cfg_dict = dict(cfg_dict)
+    # the antenna table is identified by content rather than by name
+    antennas = cache.tree_digest(cfg_dict.pop('AntennaTableName'))
+    return cache.key('makems', cfg_dict, antennas)
+
+
+#Write the makems config of a scan, None if its measurement set is cached
+def ms_prepare(opts):
+    [msname, cfg_dict] = ms_config(opts)
     if opts.debug:
         print(cfg_dict)
-
-    # import sys
-    # sys.exit(0)
+    store = cache.from_opts(opts)
+    if store is not None:
+        key = ms_key(opts)
+        if store.fetch(key) is not None:
+            return None
 
     # generate a measurement set
     # http://stackoverflow.com/a/15343686
     with tempfile.NamedTemporaryFile(delete=False) as file:
         cfg_write_ms(file, cfg_dict, verbose=opts.debug)
-    try:
-        subprocess.check_call(['makems', file.name])
-    except subprocess.CalledProcessError as e:
-        # TODO: handle or report exception here, maybe
-        pass
-    finally:
-        os.remove(file.name)
+    return file.name
+
+
+#Restore the antenna names in a generated measurement set and cache it
+def ms_finish(opts):
+    [msname, cfg_dict] = ms_config(opts)
     # this is a lofar script and will use the position information, but loose the namings
     # so the original ANTENNA table needs to be copied back into the MS
     antenna_dir = '%s_p0/ANTENNA' % msname
@@ -82,7 +102,58 @@ def ms_make(opts):
     shutil.rmtree(antenna_bak, ignore_errors=True)  # /should/ be safe enough
     shutil.move(antenna_dir, antenna_bak)
     shutil.copytree(opts.tblname, antenna_dir)
+    store = cache.from_opts(opts)
+    if store is not None:
+        store.store(ms_key(opts), glob.glob('%s_p*' % msname))
     return '%s_p0' % msname
 
 
+#Make empty measurement set
+def ms_make(opts):
+    return ms_make_scans([opts], timeout=opts.timeout)[0]
+
+
+#Options per scan, every scan gets its own config file and MS name
+def scan_options(
+                 opts,
+                 starttimes,  # datetime per scan
+                ):
+    scan_opts = []
+    for starttime in starttimes:
+        scan = copy.copy(opts)
+        scan.stime = starttime.strftime("%Y/%m/%d/%H:%M:%S")
+        scan_opts.append(scan)
+    return scan_opts
+
+
+#Make measurement sets for all scans, running up to jobs makems at a time
+def ms_make_scans(
+                  scan_opts,     # options per scan from scan_options
+                  jobs=1,        # nr of concurrent makems runs
+                  timeout=None,  # max run time of a makems run [sec]
+                 ):
+    cfgfiles = [ms_prepare(scan) for scan in scan_opts]
+    # makems runs in its own process, one thread waits on all of them and
+    # stops the others as soon as one fails
+    tools = runner.Runner(jobs=jobs, timeout=timeout)
+    for scan, cfgfile in zip(scan_opts, cfgfiles):
+        if cfgfile is not None:
+            tools.add(ms_config(scan)[0], ['makems', cfgfile])
+    try:
+        tools.run()
+    finally:
+        for cfgfile in cfgfiles:
+            if cfgfile is not None:
+                os.remove(cfgfile)
+
+    # measurement sets in scan order, cached ones are complete already
+    mslist = []
+    for scan, cfgfile in zip(scan_opts, cfgfiles):
+        if cfgfile is None:
+            mslist.append('%s_p0' % ms_config(scan)[0])
+        else:
+            mslist.append(ms_finish(scan))
+    return mslist
+
+
 # -fin-
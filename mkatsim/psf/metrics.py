@@ -0,0 +1,302 @@
+"""Numerical PSF quality metrics for batches of PSF images"""
+
+from __future__ import print_function
+
+import csv
+import json
+import sys
+
+import numpy as np
+
+import imager
+
+# Scalar columns of the metrics table
+COLUMNS = [
+           'name',
+           'bmaj',           # fitted beam from the header [asec]
+           'bmin',           # [asec]
+           'bpa',            # [deg]
+           'fwhm_major',     # FWHM along the major axis [asec]
+           'fwhm_minor',     # FWHM along the minor axis [asec]
+           'peak',           # PSF peak value
+           'peak_sidelobe',  # max outside the first null, relative to peak
+           'rms_sidelobe',   # rms outside the first null, relative to peak
+           'first_null',     # first null of the radial profile [asec]
+          ]
+# Samples per pixel along the axis cuts
+OVERSAMPLE = 10
+# Max nr of pixels (images x image size) processed in one batch
+BATCH_PIXELS = 2**24
+
+
+# Image plane, pixel size [asec] and fitted beam of a PSF fits image
+def read_psf(
+             fitsimage,
+             size=None,  # only read a central window of size x size pixels
+            ):
+    import pyfits
+    fitsfile = pyfits.open(fitsimage, memmap=True)
+    try:
+        header = fitsfile[0].header
+        image = fitsfile[0].data
+        while image.ndim > 2:
+            image = image[0]
+        if size is not None:
+            [ny, nx] = image.shape
+            image = image[
+                          max(ny//2 - size//2, 0):ny//2 + size//2,
+                          max(nx//2 - size//2, 0):nx//2 + size//2,
+                         ]
+        image = np.array(image, dtype=float)
+        scale = abs(float(header['CDELT1']))*3600.
+        beam = [
+                float(header.get('BMAJ', np.nan))*3600.,
+                float(header.get('BMIN', np.nan))*3600.,
+                float(header.get('BPA', np.nan)),
+               ]
+    finally:
+        fitsfile.close()
+    return [image, scale, beam]
+
+
+# Bilinear interpolation in a stack of images, zero outside the images
+def _bilinear(
+              images,  # (nimages, ny, nx)
+              rows,    # (nimages, nsamples)
+              cols,    # (nimages, nsamples)
+             ):
+    [nimages, nrows, ncols] = images.shape
+    inside = (rows >= 0) & (rows <= nrows - 1) & (cols >= 0) & (cols <= ncols - 1)  # noqa
+    row0 = np.clip(np.floor(rows).astype(int), 0, nrows - 2)
+    col0 = np.clip(np.floor(cols).astype(int), 0, ncols - 2)
+    drow = rows - row0
+    dcol = cols - col0
+    plane = np.arange(nimages)[:, np.newaxis]
+    values = np.zeros(rows.shape)
+    for [row, wrow] in [[row0, 1. - drow], [row0 + 1, drow]]:
+        for [col, wcol] in [[col0, 1. - dcol], [col0 + 1, dcol]]:
+            values += images[plane, row, col]*wrow*wcol
+    return np.where(inside, values, 0.)
+
+
+# Offset [pixels] where the cuts first drop below level, nan if they never do
+def _crossing(
+              cuts,   # (ncuts, nsamples) starting at the peak
+              step,   # sample spacing [pixels]
+              level=0.5,
+             ):
+    below = cuts < level
+    idx = np.argmax(below, axis=1)
+    found = below[np.arange(cuts.shape[0]), idx] & (idx > 0)
+    idx = np.maximum(idx, 1)
+    prev = cuts[np.arange(cuts.shape[0]), idx - 1]
+    curr = cuts[np.arange(cuts.shape[0]), idx]
+    frac = (prev - level)/np.where(prev > curr, prev - curr, 1.)
+    return np.where(found, (idx - 1 + frac)*step, np.nan)
+
+
+def stack_metrics(
+                  images,  # (nimages, ny, nx) PSF images of the same size
+                  scale,   # pixel size [asec]
+                  bpa,     # (nimages,) position angle of the major axis [deg]
+                 ):
+    """
+    Metrics of a stack of PSF images, all computed for the whole stack at once.
+
+    Returns a dict of arrays with one value per image, and the radial
+    profiles as an (nimages, nradii) array in 'radial_profile'.
+    """
+    [nimages, ny, nx] = images.shape
+    images = np.asarray(images, dtype=float)
+    plane = np.arange(nimages)
+
+    # PSF peak and its position, the images are not normalised to save a
+    # full size copy, the values taken from them are divided by peak instead
+    [py, px] = np.unravel_index(images.reshape(nimages, -1).argmax(axis=1), (ny, nx))  # noqa
+    peak = images[plane, py, px]
+    norm = peak[:, np.newaxis]
+
+    # squared distance [pixels^2] to the peak, int32 up to 32k pixels a side
+    dy2 = ((np.arange(ny) - py[:, np.newaxis])**2).astype(np.int32)
+    dx2 = ((np.arange(nx) - px[:, np.newaxis])**2).astype(np.int32)
+    radius2 = dy2[:, :, np.newaxis] + dx2[:, np.newaxis, :]
+
+    # azimuthally averaged radial profile, 1 pixel wide annuli: rint(radius)
+    # is k for k(k-1) < radius^2 <= k(k+1), and annulus nradii of every
+    # image collects the pixels further out
+    nradii = min(ny, nx)//2
+    edges = (np.arange(nradii)*np.arange(1, nradii + 1)).astype(np.int32)
+    annulus = np.searchsorted(edges, radius2)
+    annulus += (nradii + 1)*plane[:, np.newaxis, np.newaxis]
+    nbins = nimages*(nradii + 1)
+    sums = np.bincount(annulus.ravel(), weights=images.ravel(), minlength=nbins)  # noqa
+    counts = np.bincount(annulus.ravel(), minlength=nbins)
+    del annulus
+    profile = (sums/np.maximum(counts, 1)).reshape(nimages, nradii + 1)[:, :-1]/norm  # noqa
+
+    # first null: profile crosses zero, or else its first minimum
+    rising = np.diff(profile, axis=1) > 0
+    null = (profile[:, 1:] <= 0) | rising
+    idx = np.argmax(null, axis=1) + 1
+    found = null[plane, idx - 1]
+    prev = profile[plane, idx - 1]
+    curr = profile[plane, idx]
+    crossing = (profile[plane, idx] <= 0) & (prev > curr)
+    # interpolated zero crossing, else the minimum at idx - 1
+    frac = np.where(crossing, prev/np.where(crossing, prev - curr, 1.), 0.)
+    first_null = np.where(found, idx - 1 + frac, np.nan)
+
+    # sidelobes outside the first null, their max and rms reduced through
+    # one work buffer
+    limit = np.where(found, first_null, np.inf)
+    sidelobes = radius2 > (limit**2)[:, np.newaxis, np.newaxis]
+    del radius2
+    nsidelobe = sidelobes.sum(axis=(1, 2))
+    work = np.empty_like(images)
+    work.fill(-np.inf)
+    np.copyto(work, images, where=sidelobes)
+    peak_sidelobe = work.max(axis=(1, 2))/peak
+    work.fill(0.)
+    np.copyto(work, images, where=sidelobes)
+    np.square(work, out=work)
+    rms_sidelobe = np.sqrt(work.sum(axis=(1, 2))/np.maximum(nsidelobe, 1))/np.abs(peak)  # noqa
+    del work, sidelobes
+    peak_sidelobe = np.where(nsidelobe > 0, peak_sidelobe, np.nan)
+    rms_sidelobe = np.where(nsidelobe > 0, rms_sidelobe, np.nan)
+
+    # FWHM from cuts through the peak along the major and minor axes,
+    # pixel x points west as for imager.fit_beam
+    step = 1./OVERSAMPLE
+    offsets = np.arange(0., nradii, step)
+    fwhm = []
+    for angle in [np.deg2rad(bpa), np.deg2rad(bpa) + np.pi/2.]:
+        dx = -np.sin(angle)[:, np.newaxis]
+        dy = np.cos(angle)[:, np.newaxis]
+        width = 0.
+        for sign in [1., -1.]:
+            cuts = _bilinear(
+                             images,
+                             py[:, np.newaxis] + sign*offsets*dy,
+                             px[:, np.newaxis] + sign*offsets*dx,
+                            )/norm
+            width = width + _crossing(cuts, step)
+        fwhm.append(width*scale)
+
+    return {
+            'fwhm_major': fwhm[0],
+            'fwhm_minor': fwhm[1],
+            'peak': peak,
+            'peak_sidelobe': peak_sidelobe,
+            'rms_sidelobe': rms_sidelobe,
+            'first_null': first_null*scale,
+            'radial_profile': profile,
+           }
+
+
+# Group consecutive PSFs of the same shape and pixel size into batches
+def _batches(psfs, size, scale):
+    batch = []
+    for [name, psf] in psfs:
+        if isinstance(psf, np.ndarray):
+            image = np.array(psf, dtype=float)
+            while image.ndim > 2:
+                image = image[0]
+            [psf_scale, beam] = [scale, [np.nan]*3]
+        else:
+            [image, psf_scale, beam] = read_psf(psf, size=size)
+        if batch and (image.shape != batch[0][1].shape or psf_scale != batch[0][2] or (len(batch) + 1)*image.size > BATCH_PIXELS):  # noqa
+            yield batch
+            batch = []
+        batch.append([name, image, psf_scale, beam])
+    if batch:
+        yield batch
+
+
+def psf_metrics(
+                psfs,              # fits file names or 2D PSF arrays
+                names=None,        # row names, default the file names
+                scale=imager.SCALE,  # pixel size of array PSFs [asec]
+                size=None,         # only use a central window of the images
+               ):
+    """Metrics table of the PSFs, a list of dicts of COLUMNS and profile."""
+    if names is None:
+        names = [psf if not isinstance(psf, np.ndarray) else 'psf%d' % idx for idx, psf in enumerate(psfs)]  # noqa
+    rows = []
+    for batch in _batches(zip(names, psfs), size, scale):
+        images = np.empty((len(batch),) + batch[0][1].shape)
+        for idx, entry in enumerate(batch):
+            # move the image into the stack, not keeping both copies
+            images[idx] = entry[1]
+            entry[1] = None
+        beams = np.array([beam for [name, image, psf_scale, beam] in batch])
+        bpa = beams[:, 2]
+        for idx in np.nonzero(np.isnan(bpa))[0]:
+            # no fitted beam available, fit the main lobe here
+            image = images[idx]
+            beams[idx] = imager.fit_beam(image/image.max(), scale=batch[idx][2])  # noqa
+            bpa[idx] = beams[idx, 2]
+        values = stack_metrics(images, batch[0][2], bpa)
+        for idx, [name, image, psf_scale, beam] in enumerate(batch):
+            row = {
+                   'name': name,
+                   'bmaj': float(beams[idx, 0]),
+                   'bmin': float(beams[idx, 1]),
+                   'bpa': float(beams[idx, 2]),
+                   'radius': list(np.arange(values['radial_profile'].shape[1])*psf_scale),  # noqa
+                  }
+            for key, value in values.items():
+                if key == 'radial_profile':
+                    row[key] = [float(val) for val in value[idx]]
+                else:
+                    row[key] = float(value[idx])
+            rows.append(row)
+    return rows
+
+
+# Write metrics as CSV, or as JSON including the radial profiles
+def write_table(
+                rows,           # from psf_metrics
+                filename=None,  # .json or .csv file, default CSV to stdout
+               ):
+    if filename is not None and filename.endswith('.json'):
+        with open(filename, 'w') as fout:
+            json.dump(rows, fout, indent=2, sort_keys=True)
+        return filename
+    fout = sys.stdout if filename is None else open(filename, 'w')
+    try:
+        writer = csv.DictWriter(fout, COLUMNS, extrasaction='ignore')
+        writer.writeheader()
+        for row in rows:
+            writer.writerow(row)
+    finally:
+        if filename is not None:
+            fout.close()
+    return filename
+
+
+if __name__ == '__main__':
+    from optparse import OptionParser
+    usage = '%prog [options] <fitsimage> [<fitsimage> ...]'
+    parser = OptionParser(usage=usage, description="Tabulate PSF quality metrics", version="%prog 1.0")  # noqa
+    parser.add_option('--output',
+                      action='store',
+                      dest='output',
+                      type=str,
+                      default=None,
+                      help='CSV or JSON (.json) output file, default CSV to stdout')  # noqa
+    parser.add_option('--size',
+                      action='store',
+                      dest='size',
+                      type=int,
+                      default=None,
+                      help='Only use the central size x size pixels of the PSF')  # noqa
+    (opts, args) = parser.parse_args()
+
+    if len(args) < 1:
+        print('No fits image provided')
+        parser.print_usage()
+        raise SystemExit
+
+    write_table(psf_metrics(args, size=opts.size), opts.output)
+
+# -fin-
@@ -0,0 +1,72 @@
+"""Bulk column writers for CASA tables and measurement set subtables"""
+
+from collections import OrderedDict
+
+import casacore.tables
+
+
+# Table description with the columns in the given order
+def tabledesc(
+              descs,  # column descriptions from makescacoldesc/makearrcoldesc
+             ):
+    rec = OrderedDict()
+    for desc in descs:
+        colname = desc['name']
+        if colname in rec:
+            raise ValueError('Column name %s multiply used in table description' % colname)  # noqa
+        rec[colname] = desc['desc']
+    return rec
+
+
+# Write all given columns, one putcol call per column
+def put_columns(
+                table,
+                columns,  # list of (column name, values for all rows)
+                startrow=0,
+               ):
+    for colname, values in columns:
+        table.putcol(colname, values, startrow=startrow)
+
+
+def write_table(
+                tblname,
+                descs,          # column descriptions, in table column order
+                columns,        # list of (column name, values for all rows)
+                colkeywords=None,  # dict of column name -> column keywords
+               ):
+    """Create a new table and fill it with one putcol call per column."""
+    nrow = len(columns[0][1]) if columns else 0
+    table = casacore.tables.table(
+                                  tblname,
+                                  tabledesc(descs),
+                                  nrow=nrow,
+                                  readonly=False,
+                                  ack=False,
+                                 )
+    try:
+        for colname, keywords in (colkeywords or {}).items():
+            table.putcolkeywords(colname, keywords)
+        put_columns(table, columns)
+        table.flush()
+    finally:
+        table.close()
+    return tblname
+
+
+def fill_table(
+               tblname,   # existing table, e.g. a measurement set subtable
+               columns,   # list of (column name, values for the new rows)
+              ):
+    """Append rows to an existing table with one putcol call per column."""
+    nrow = len(columns[0][1])
+    table = casacore.tables.table(tblname, readonly=False, ack=False)
+    try:
+        startrow = table.nrows()
+        table.addrows(nrow)
+        put_columns(table, columns, startrow=startrow)
+        table.flush()
+    finally:
+        table.close()
+    return tblname
+
+# -fin-
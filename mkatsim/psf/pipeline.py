@@ -0,0 +1,160 @@
+"""Overlap simulation, imaging and post-processing of a declination sweep"""
+
+from __future__ import print_function
+
+import copy
+import multiprocessing
+import os
+
+import main
+import report
+
+STAGES = ['simulate', 'image', 'postprocess']
+# Max wait [sec] between checks of the running stages
+POLL_INTERVAL = 0.1
+
+
+# Worker processes per stage from a 'SIM,IMAGE,POST' option value
+def pool_sizes(spec):
+    try:
+        sizes = [int(size) for size in spec.split(',')]
+    except ValueError:
+        sizes = []
+    if len(sizes) != len(STAGES) or min(sizes) < 1:
+        raise RuntimeError('Pipeline needs %d pool sizes SIM,IMAGE,POST, got %s' % (len(STAGES), spec))  # noqa
+    return sizes
+
+
+# Options of a stage in a worker process, run in the declination directory
+def _stage_opts(opts, declination, workdir):
+    os.chdir(workdir)
+    opts = copy.copy(opts)
+    opts.declination = declination
+    # already running in a pool worker, post-process in this process
+    opts.jobs = 1
+    # stages of this worker are returned to the parent report
+    report.start(opts)
+    return opts
+
+
+def _simulate_worker(args):
+    [opts, declination, starttime_object, workdir] = args
+    opts = _stage_opts(opts, declination, workdir)
+    [msname, sim_key] = main.simulate(opts, starttime_object)
+    return [msname, sim_key, report.records()]
+
+
+def _image_worker(args):
+    [opts, declination, msname, sim_key, wsclean_args, workdir] = args
+    opts = _stage_opts(opts, declination, workdir)
+    main.image(opts, msname, wsclean_args, sim_key=sim_key)
+    return [report.records()]
+
+
+def _postprocess_worker(args):
+    [opts, declination, msname, workdir] = args
+    import matplotlib.pyplot as plt
+    plt.switch_backend('Agg')
+    opts = _stage_opts(opts, declination, workdir)
+    try:
+        main.postprocess(opts, msname)
+        return [report.records()]
+    finally:
+        plt.close('all')
+
+
+# Submit the stage after a finished one, None after post-processing
+def _next_stage(
+                pools,         # simulate, image and postprocess pools
+                tasks,         # [opts, declination, workdir] per declination
+                wsclean_args,
+                msnames,       # simulated measurement set per declination
+                name,          # stage that finished
+                idx,           # declination index
+                values,        # result of the finished stage
+               ):
+    [opts, declination, workdir] = tasks[idx]
+    if name == 'simulate':
+        [msnames[idx], sim_key] = values[:2]
+        task = [opts, declination, msnames[idx], sim_key, wsclean_args, workdir]  # noqa
+        return ['image', idx, pools[1].apply_async(_image_worker, (task,))]
+    if name == 'image':
+        task = [opts, declination, msnames[idx], workdir]
+        return ['postprocess', idx, pools[2].apply_async(_postprocess_worker, (task,))]  # noqa
+    return None
+
+
+# Feed the declinations through the stage pools, returns the measurement sets
+def _schedule(
+              pools,         # simulate, image and postprocess pools
+              sizes,         # of the pools
+              tasks,         # [opts, declination, workdir] per declination
+              starttime_object,
+              wsclean_args,
+             ):
+    ndecs = len(tasks)
+    msnames = [None]*ndecs
+    running = []      # [stage, declination index, AsyncResult]
+    nsimulate = 0     # declinations that entered the pipeline
+    nimaged = 0       # declinations done imaging
+    while True:
+        while nsimulate < ndecs and nsimulate - nimaged < sizes[0] + sizes[1]:  # noqa
+            [opts, declination, workdir] = tasks[nsimulate]
+            task = [opts, declination, starttime_object, workdir]
+            running.append(['simulate', nsimulate, pools[0].apply_async(_simulate_worker, (task,))])  # noqa
+            nsimulate += 1
+        if not running:
+            return msnames
+        finished = [stage for stage in running if stage[2].ready()]
+        if not finished:
+            running[0][2].wait(POLL_INTERVAL)
+            continue
+        for stage in finished:
+            running.remove(stage)
+            [name, idx, result] = stage
+            # raises the exception of a failed stage
+            values = result.get()
+            report.merge(values[-1])
+            if name == 'image':
+                nimaged += 1
+            following = _next_stage(pools, tasks, wsclean_args, msnames, name, idx, values)  # noqa
+            if following is not None:
+                running.append(following)
+
+
+def run(
+        opts,
+        declinations_deg,
+        starttime_object,
+        wsclean_args,
+       ):
+    """
+    Run every declination through the simulate, image and postprocess stages.
+
+    Each stage has its own pool of worker processes, sized by opts.pipeline,
+    so that declination i is post-processed while i+1 is imaged and i+2 is
+    simulated.  Declinations enter in order, and the simulated measurement
+    sets waiting for imaging are limited to the simulation and imaging pool
+    sizes.  The first failing stage stops the pipeline.
+
+    Returns the measurement set names, including their working directories.
+    """
+    sizes = pool_sizes(opts.pipeline)
+    [opts, workdirs] = main.sweep_dirs(opts, declinations_deg)
+    tasks = [[opts, declination, workdir] for declination, workdir in zip(declinations_deg, workdirs)]  # noqa
+    pools = [multiprocessing.Pool(processes=min(size, len(tasks))) for size in sizes]  # noqa
+    try:
+        msnames = _schedule(pools, sizes, tasks, starttime_object, wsclean_args)  # noqa
+    except BaseException:
+        for pool in pools:
+            pool.terminate()
+        raise
+    else:
+        for pool in pools:
+            pool.close()
+    finally:
+        for pool in pools:
+            pool.join()
+    return [os.path.join(workdir, msname) for workdir, msname in zip(workdirs, msnames)]  # noqa
+
+# -fin-
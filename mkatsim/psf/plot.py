@@ -1,29 +1,72 @@
 from scipy import ndimage
 import matplotlib.pylab as plt
 import numpy as np
-import os
 import pyfits
-import shutil
-import tempfile
 
+# Central psf window kept when cropping
+CROP_SIZE = 480
+# Measurement sets with more rows are plotted as a uv density image
+UV_SCATTER_MAX = 2**20
+# Rows of UVW read per chunk
+UV_CHUNK = 2**18
+# Density image cells per axis
+UV_BINS = 1024
 
-# Use fake temp file to crop psf for slicing, do not change input fits image
+
+# Slice the psf without changing the input fits image
 def slicepsf(
              fitsimage,
              beamwidth=None,  # arcsec
              crop=False,
              output=None,
             ):
-    """Wrap along_axes with temp file."""
-    with tempfile.NamedTemporaryFile(delete=False) as file:
-        pass
-    try:
-        shutil.copy(fitsimage, file.name)
-        along_axes(file.name, beamwidth=beamwidth, output=output, crop=crop)
-    except:
-        raise
-    finally:
-        os.remove(file.name)
+    """Wrap along_axes, the fits image is only read."""
+    along_axes(fitsimage, beamwidth=beamwidth, output=output, crop=crop)
+
+
+# Interpolate image values at (row, col) positions, only reading the pixels
+# next to them
+def _bilinear(
+              data,  # 2D image, may be a memmap
+              rows,
+              cols,
+             ):
+    [nrows, ncols] = data.shape
+    # samples outside the image are zero, as for map_coordinates
+    inside = (rows >= 0) & (rows <= nrows - 1) & (cols >= 0) & (cols <= ncols - 1)  # noqa
+    row0 = np.clip(np.floor(rows).astype(int), 0, max(nrows - 2, 0))
+    col0 = np.clip(np.floor(cols).astype(int), 0, max(ncols - 2, 0))
+    drow = rows - row0
+    dcol = cols - col0
+    values = np.zeros(rows.shape)
+    for [row, wrow] in [[row0, 1. - drow], [row0 + 1, drow]]:
+        for [col, wcol] in [[col0, 1. - dcol], [col0 + 1, dcol]]:
+            values += data[row, col]*wrow*wcol
+    return np.where(inside, values, 0.)
+
+
+# Header values and image plane of the psf, the full image stays on disk
+def _read_psf(
+              imfile,  # fits input image
+              crop=False,
+             ):
+    fitsfile = pyfits.open(imfile, memmap=True)
+    header = fitsfile[0].header
+    beam = [
+            float(header['BMAJ'])*3600.,
+            float(header['BMIN'])*3600.,
+            float(header['BPA']),
+           ]
+    pixels = header['NAXIS1']
+    pixel_scale = header['CDELT1']
+    image = fitsfile[0].data[0, 0]
+    if crop:
+        #Chop the psf to desired size around the centre pixel
+        centre = pixels//2
+        sl = slice(centre - CROP_SIZE//2, centre + CROP_SIZE//2)
+        image = np.array(image[sl, sl])
+        pixels = CROP_SIZE
+    return [beam, pixels, pixel_scale, image, fitsfile]
 
 
 # Take sections through the beam major and minor axes
@@ -34,25 +77,7 @@ def along_axes(
                output=None,
               ):
     """Plot a slice through the major and minor axes of a beam."""
-    if crop:
-        #Chop the psf to desired size
-        t = pyfits.open(imfile, mode='update')
-        t[0].header['NAXIS1'] = 480
-        t[0].header['NAXIS2'] = 480
-        t[0].header['CRPIX1'] = 241
-        t[0].header['CRPIX2'] = 241
-        sl = slice(3600-240, 3600+240)
-        t[0].data = t[0].data[:, :, sl, sl]
-        t.flush()
-        t.close()
-
-    fitsfile = pyfits.open(imfile)
-
-    bmaj = float(fitsfile[0].header['BMAJ'])*3600.
-    bmin = float(fitsfile[0].header['BMIN'])*3600.
-    bpa = float(fitsfile[0].header['BPA'])
-    pixels = fitsfile[0].header['NAXIS1']
-    pixel_scale = fitsfile[0].header['CDELT1']
+    [[bmaj, bmin, bpa], pixels, pixel_scale, image, fitsfile] = _read_psf(imfile, crop=crop)  # noqa
     num = 100000
 
     if bpa <= 45.0:
@@ -97,9 +122,16 @@ def along_axes(
     # #Cut 50% of the beam
     # cut=int(pixels*0.25)
 
-    # Extract the values along the line, using cubic interpolation
-    major = ndimage.map_coordinates(fitsfile[0].data[0, 0], np.vstack((xmaj_r, ymaj_r)), order=1)
-    minor = ndimage.map_coordinates(fitsfile[0].data[0, 0], np.vstack((xmin_r, ymin_r)), order=1)
+    # Extract the values along the line, using linear interpolation
+    if crop:
+        major = ndimage.map_coordinates(image, np.vstack((xmaj_r, ymaj_r)), order=1)  # noqa
+        minor = ndimage.map_coordinates(image, np.vstack((xmin_r, ymin_r)), order=1)  # noqa
+    else:
+        # only the pixels next to the lines are read from the memmap
+        major = _bilinear(image, xmaj_r, ymaj_r)
+        minor = _bilinear(image, xmin_r, ymin_r)
+    del image
+    fitsfile.close()
     pixels_asec = np.linspace(0., line_length, num) - (line_length/2)
 
     # fig = plt.figure(figsize=(10,7))
@@ -123,13 +155,24 @@ def along_axes(
 def uv(
        msname,
        output=None,
+       density=None,  # plot density image, default for large MS
+       bins=UV_BINS,
+       chunksize=UV_CHUNK,
       ):
     """Plot the uv coverage in a measurement set"""
 
     import casacore.tables
 
     tab = casacore.tables.table(msname)
-    uv = tab.getcol("UVW")[:, :2]
+    try:
+        if density is None:
+            density = tab.nrows() > UV_SCATTER_MAX
+        if density:
+            uv_density(tab, output=output, bins=bins, chunksize=chunksize)
+            return
+        uv = tab.getcol("UVW")[:, :2]
+    finally:
+        tab.close()
 
     # fig = plt.figure(figsize=(20, 13))
     plt.figure(figsize=(20, 13))
@@ -145,4 +188,64 @@ def uv(
         plt.savefig(output)
 
 
+# Upper bound on the uv distance from the antenna positions in the MS
+def uv_extent(tab):
+    import casacore.tables
+
+    try:
+        anttab = casacore.tables.table(tab.getkeyword('ANTENNA'), ack=False)
+        try:
+            positions = anttab.getcol('POSITION')
+        finally:
+            anttab.close()
+        return 2.*np.max(np.linalg.norm(positions - positions.mean(axis=0), axis=1))  # noqa
+    except RuntimeError:
+        # no usable ANTENNA subtable, scan the UVW column once
+        uvmax = 0.
+        for startrow in range(0, tab.nrows(), UV_CHUNK):
+            uvw = tab.getcol('UVW', startrow=startrow, nrow=UV_CHUNK)
+            uvmax = max(uvmax, np.abs(uvw[:, :2]).max())
+        return uvmax
+
+
+def uv_density(
+               tab,                 # open measurement set table
+               output=None,
+               bins=UV_BINS,        # histogram cells per axis
+               chunksize=UV_CHUNK,  # rows read per getcol
+              ):
+    """Plot the uv coverage as a density image, reading UVW in row chunks"""
+    from matplotlib.colors import LogNorm
+
+    extent = uv_extent(tab)
+    if extent <= 0:
+        extent = 1.
+    uvrange = [[-extent, extent], [-extent, extent]]
+    counts = np.zeros((bins, bins))
+    for startrow in range(0, tab.nrows(), chunksize):
+        uvw = tab.getcol('UVW', startrow=startrow, nrow=chunksize)
+        hist = np.histogram2d(uvw[:, 0], uvw[:, 1], bins=bins, range=uvrange)[0]  # noqa
+        # conjugate samples (-u, -v) land in the mirrored cells
+        counts += hist + hist[::-1, ::-1]
+
+    plt.figure(figsize=(20, 13))
+    plt.title('uv coverage', fontsize=30)
+    image = plt.imshow(
+                       np.ma.masked_equal(counts.T, 0),
+                       origin='lower',
+                       extent=[-extent, extent, -extent, extent],
+                       norm=LogNorm(),
+                       cmap='Blues',
+                       interpolation='nearest',
+                      )
+    bar = plt.colorbar(image)
+    bar.set_label('samples per cell', fontsize=20)
+    plt.xlabel('u (meters)', fontsize=28)
+    plt.ylabel('v (meters)', fontsize=28)
+    plt.yticks(fontsize=28)
+    plt.xticks(fontsize=28)
+    if output is not None:
+        plt.savefig(output)
+
+
 # -fin-
@@ -0,0 +1,203 @@
+"""Resource usage per pipeline stage: wall/CPU time, peak memory and output"""
+
+from __future__ import print_function
+
+import contextlib
+import json
+import os
+import resource
+import sys
+import time
+
+# ru_maxrss is in kB on Linux and in bytes on macOS
+MAXRSS_UNIT = 1. if sys.platform == 'darwin' else 1024.
+MB = 1024.**2
+
+
+# Bytes written by this process and its reaped children
+def _bytes_written():
+    try:
+        with open('/proc/self/io') as fin:
+            for line in fin:
+                [field, value] = line.split(':')
+                if field == 'wchar':
+                    return int(value)
+    except (IOError, OSError, ValueError):
+        pass
+    # blocks written to storage, no /proc on this platform
+    usage = [resource.getrusage(who) for who in [resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN]]  # noqa
+    return 512*sum(use.ru_oublock for use in usage)
+
+
+# Reset the peak RSS of this process, Linux only
+def _reset_peak():
+    try:
+        with open('/proc/self/clear_refs', 'w') as fout:
+            fout.write('5')
+        return True
+    except (IOError, OSError):
+        return False
+
+
+# Peak RSS [bytes] of this process since the last reset
+def _peak_rss():
+    try:
+        with open('/proc/self/status') as fin:
+            for line in fin:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])*1024.
+    except (IOError, OSError, ValueError):
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss*MAXRSS_UNIT
+
+
+# Counters at the start or end of a stage
+def _snapshot():
+    self_use = resource.getrusage(resource.RUSAGE_SELF)
+    child_use = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return {
+            'wall': time.time(),
+            'cpu_self': self_use.ru_utime + self_use.ru_stime,
+            'cpu_children': child_use.ru_utime + child_use.ru_stime,
+            'bytes_written': _bytes_written(),
+           }
+
+
+class Report(object):
+    """
+    Records of the pipeline stages run in this process.
+
+    Every stage records wall time, CPU time of the process and of the
+    external tools it waited for, the peak RSS of the process, and the
+    bytes written.  The kernel only keeps the peak RSS of the largest child
+    process over the lifetime of the process, so stages that waited for a
+    tool record that as peak_rss_children_so_far_mb: an upper bound of the
+    peak of their own tools.  With profile set, every stage also runs under
+    cProfile and is dumped to '<prefix><stage>.prof'.
+    """
+
+    def __init__(
+                 self,
+                 profile=False,  # cProfile dump per stage
+                 prefix='',      # of the profile dump file names
+                ):
+        self.records = []
+        self.profile = profile
+        self.prefix = prefix
+        self._profiling = False
+
+    @contextlib.contextmanager
+    def stage(
+              self,
+              name,       # pipeline stage, e.g. 'makems' or 'image'
+              **labels    # e.g. the declination of the stage
+             ):
+        profiler = None
+        if self.profile and not self._profiling:
+            import cProfile
+            profiler = cProfile.Profile()
+        reset = _reset_peak()
+        start = _snapshot()
+        if profiler is not None:
+            self._profiling = True
+            profiler.enable()
+        try:
+            yield
+        finally:
+            if profiler is not None:
+                profiler.disable()
+                self._profiling = False
+            end = _snapshot()
+            record = dict(labels)
+            record.update({
+                           'stage': name,
+                           'pid': os.getpid(),
+                           'start': start['wall'],
+                           'wall_time': end['wall'] - start['wall'],
+                           'cpu_self': end['cpu_self'] - start['cpu_self'],
+                           'cpu_children': end['cpu_children'] - start['cpu_children'],  # noqa
+                           'bytes_written': end['bytes_written'] - start['bytes_written'],  # noqa
+                           # since the stage started if it could be reset,
+                           # else since the process started
+                           'peak_rss_mb': _peak_rss()/MB,
+                           'peak_rss_reset': reset,
+                          })
+            if record['cpu_children'] > 0:
+                # largest child of the process so far, not only this stage
+                record['peak_rss_children_so_far_mb'] = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss*MAXRSS_UNIT/MB  # noqa
+            if profiler is not None:
+                record['profile'] = os.path.abspath(self.profile_name(name, labels))  # noqa
+                profiler.dump_stats(record['profile'])
+            self.records.append(record)
+
+    def profile_name(self, name, labels):
+        suffix = ''.join('_%s' % labels[key] for key in sorted(labels))
+        basename = '%s%s%s' % (self.prefix, name, suffix.replace('/', '-'))
+        # repeated stages, e.g. a slice per PSF, are numbered
+        used = set(record.get('profile') for record in self.records)
+        filename = '%s.prof' % basename
+        count = 1
+        while os.path.abspath(filename) in used:
+            filename = '%s_%d.prof' % (basename, count)
+            count += 1
+        return filename
+
+    def merge(self, records):
+        """Add the records of another process, e.g. a pool worker."""
+        self.records.extend(records)
+
+    def totals(self):
+        """Summed wall time, CPU time and bytes written per stage name."""
+        totals = {}
+        for record in self.records:
+            total = totals.setdefault(record['stage'], {'count': 0, 'wall_time': 0., 'cpu_self': 0., 'cpu_children': 0., 'bytes_written': 0, 'peak_rss_mb': 0.})  # noqa
+            total['count'] += 1
+            for key in ['wall_time', 'cpu_self', 'cpu_children', 'bytes_written']:  # noqa
+                total[key] += record[key]
+            total['peak_rss_mb'] = max(total['peak_rss_mb'], record['peak_rss_mb'])  # noqa
+        return totals
+
+    def write(self, filename):
+        """Write the stage records and per stage totals as JSON."""
+        with open(filename, 'w') as fout:
+            json.dump({'stages': self.records, 'totals': self.totals()}, fout, indent=2, sort_keys=True)  # noqa
+        return filename
+
+
+# Report of this process, a no-op recorder unless started
+_REPORT = None
+
+
+def start(opts):
+    """Start recording if a report or profile is requested in opts."""
+    global _REPORT
+    _REPORT = None
+    if opts.report is not None or opts.profile:
+        _REPORT = Report(profile=opts.profile, prefix='%s_' % opts.array)
+    return _REPORT
+
+
+@contextlib.contextmanager
+def stage(name, **labels):
+    """Record a pipeline stage in the report of this process, if any."""
+    if _REPORT is None:
+        yield
+    else:
+        with _REPORT.stage(name, **labels):
+            yield
+
+
+def records():
+    return [] if _REPORT is None else list(_REPORT.records)
+
+
+def merge(worker_records):
+    if _REPORT is not None:
+        _REPORT.merge(worker_records)
+
+
+def write(opts):
+    if _REPORT is not None and opts.report is not None:
+        return _REPORT.write(opts.report)
+
+# -fin-
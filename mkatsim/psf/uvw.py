@@ -0,0 +1,287 @@
+"""Vectorized UVW simulator as in-process alternative to makems"""
+
+from __future__ import print_function
+from datetime import datetime
+
+import numpy as np
+import os
+import shutil
+
+from ..common.baselines import BaselineTable
+import cache
+
+# Reference epoch of the MS TIME column (MJD seconds)
+MJD_EPOCH = datetime(1858, 11, 17)
+# Max number of visibilities written per putcol call
+CHUNK_SIZE = 2**22
+
+
+# Convert makems/astropy style angle string to radians
+def angle(value):
+    value = str(value).strip()
+    if value.endswith('deg'):
+        return np.deg2rad(float(value[:-3]))
+    if value.endswith('rad'):
+        return float(value[:-3])
+    return np.deg2rad(float(value))
+
+
+# UTC datetime to MJD seconds
+def mjd_seconds(timestamp):
+    return (timestamp - MJD_EPOCH).total_seconds()
+
+
+# Greenwich mean sidereal time [rad] for an array of MJD seconds
+def gmst(mjd_sec):
+    days = np.asarray(mjd_sec, dtype=float)/86400. - 51544.5
+    gmst_deg = 280.46061837 + 360.98564736629*days
+    return np.deg2rad(np.mod(gmst_deg, 360.))
+
+
+# Time centroids for all scans as a (nscans, ntimes) array of MJD seconds
+def timestamps(
+               starttime,    # datetime of first scan
+               nscans,       # number of scans
+               ntimes,       # number of dumps per scan
+               dt,           # dump time [sec]
+               dtime,        # scan separation [hr]
+              ):
+    start = mjd_seconds(starttime)
+    scans = start + np.arange(nscans)*dtime*3600.
+    dumps = (np.arange(ntimes) + 0.5)*dt
+    return scans[:, np.newaxis] + dumps[np.newaxis, :]
+
+
+def compute(
+            positions,        # (nants, 3) ITRF antenna positions [m]
+            ra,               # J2000 right ascension [rad]
+            dec,              # J2000 declination [rad]
+            times,            # MJD seconds, any shape
+            autocorr=False,   # include zero length baselines
+            table=None,       # precomputed BaselineTable, else from positions
+           ):
+    """
+    Compute UVW coordinates for all baselines at all times in one pass.
+
+    Returns (uvw, time, ant1, ant2) as flat row arrays in time major order,
+    with uvw of shape (ntimes*nbaselines, 3) in meters.
+    """
+    if table is None:
+        table = BaselineTable.from_positions(positions, autocorr=autocorr)
+    [ant1, ant2, bl_xyz] = [table.ant1, table.ant2, table.xyz]
+
+    times = np.asarray(times, dtype=float).ravel()
+    ha = gmst(times) - ra
+    sin_ha, cos_ha = np.sin(ha), np.cos(ha)
+    sin_dec, cos_dec = np.sin(dec), np.cos(dec)
+    # rotation from ITRF baseline to (u,v,w), one matrix per timestamp
+    rot = np.empty((times.size, 3, 3))
+    rot[:, 0, 0] = sin_ha
+    rot[:, 0, 1] = cos_ha
+    rot[:, 0, 2] = 0.
+    rot[:, 1, 0] = -sin_dec*cos_ha
+    rot[:, 1, 1] = sin_dec*sin_ha
+    rot[:, 1, 2] = cos_dec
+    rot[:, 2, 0] = cos_dec*cos_ha
+    rot[:, 2, 1] = -cos_dec*sin_ha
+    rot[:, 2, 2] = sin_dec
+    uvw = np.einsum('tij,bj->tbi', rot, bl_xyz).reshape(-1, 3)
+
+    nbl = ant1.size
+    return [
+            uvw,
+            np.repeat(times, nbl),
+            np.tile(ant1, times.size).astype(np.int32),
+            np.tile(ant2, times.size).astype(np.int32),
+           ]
+
+
+# Channel centre frequencies per subband from the makems style options
+def frequencies(opts):
+    nchans = opts.nfreqs // opts.nbands
+    sfreqs = [float(freq) for freq in opts.sfreq.split(',')]
+    stepfreqs = [float(freq) for freq in opts.stepfreq.split(',')]
+    chan_freqs = []
+    for sfreq, stepfreq in zip(sfreqs, stepfreqs):
+        chan_freqs.append(sfreq + (np.arange(nchans) + 0.5)*stepfreq)
+    return [np.array(chan_freqs), np.array(stepfreqs)]
+
+
+# Number of scans and dumps per scan, as used by makems.ms_make
+def scan_layout(opts):
+    nscans = int(12./opts.dtime)
+    ntimes = int((opts.synthesis/opts.dt) / nscans) + 1
+    return [nscans, ntimes]
+
+
+def write_ms(
+             msname,           # name of measurement set to create
+             uvw,              # (nrows, 3) UVW coordinates
+             time,             # (nrows,) MJD seconds
+             ant1,             # (nrows,) ANTENNA1
+             ant2,             # (nrows,) ANTENNA2
+             interval,         # dump time [sec]
+             chan_freqs,       # (nbands, nchans) channel frequencies [Hz]
+             chan_widths,      # (nbands,) channel width [Hz]
+             ra,               # phase centre [rad]
+             dec,              # phase centre [rad]
+             tblname,          # CASA ANTENNA table to copy into the MS
+             scan=None,        # (nrows,) SCAN_NUMBER
+             telescope='MeerKAT',
+            ):
+    """Write a minimal measurement set using bulk column writes."""
+    import casacore.tables as tables
+    from mstables import fill_table
+
+    nbands, nchans = chan_freqs.shape
+    ncorr = 4
+    nvis = uvw.shape[0]
+    nrows = nvis*nbands
+
+    tabdesc = tables.maketabdesc([
+        tables.makearrcoldesc('DATA', 0j, ndim=2, shape=[nchans, ncorr]),
+        tables.makearrcoldesc('FLAG', False, ndim=2, shape=[nchans, ncorr]),
+        tables.makearrcoldesc('WEIGHT', 0., ndim=1, shape=[ncorr]),
+        tables.makearrcoldesc('SIGMA', 0., ndim=1, shape=[ncorr]),
+        ])
+    ms = tables.default_ms(msname, tabdesc)
+    try:
+        ms.addrows(nrows)
+        # one block of visibility rows per subband
+        for band in range(nbands):
+            row = band*nvis
+            ms.putcol('UVW', uvw, startrow=row, nrow=nvis)
+            ms.putcol('TIME', time, startrow=row, nrow=nvis)
+            ms.putcol('TIME_CENTROID', time, startrow=row, nrow=nvis)
+            ms.putcol('ANTENNA1', ant1, startrow=row, nrow=nvis)
+            ms.putcol('ANTENNA2', ant2, startrow=row, nrow=nvis)
+            ms.putcol('DATA_DESC_ID', np.full(nvis, band, dtype=np.int32), startrow=row, nrow=nvis)  # noqa
+            if scan is not None:
+                ms.putcol('SCAN_NUMBER', scan, startrow=row, nrow=nvis)
+        ms.putcol('INTERVAL', np.full(nrows, interval))
+        ms.putcol('EXPOSURE', np.full(nrows, interval))
+        ms.putcol('WEIGHT', np.ones((nrows, ncorr), dtype=np.float32))
+        ms.putcol('SIGMA', np.ones((nrows, ncorr), dtype=np.float32))
+        # imaging columns are large, write them in chunks of rows
+        chunk = max(1, CHUNK_SIZE // (nchans*ncorr))
+        for row in range(0, nrows, chunk):
+            nrow = min(chunk, nrows - row)
+            ms.putcol('DATA', np.zeros((nrow, nchans, ncorr), dtype=np.complex64), startrow=row, nrow=nrow)  # noqa
+            ms.putcol('FLAG', np.zeros((nrow, nchans, ncorr), dtype=bool), startrow=row, nrow=nrow)  # noqa
+    finally:
+        ms.close()
+
+    widths = np.repeat(chan_widths[:, np.newaxis], nchans, axis=1)
+    fill_table('%s/SPECTRAL_WINDOW' % msname, [
+               ('NUM_CHAN', np.full(nbands, nchans, dtype=np.int32)),
+               ('CHAN_FREQ', chan_freqs),
+               ('CHAN_WIDTH', widths),
+               ('EFFECTIVE_BW', widths),
+               ('RESOLUTION', widths),
+               ('REF_FREQUENCY', chan_freqs[:, 0]),
+               ('TOTAL_BANDWIDTH', nchans*chan_widths),
+               ('NAME', ['SB%d' % band for band in range(nbands)]),
+               ])
+    fill_table('%s/POLARIZATION' % msname, [
+               ('NUM_CORR', np.array([ncorr], dtype=np.int32)),
+               ('CORR_TYPE', np.array([[9, 10, 11, 12]], dtype=np.int32)),  # XX XY YX YY  # noqa
+               ('CORR_PRODUCT', np.array([[[0, 0], [0, 1], [1, 0], [1, 1]]], dtype=np.int32)),  # noqa
+               ])
+    fill_table('%s/DATA_DESCRIPTION' % msname, [
+               ('SPECTRAL_WINDOW_ID', np.arange(nbands, dtype=np.int32)),
+               ('POLARIZATION_ID', np.zeros(nbands, dtype=np.int32)),
+               ])
+    direction = np.array([[[ra, dec]]])
+    fill_table('%s/FIELD' % msname, [
+               ('PHASE_DIR', direction),
+               ('DELAY_DIR', direction),
+               ('REFERENCE_DIR', direction),
+               ('NAME', ['psf']),
+               ])
+    fill_table('%s/OBSERVATION' % msname, [
+               ('TELESCOPE_NAME', [telescope]),
+               ('TIME_RANGE', np.array([[time.min(), time.max()]])),
+               ])
+
+    # replace the empty ANTENNA subtable with the simulation antenna table
+    antenna_dir = '%s/ANTENNA' % msname
+    shutil.rmtree(antenna_dir, ignore_errors=True)
+    shutil.copytree(tblname, antenna_dir)
+    return msname
+
+
+# MS name and effective simulation config for one declination
+def ms_config(opts, starttime):
+    [nscans, ntimes] = scan_layout(opts)
+    msname = '%s_%sdeg_%.2fsec.ms_p0' % (opts.array, opts.declination, opts.synthesis)  # noqa
+    cfg_dict = {
+       'NScans': nscans,
+       'ScanSeparation': opts.dtime,
+       'NBands': opts.nbands,
+       'NFrequencies': opts.nfreqs,
+       'StartFreq': opts.sfreq,
+       'StepFreq': opts.stepfreq,
+       'StartTime': starttime.strftime("%Y/%m/%d/%H:%M:%S"),
+       'StepTime': opts.dt,
+       'NTimes': ntimes,
+       'RightAscension': opts.rightascension,
+       'Declination': opts.declination,
+       'MSName': msname,
+       }
+    return [msname, cfg_dict]
+
+
+# Cache key of the measurement set simulated for opts
+def ms_key(opts, starttime):
+    [msname, cfg_dict] = ms_config(opts, starttime)
+    return cache.key('native', cfg_dict, cache.tree_digest(opts.tblname))
+
+
+# Simulate all scans of one declination into a single measurement set
+def ms_make(opts, starttime):
+    import casacore.tables
+
+    [msname, cfg_dict] = ms_config(opts, starttime)
+    store = cache.from_opts(opts)
+    if store is not None:
+        key = ms_key(opts, starttime)
+        if store.fetch(key) is not None:
+            return msname
+
+    anttbl = casacore.tables.table(opts.tblname, ack=False)
+    try:
+        positions = anttbl.getcol('POSITION')
+    finally:
+        anttbl.close()
+
+    ra = angle(opts.rightascension)
+    dec = angle(opts.declination)
+    [nscans, ntimes] = scan_layout(opts)
+    times = timestamps(starttime, nscans, ntimes, opts.dt, opts.dtime)
+    [uvw, time, ant1, ant2] = compute(positions, ra, dec, times)
+    scan = (np.arange(time.size) // (time.size // nscans)).astype(np.int32)
+    [chan_freqs, chan_widths] = frequencies(opts)
+
+    if os.path.isdir(msname):
+        shutil.rmtree(msname)
+    if opts.debug:
+        print('Native UVW simulation: %d scans, %d dumps, %d rows' % (nscans, ntimes, time.size))  # noqa
+    write_ms(
+             msname,
+             uvw,
+             time,
+             ant1,
+             ant2,
+             opts.dt,
+             chan_freqs,
+             chan_widths,
+             ra,
+             dec,
+             opts.tblname,
+             scan=scan,
+            )
+    if store is not None:
+        store.store(key, [msname])
+    return msname
+
+# -fin-
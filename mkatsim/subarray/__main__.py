@@ -17,13 +17,25 @@ def cli():
                      dest='subarray',
                      type=str,
                      default=None,
-                     help='Name of subarray as defined in config')
+                     help="Name of subarray as defined in config, '?' to list, or 'all' to compare all")  # noqa
     group.add_option('--ant_list',
                      action='store',
                      dest='ant_list',
                      type=str,
                      default=None,
                      help='Comma separated list of antenna names')
+    group.add_option('--table',
+                     action='store',
+                     dest='table',
+                     type=str,
+                     default=None,
+                     help='Write the --sub all statistics to a CSV file')
+    group.add_option('--freq',
+                     action='store',
+                     dest='freq',
+                     type=float,
+                     default=1284.,  # MHz
+                     help='Observation frequency in MHz for the snapshot PSF width (default %default)')  # noqa
     parser.add_option_group(group)
 
     # layout
@@ -44,9 +56,64 @@ def cli():
                      default=False,
                      help='Save selected subarray to ITRF file')
     parser.add_option_group(group)
+
+    # subarray optimisation
+    group = OptionGroup(parser, 'Subarray Optimisation')
+    group.add_option('--optimize',
+                     action='store',
+                     dest='optimize',
+                     type=int,
+                     default=None,
+                     metavar='K',
+                     help='Select the K antennas with the best objective')
+    group.add_option('--objective',
+                     action='store',
+                     dest='objective',
+                     type='choice',
+                     choices=['uv', 'sidelobe'],
+                     default='uv',
+                     help="Maximise the nr of uv cells covered ('uv'), or minimise the PSF peak sidelobe ('sidelobe') (default %default)")  # noqa
+    group.add_option('--dec',
+                     action='store',
+                     dest='declination',
+                     type=str,
+                     default='-30d00m00.0s',
+                     help='Declination of the observation (default %default)')
+    group.add_option('--synthesis',
+                     action='store',
+                     dest='synthesis',
+                     type=float,
+                     default=14400,  # sec
+                     help='Synthesis time in seconds, centred on transit (default %default)')  # noqa
+    group.add_option('--cell',
+                     action='store',
+                     dest='cell',
+                     type=float,
+                     default=13.5,  # m
+                     help='uv cell size in meters (default %default)')
+    group.add_option('--anneal',
+                     action='store',
+                     dest='anneal',
+                     type=int,
+                     default=1000,
+                     help='Simulated annealing iterations after the greedy search (default %default)')  # noqa
+    group.add_option('--seed',
+                     action='store',
+                     dest='seed',
+                     type=int,
+                     default=None,
+                     help='Random seed for the annealing')
+    group.add_option('--jobs',
+                     action='store',
+                     dest='jobs',
+                     type=int,
+                     default=1,
+                     help='Nr of processes evaluating candidate antennas (default %default)')  # noqa
+    parser.add_option_group(group)
     (opts, args) = parser.parse_args()
 
-    if len(args) < 1:
+    # listing the predefined subarrays needs no catalogue
+    if len(args) < 1 and opts.subarray != '?':
         print('Antenna position file needed for Array Map generation')
         parser.print_usage()
         raise SystemExit
@@ -2,12 +2,18 @@
 
 from __future__ import print_function
 
-import matplotlib.pyplot as plt
+import sys
 
 from ..common import coordinates
 
 
 def main(opts, args):
+    # Listing the subarray names needs no catalogue, coordinates or plotting
+    if opts.subarray == '?':
+        from mkat_config import Subarrays
+        Subarrays.names_only().list_subs()
+        return
+
     # Reference location
     ref_location = coordinates.location(opts.lat, opts.lon, opts.alt)
     # Array location
@@ -23,30 +29,88 @@ def main(opts, args):
 
 ## Options for selecting antennas into subarrays
     from mkat_config import Subarrays
-    from telescopearray import show_subarray
     mkat = Subarrays(ref_location, array_geocentric, ant_list)
 
+    if opts.subarray == 'all':
+        # the custom subarray is a row of the table, not plotted or saved
+        compare_subs(opts, mkat)
+    else:
+        show_subs(opts, ref_location, array_geocentric, mkat)
+
+## Search for the subarray of K antennas with the best objective
+    if opts.optimize is not None:
+        optimize_sub(opts, ref_location, array_geocentric, mkat)
+
+    if not opts.savegraph:
+        opts.verbose = True
+    # only show figures if any plotting was done
+    if opts.verbose and 'matplotlib.pyplot' in sys.modules:
+        import matplotlib.pyplot as plt
+        try:
+            plt.show()
+        except:
+            pass  # nothing to show
+
+
+# Subarray maps are only drawn as figures if they will be displayed
+def _show(opts):
+    return opts.verbose or not opts.savegraph
+
+
+# Show the selected subarray, and the custom one saved if requested
+def show_subs(opts, ref_location, array_geocentric, mkat):
     if opts.subarray is not None:
-        if opts.subarray == '?':
-            mkat.list_subs()
-        else:
-            subarray_geocentric = mkat.get_sub(opts.subarray)
-            show_subarray(ref_location, array_geocentric, subarray_geocentric, subname=opts.subarray, savegraph=opts.savegraph)  # noqa
+        from telescopearray import show_subarray
+        subarray_geocentric = mkat.get_sub(opts.subarray)
+        show_subarray(ref_location, array_geocentric, subarray_geocentric, subname=opts.subarray, savegraph=opts.savegraph, show=_show(opts))  # noqa
 
     if opts.ant_list is not None:
+        from telescopearray import show_subarray
         subarray_geocentric = mkat.def_sub(opts.ant_list.split(','))
-        show_subarray(ref_location, array_geocentric, subarray_geocentric, subname='custom', radii=False, savegraph=opts.savegraph)  # noqa
+        show_subarray(ref_location, array_geocentric, subarray_geocentric, subname='custom', radii=False, savegraph=opts.savegraph, show=_show(opts))  # noqa
 
         if opts.savesubarray:
             from telescopearray import save_array
             save_array(subarray_geocentric)
 
-    if not opts.savegraph:
-        opts.verbose = True
-    if opts.verbose:
-        try:
-            plt.show()
-        except:
-            pass  # nothing to show
+
+# Select, show and optionally save the subarray with the best objective
+def optimize_sub(opts, ref_location, array_geocentric, mkat):
+    from astropy.coordinates import Angle
+    from astropy import units as u
+    from optimize import optimize
+    [ant_names, score] = optimize(
+                                  mkat.array,
+                                  opts.optimize,
+                                  ref_location.lon.rad,
+                                  Angle(opts.declination, unit=u.deg).rad,
+                                  opts.synthesis,
+                                  objective=opts.objective,
+                                  cell=opts.cell,
+                                  iterations=opts.anneal,
+                                  jobs=opts.jobs,
+                                  seed=opts.seed,
+                                 )
+    print('Optimised subarray of %d antennas (%s objective %g):\n\t%s' % (opts.optimize, opts.objective, score, ','.join(ant_names)))  # noqa
+    from telescopearray import show_subarray
+    subarray_geocentric = mkat.def_sub(ant_names)
+    show_subarray(ref_location, array_geocentric, subarray_geocentric, subname='optimized', radii=False, savegraph=opts.savegraph, show=_show(opts))  # noqa
+
+    if opts.savesubarray:
+        from telescopearray import save_array
+        save_array(subarray_geocentric)
+
+
+# Statistics of all predefined (and the custom) subarrays in one table
+def compare_subs(opts, mkat):
+    import stats
+    subarrays = [[name, mkat.__dict__[name]] for name in sorted(mkat.sub_names())]  # noqa
+    if opts.ant_list is not None:
+        subarrays.append(['custom', [ant.strip() for ant in opts.ant_list.split(',')]])  # noqa
+    [rows, edges] = stats.subarray_stats(mkat.array, subarrays, freq=opts.freq*1e6)  # noqa
+    stats.show_table(rows, edges)
+    if opts.table is not None:
+        outfile = stats.write_table(rows, edges, opts.table)
+        print('Subarray statistics written to %s' % outfile)
 
 # -fin-
@@ -0,0 +1,262 @@
+"""Select subarrays with the best uv coverage or PSF sidelobes"""
+
+from __future__ import print_function
+
+import multiprocessing
+
+import numpy as np
+
+from ..psf import uvw
+
+# uv cell size [m], about a dish diameter
+CELL_SIZE = 13.5
+# Samples along every baseline track
+NTIMES = 64
+# Max nr of candidate PSFs evaluated together
+PSF_BATCH = 8
+OBJECTIVES = ['uv', 'sidelobe']
+
+
+class UVCells(object):
+    """
+    uv cells covered by the track of every baseline of an array.
+
+    The cells of a baseline, including those of the conjugate track, are
+    stored once as unique cell indices in compressed rows, so that the
+    coverage of any subarray can be updated one antenna at a time.
+    """
+
+    def __init__(
+                 self,
+                 table,            # BaselineTable of the candidate antennas
+                 lon,              # longitude of the array reference [rad]
+                 dec,              # declination [rad]
+                 synthesis,        # track length [sec], centred on transit
+                 cell=CELL_SIZE,   # uv cell size [m]
+                 ntimes=NTIMES,    # samples along a track
+                ):
+        self.nants = table.nants
+        # local hour angle zero halfway through the track, uvw.compute
+        # takes the Greenwich hour angle of the ITRF baselines
+        times = np.linspace(-synthesis/2., synthesis/2., ntimes)
+        ra = uvw.gmst(0.) + lon
+        uv = uvw.compute(None, ra, dec, times, table=table)[0]
+        nbl = len(table)
+        self.ant1 = table.ant1
+        self.ant2 = table.ant2
+        uv = uv[:, :2].reshape(ntimes, nbl, 2)
+
+        half = int(np.ceil(np.abs(uv).max()/cell)) if uv.size else 0
+        self.ngrid = 2*half + 1
+        ncells = self.ngrid**2
+        iu = np.rint(uv[..., 0]/cell).astype(int) + half
+        iv = np.rint(uv[..., 1]/cell).astype(int) + half
+        cells = np.vstack((
+                           iv*self.ngrid + iu,
+                           (self.ngrid - 1 - iv)*self.ngrid + (self.ngrid - 1 - iu),  # noqa
+                          ))
+        # unique cells per baseline, sorted by baseline
+        keys = np.unique((np.arange(nbl)[np.newaxis]*ncells + cells).ravel())
+        self.cells = keys % ncells
+        self.offsets = np.searchsorted(keys // ncells, np.arange(nbl + 1))
+
+        self.pairs = np.full((self.nants, self.nants), -1, dtype=int)
+        self.pairs[self.ant1, self.ant2] = np.arange(nbl)
+        self.pairs[self.ant2, self.ant1] = np.arange(nbl)
+
+    @property
+    def ncells(self):
+        return self.ngrid**2
+
+    def baseline_cells(self, ant, others):
+        """Cells of the baselines between ant and the others, with repeats."""
+        bls = self.pairs[ant, np.asarray(others, dtype=int)]
+        bls = bls[bls >= 0]
+        if bls.size == 0:
+            return np.zeros(0, dtype=int)
+        return np.concatenate([self.cells[self.offsets[bl]:self.offsets[bl+1]] for bl in bls])  # noqa
+
+
+# Normalised PSFs of uv cell occupancy grids, uniform weighting
+def _psfs(grids):
+    psfs = np.fft.fftshift(np.fft.ifft2(np.fft.ifftshift(grids, axes=(1, 2))), axes=(1, 2)).real  # noqa
+    return psfs
+
+
+# Peak sidelobe of occupancy grids, relative to the PSF peak
+def peak_sidelobes(grids):
+    from ..psf import metrics
+    psfs = _psfs(np.asarray(grids, dtype=float))
+    values = metrics.stack_metrics(psfs, 1., np.zeros(psfs.shape[0]))
+    return np.where(np.isnan(values['peak_sidelobe']), 1., values['peak_sidelobe'])  # noqa
+
+
+class Coverage(object):
+    """uv cell counts of a subarray, updated as antennas are added/removed"""
+
+    def __init__(self, uvcells, selected=()):
+        self.uvcells = uvcells
+        self.counts = np.zeros(uvcells.ncells, dtype=np.int32)
+        self.selected = []
+        self.covered = 0
+        for ant in selected:
+            self.add(ant)
+
+    def gain(self, ant):
+        """Nr of cells newly covered when adding ant."""
+        cells = self.uvcells.baseline_cells(ant, self.selected)
+        return np.unique(cells[self.counts[cells] == 0]).size
+
+    def add(self, ant):
+        self.covered += self.gain(ant)
+        np.add.at(self.counts, self.uvcells.baseline_cells(ant, self.selected), 1)  # noqa
+        self.selected.append(ant)
+
+    def remove(self, ant):
+        self.selected.remove(ant)
+        cells = self.uvcells.baseline_cells(ant, self.selected)
+        np.subtract.at(self.counts, cells, 1)
+        self.covered -= np.unique(cells[self.counts[cells] == 0]).size
+
+    def grid(self, ant=None):
+        """Occupancy grid of the subarray, optionally with ant added."""
+        occupied = self.counts > 0
+        if ant is not None:
+            occupied = occupied.copy()
+            occupied[self.uvcells.baseline_cells(ant, self.selected)] = True
+        return occupied.reshape(self.uvcells.ngrid, self.uvcells.ngrid)
+
+    def score(self, objective='uv'):
+        """Objective of the subarray, higher is better."""
+        if objective == 'uv':
+            return float(self.covered)
+        return -float(peak_sidelobes([self.grid()])[0])
+
+    def scores(self, candidates, objective='uv'):
+        """Objective of the subarray with each candidate added."""
+        if objective == 'uv':
+            return np.array([self.covered + self.gain(ant) for ant in candidates], dtype=float)  # noqa
+        scores = []
+        for start in range(0, len(candidates), PSF_BATCH):
+            grids = [self.grid(ant) for ant in candidates[start:start+PSF_BATCH]]  # noqa
+            scores.extend(-peak_sidelobes(grids))
+        return np.array(scores)
+
+
+# Pool worker state, the uv cells are sent once per process
+_UVCELLS = None
+
+
+def _init_worker(uvcells):
+    global _UVCELLS
+    _UVCELLS = uvcells
+
+
+def _scores_worker(args):
+    [selected, candidates, objective] = args
+    return Coverage(_UVCELLS, selected).scores(candidates, objective)
+
+
+# Objective of the coverage with each candidate added, spread over the pool
+def _evaluate(coverage, candidates, objective, pool=None, jobs=1):
+    if pool is None or len(candidates) < 2:
+        return coverage.scores(candidates, objective)
+    nchunks = min(len(candidates), 4*jobs)
+    chunks = [list(chunk) for chunk in np.array_split(candidates, nchunks)]
+    results = pool.map(_scores_worker, [[list(coverage.selected), chunk, objective] for chunk in chunks])  # noqa
+    return np.concatenate(results)
+
+
+def greedy(
+           uvcells,
+           nants,          # nr of antennas to select
+           objective='uv',
+           start=(),       # antennas that must be in the subarray
+           pool=None,
+           jobs=1,
+          ):
+    """Add the best antenna for the objective until nants are selected."""
+    coverage = Coverage(uvcells, start)
+    if len(coverage.selected) == 0 and nants >= 2:
+        # start from the baseline covering the most cells
+        bl = int(np.argmax(np.diff(uvcells.offsets)))
+        coverage.add(uvcells.ant1[bl])
+        coverage.add(uvcells.ant2[bl])
+    while len(coverage.selected) < nants:
+        candidates = [ant for ant in range(uvcells.nants) if ant not in coverage.selected]  # noqa
+        scores = _evaluate(coverage, candidates, objective, pool=pool, jobs=jobs)  # noqa
+        coverage.add(candidates[int(np.argmax(scores))])
+    return coverage
+
+
+def anneal(
+           coverage,
+           iterations=1000,
+           objective='uv',
+           seed=None,
+          ):
+    """Improve a subarray by simulated annealing over antenna swaps."""
+    rng = np.random.RandomState(seed)
+    nants = coverage.uvcells.nants
+    score = coverage.score(objective)
+    best = [score, list(coverage.selected)]
+    if iterations <= 0 or len(coverage.selected) in [0, nants]:
+        return best
+    temp0 = max(0.02*abs(score), 1e-6)
+    cooling = 1e-3**(1./iterations)
+    temp = temp0
+    for _ in range(iterations):
+        unselected = np.setdiff1d(np.arange(nants), coverage.selected)
+        out_ant = coverage.selected[rng.randint(len(coverage.selected))]
+        in_ant = int(unselected[rng.randint(unselected.size)])
+        coverage.remove(out_ant)
+        coverage.add(in_ant)
+        new_score = coverage.score(objective)
+        if new_score >= score or rng.rand() < np.exp((new_score - score)/temp):  # noqa
+            score = new_score
+            if score > best[0]:
+                best = [score, list(coverage.selected)]
+        else:
+            coverage.remove(in_ant)
+            coverage.add(out_ant)
+        temp *= cooling
+    return best
+
+
+def optimize(
+             array,                 # AntennaArray of candidate antennas
+             nants,                 # nr of antennas to select
+             lon,                   # longitude of the array reference [rad]
+             dec,                   # declination [rad]
+             synthesis,             # track length [sec], centred on transit
+             objective='uv',        # 'uv' cells covered or 'sidelobe' level
+             cell=CELL_SIZE,        # uv cell size [m]
+             iterations=1000,       # annealing iterations after greedy search
+             jobs=1,                # processes evaluating greedy candidates
+             seed=None,
+            ):
+    """
+    Select nants antennas from the array maximising the objective.
+
+    Returns [names, score], the score is the nr of uv cells covered, or
+    minus the peak sidelobe for the 'sidelobe' objective.
+    """
+    if objective not in OBJECTIVES:
+        raise RuntimeError('Unknown objective %s' % objective)
+    if nants > len(array):
+        raise RuntimeError('Cannot select %d from %d antennas' % (nants, len(array)))  # noqa
+    uvcells = UVCells(array.baselines(), lon, dec, synthesis, cell=cell)
+
+    pool = None
+    if jobs > 1:
+        pool = multiprocessing.Pool(processes=jobs, initializer=_init_worker, initargs=(uvcells,))  # noqa
+    try:
+        coverage = greedy(uvcells, nants, objective=objective, pool=pool, jobs=jobs)  # noqa
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    [score, selected] = anneal(coverage, iterations=iterations, objective=objective, seed=seed)  # noqa
+    return [[str(name) for name in array.names[sorted(selected)]], score]
+
+# -fin-
@@ -0,0 +1,84 @@
+"""Local map projection of array layouts, a few km across"""
+
+import numpy as np
+
+# WGS84 equatorial radius [m]
+EARTH_RADIUS = 6378137.
+# Graticule spacing [deg]
+GRID_STEP = 0.01
+
+
+class Mercator(object):
+    """
+    Spherical Mercator projection centred on the array reference location.
+
+    Called like a Basemap instance: m(lon, lat) gives map coordinates [m]
+    east and north of the reference, m(x, y, inverse=True) the geodetic
+    coordinates [deg].  The scale is true at the reference latitude, over
+    a few km the distortion is far below the plot resolution.
+    """
+
+    def __init__(
+                 self,
+                 lon_0,  # reference longitude [deg]
+                 lat_0,  # reference latitude [deg]
+                ):
+        self.lon_0 = float(lon_0)
+        self.lat_0 = float(lat_0)
+        self.radius = EARTH_RADIUS*np.cos(np.deg2rad(self.lat_0))
+        self.y_0 = self._stretch(self.lat_0)
+
+    @staticmethod
+    def _stretch(lat):
+        return np.log(np.tan(np.pi/4. + np.deg2rad(lat)/2.))
+
+    def __call__(self, lon, lat, inverse=False):
+        if inverse:
+            [x, y] = [np.asarray(lon, dtype=float), np.asarray(lat, dtype=float)]  # noqa
+            lon = self.lon_0 + np.rad2deg(x/self.radius)
+            lat = np.rad2deg(2.*np.arctan(np.exp(y/self.radius + self.y_0)) - np.pi/2.)  # noqa
+            return (lon, lat)
+        lon = np.asarray(lon, dtype=float)
+        lat = np.asarray(lat, dtype=float)
+        x = self.radius*np.deg2rad(lon - self.lon_0)
+        y = self.radius*(self._stretch(lat) - self.y_0)
+        return (x, y)
+
+    def extent(
+               self,
+               lon,            # deg
+               lat,            # deg
+               margin=0.005,   # added around the positions [deg]
+               aspect=None,    # height/width of the plot area
+              ):
+        """
+        Map limits [xmin, xmax, ymin, ymax] around the positions.
+
+        With an aspect the shorter side is widened, so that the map fills
+        the plot area at equal scale in x and y.
+        """
+        [x0, y0] = self(np.min(lon) - margin, np.min(lat) - margin)
+        [x1, y1] = self(np.max(lon) + margin, np.max(lat) + margin)
+        if aspect is not None:
+            [width, height] = [x1 - x0, y1 - y0]
+            if height < aspect*width:
+                pad = (aspect*width - height)/2.
+                [y0, y1] = [y0 - pad, y1 + pad]
+            else:
+                pad = (height/aspect - width)/2.
+                [x0, x1] = [x0 - pad, x1 + pad]
+        return [float(x0), float(x1), float(y0), float(y1)]
+
+    def graticule(
+                  self,
+                  extent,          # [xmin, xmax, ymin, ymax] map limits
+                  step=GRID_STEP,  # deg
+                 ):
+        """Meridians and parallels [deg] on whole multiples of step inside the map."""  # noqa
+        [lon0, lat0] = self(extent[0], extent[2], inverse=True)
+        [lon1, lat1] = self(extent[1], extent[3], inverse=True)
+        meridians = np.arange(np.ceil(lon0/step), np.floor(lon1/step) + 1)*step  # noqa
+        parallels = np.arange(np.ceil(lat0/step), np.floor(lat1/step) + 1)*step  # noqa
+        return [meridians, parallels]
+
+# -fin-
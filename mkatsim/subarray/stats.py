@@ -0,0 +1,116 @@
+"""Compare subarray configurations in one pass over the baselines"""
+
+from __future__ import print_function
+
+import csv
+import sys
+
+import numpy as np
+
+C = 299792458.  # m/s
+# Radial bins of the uv density profile
+NBINS = 8
+FWHM = 2.*np.sqrt(2.*np.log(2.))
+
+
+def subarray_stats(
+                   array,          # AntennaArray of all antennas
+                   subarrays,      # list of [name, antenna names]
+                   freq=1284.e6,   # observation frequency [Hz]
+                   nbins=NBINS,    # radial bins of the uv density profile
+                  ):
+    """
+    Baseline statistics and snapshot PSF width of every subarray.
+
+    All subarrays are evaluated together on the baseline table of the full
+    array, using a (nsubarrays, nbaselines) membership mask.  The snapshot
+    uv coverage is the ENU baseline projection at zenith, the PSF width
+    follows from the second moments of the uv distribution (natural
+    weighting, Gaussian approximation).
+
+    Returns [rows, edges]: a dict per subarray and the radial bin edges [m].
+    """
+    table = array.baselines()
+    members = np.zeros((len(subarrays), len(array)), dtype=bool)
+    for idx, [name, ant_names] in enumerate(subarrays):
+        members[idx, array.index(ant_names)] = True
+    # baselines with both antennas in the subarray
+    inside = members[:, table.ant1] & members[:, table.ant2]
+    nbl = inside.sum(axis=1)
+
+    length = table.length
+    max_bl = np.where(inside, length, -np.inf).max(axis=1)
+    min_bl = np.where(inside, length, np.inf).min(axis=1)
+
+    # radial uv density, baselines per km^2 in annuli of the full array
+    edges = np.linspace(0., length.max(), nbins + 1)
+    rbin = np.clip(np.searchsorted(edges, length, side='right') - 1, 0, nbins - 1)  # noqa
+    [sub, bl] = np.nonzero(inside)
+    counts = np.bincount(sub*nbins + rbin[bl], minlength=len(subarrays)*nbins).reshape(-1, nbins)  # noqa
+    area = np.pi*(edges[1:]**2 - edges[:-1]**2)/1e6
+    density = counts/area
+
+    # second moments of the snapshot uv coverage in wavelengths
+    wavelength = C/freq
+    u = table.enu[:, 0]/wavelength
+    v = table.enu[:, 1]/wavelength
+    moments = np.dot(inside, np.vstack((u*u, u*v, v*v)).T)/np.maximum(nbl, 1)[:, np.newaxis]  # noqa
+    trace = moments[:, 0] + moments[:, 2]
+    det = moments[:, 0]*moments[:, 2] - moments[:, 1]**2
+    root = np.sqrt(np.maximum(trace**2/4. - det, 0.))
+    [sigma_max, sigma_min] = [np.sqrt(np.maximum(trace/2. + sign*root, 0.)) for sign in [1., -1.]]  # noqa
+    with np.errstate(divide='ignore'):
+        # the narrowest uv extent gives the widest PSF axis
+        psf_major = np.rad2deg(FWHM/(2.*np.pi*sigma_min))*3600.
+        psf_minor = np.rad2deg(FWHM/(2.*np.pi*sigma_max))*3600.
+
+    rows = []
+    for idx, [name, ant_names] in enumerate(subarrays):
+        row = {
+               'name': name,
+               'nants': int(members[idx].sum()),
+               'nbaselines': int(nbl[idx]),
+               'max_baseline': float(max_bl[idx]) if nbl[idx] else np.nan,
+               'min_baseline': float(min_bl[idx]) if nbl[idx] else np.nan,
+               'psf_major': float(psf_major[idx]) if nbl[idx] else np.nan,
+               'psf_minor': float(psf_minor[idx]) if nbl[idx] else np.nan,
+              }
+        for rdx in range(nbins):
+            row[density_column(edges, rdx)] = float(density[idx, rdx])
+        rows.append(row)
+    return [rows, edges]
+
+
+# Column name of a radial uv density bin
+def density_column(edges, rdx):
+    return 'density_%.1f-%.1fkm' % (edges[rdx]/1e3, edges[rdx+1]/1e3)
+
+
+# Table columns in display order
+def columns(edges):
+    cols = ['name', 'nants', 'nbaselines', 'max_baseline', 'min_baseline', 'psf_major', 'psf_minor']  # noqa
+    return cols + [density_column(edges, rdx) for rdx in range(len(edges) - 1)]  # noqa
+
+
+def show_table(rows, edges, fout=sys.stdout):
+    """Print the subarray statistics as an aligned text table."""
+    print('Subarray statistics: baselines [m], snapshot PSF FWHM [arcsec], uv density [baselines/km^2]', file=fout)  # noqa
+    header = columns(edges)
+    cells = [header]
+    for row in rows:
+        cells.append([row[col] if isinstance(row[col], str) else '%d' % row[col] if isinstance(row[col], int) else '%.2f' % row[col] for col in header])  # noqa
+    widths = [max(len(line[idx]) for line in cells) for idx in range(len(header))]  # noqa
+    for line in cells:
+        print('  '.join(cell.rjust(width) for cell, width in zip(line, widths)), file=fout)  # noqa
+
+
+def write_table(rows, edges, filename):
+    """Write the subarray statistics to a CSV file."""
+    with open(filename, 'w') as fout:
+        writer = csv.DictWriter(fout, columns(edges))
+        writer.writeheader()
+        for row in rows:
+            writer.writerow(row)
+    return filename
+
+# -fin-
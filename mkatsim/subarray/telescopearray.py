@@ -3,23 +3,31 @@
 
 import numpy
 import matplotlib.pyplot as plt
-from mpl_toolkits.basemap import Basemap
+
+from ..common.antennas import as_array
+from .projection import Mercator
 
 # Copied library functions
 def shoot(lon, lat, azimuth, maxdist=None):
     """Shooter Function
     Original javascript on http://williams.best.vwh.net/gccalc.htm
     Translated to python by Thomas Lecocq
+    Vectorised: lon, lat, azimuth and maxdist may be arrays that broadcast
+    together, all points are refined in the same Vincenty iterations
     """
     import numpy as np
+    [lon, lat, azimuth, maxdist] = np.broadcast_arrays(
+        *[np.asarray(val, dtype=float) for val in (lon, lat, azimuth, maxdist)])  # noqa
+    shape = lon.shape
+    [lon, lat, azimuth, maxdist] = [val.ravel() for val in (lon, lat, azimuth, maxdist)]  # noqa
     glat1 = lat * np.pi / 180.
     glon1 = lon * np.pi / 180.
     s = maxdist / 1.852
     faz = azimuth * np.pi / 180.
 
     EPS= 0.00000000005
-    if ((np.abs(np.cos(glat1))<EPS) and not (np.abs(np.sin(faz))<EPS)):
-        alert("Only N-S courses are meaningful, starting at a pole!")
+    if np.any((np.abs(np.cos(glat1))<EPS) & ~(np.abs(np.sin(faz))<EPS)):
+        raise RuntimeError("Only N-S courses are meaningful, starting at a pole!")
 
     a=6378.13/1.852
     f=1/298.257223563
@@ -27,10 +35,7 @@ def shoot(lon, lat, azimuth, maxdist=None):
     tu = r * np.tan(glat1)
     sf = np.sin(faz)
     cf = np.cos(faz)
-    if (cf==0):
-        b=0.
-    else:
-        b=2.  * np.arctan2(tu, cf)
+    b = np.where(cf==0, 0., 2.  * np.arctan2(tu, cf))
 
     cu = 1.  / np.sqrt(1 + tu * tu)
     su = tu * cu
@@ -42,18 +47,29 @@ def shoot(lon, lat, azimuth, maxdist=None):
     c = (x * x / 4.  + 1.) / c
     d = (0.375 * x * x - 1.) * x
     tu = s / (r * a * c)
-    y = tu
+    y = tu.copy()
     c = y + 1
-    while (np.abs (y - c) > EPS):
-
-        sy = np.sin(y)
-        cy = np.cos(y)
-        cz = np.cos(b + y)
-        e = 2.  * cz * cz - 1.
-        c = y
-        x = e * cy
-        y = e + e - 1.
-        y = (((sy * sy * 4.  - 3.) * y * cz * d / 6.  + x) * d / 4.  - cz) * sy * d + tu
+    sy = np.empty_like(y)
+    cy = np.empty_like(y)
+    cz = np.empty_like(y)
+    e = np.empty_like(y)
+    # iterate only the points that have not converged yet
+    active = np.abs(y - c) > EPS
+    while np.any(active):
+        ya = y[active]
+        da = d[active]
+        sya = np.sin(ya)
+        cza = np.cos(b[active] + ya)
+        ea = 2.  * cza * cza - 1.
+        sy[active] = sya
+        cy[active] = np.cos(ya)
+        cz[active] = cza
+        e[active] = ea
+        c[active] = ya
+        x = ea * cy[active]
+        ya = ea + ea - 1.
+        y[active] = (((sya * sya * 4.  - 3.) * ya * cza * da / 6.  + x) * da / 4.  - cza) * sya * da + tu[active]  # noqa
+        active = np.abs(y - c) > EPS
 
     b = cu * cy * cf - su * sy
     c = r * np.sqrt(sa * sa + b * b)
@@ -71,25 +87,163 @@ def shoot(lon, lat, azimuth, maxdist=None):
     glat2 *= 180./np.pi
     baz *= 180./np.pi
 
-    return (glon2, glat2, baz)
+    return (glon2.reshape(shape)[()], glat2.reshape(shape)[()], baz.reshape(shape)[()])  # noqa
+
+# Closed geodesic circles of several radii around a centre in one call
+def circles(
+            centerlon,     # deg
+            centerlat,     # deg
+            radii,         # list of radii [km]
+            npoints=360,   # points per circle, one per degree azimuth
+           ):
+    azimuth = numpy.arange(npoints, dtype=float)*360./npoints
+    radii = numpy.atleast_1d(numpy.asarray(radii, dtype=float))
+    glon2, glat2, baz = shoot(centerlon, centerlat, azimuth[numpy.newaxis, :], radii[:, numpy.newaxis])  # noqa
+    # repeat the first point to close every circle
+    X = numpy.hstack((glon2, glon2[:, :1]))
+    Y = numpy.hstack((glat2, glat2[:, :1]))
+    return (X, Y)
 
 def equi(m, centerlon, centerlat, radius, *args, **kwargs):
-    glon1 = centerlon
-    glat1 = centerlat
-    X = []
-    Y = []
-    for azimuth in range(0, 360):
-        glon2, glat2, baz = shoot(glon1, glat1, azimuth, radius)
-        X.append(glon2)
-        Y.append(glat2)
-    X.append(X[0])
-    Y.append(Y[0])
-
-    #~ m.plot(X,Y,**kwargs)
-    #Should work, but doesn't...
-    X,Y = m(X,Y)
+    X, Y = circles(centerlon, centerlat, [radius])
+    # m is any callable projection, e.g. projection.Mercator
+    X,Y = m(X[0],Y[0])
     plt.plot(X,Y,**kwargs)
 
+# Figure layout of the array maps, the axes position is fixed so that the
+# pre-rendered base layer maps one to one onto the axes pixels
+FIGSIZE = (20, 13)
+AXES = [0.125, 0.11, 0.775, 0.77]
+# Pre-rendered base layers, keyed by array positions and figure layout
+_BASE_LAYERS = {}
+
+# Draw the graticule lines of the map
+def _draw_grid(ax, proj, extent):
+    [meridians, parallels] = proj.graticule(extent)
+    [xs, ys] = [proj(meridians, proj.lat_0)[0], proj(proj.lon_0, parallels)[1]]  # noqa
+    ax.vlines(xs, extent[2], extent[3], colors='k', linestyles='dotted', linewidth=0.5)  # noqa
+    ax.hlines(ys, extent[0], extent[1], colors='k', linestyles='dotted', linewidth=0.5)  # noqa
+
+# Label the graticule lines along the map edges and fix the map limits
+def _label_grid(ax, proj, extent, fontsize=10):
+    [meridians, parallels] = proj.graticule(extent)
+    ax.set_xticks(proj(meridians, proj.lat_0)[0])
+    # plain degree sign, mathtext labels are slow to lay out
+    ax.set_xticklabels([u'%.2f\u00b0%s' % (abs(lon), 'E' if lon >= 0 else 'W') for lon in meridians], fontsize=fontsize)  # noqa
+    ax.set_yticks(proj(proj.lon_0, parallels)[1])
+    ax.set_yticklabels([u'%.2f\u00b0%s' % (abs(lat), 'N' if lat >= 0 else 'S') for lat in parallels], fontsize=fontsize)  # noqa
+    ax.set_xlim(extent[0], extent[1])
+    ax.set_ylim(extent[2], extent[3])
+
+# Map projection and limits of the array on axes of the figure layout
+def _array_map(ref_location, arr_lon, arr_lat, figsize=FIGSIZE, axes=AXES):
+    proj = Mercator(ref_location.longitude.value, ref_location.latitude.value)
+    aspect = (figsize[1]*axes[3])/(figsize[0]*axes[2])
+    return [proj, proj.extent(arr_lon, arr_lat, aspect=aspect)]
+
+# Full array and graticule rendered once as an RGBA image of the map axes
+def base_layer(
+               ref_location,     # array geodetic (LAT,LON) reference
+               array,            # antenna location array
+               figsize=FIGSIZE,
+               axes=AXES,
+               dpi=None,         # default the matplotlib figure dpi
+              ):
+    import matplotlib
+    from matplotlib.figure import Figure
+    from ..common.baselines import positions_digest
+    array = as_array(array, ref_location)
+    if dpi is None:
+        dpi = matplotlib.rcParams['figure.dpi']
+    key = (positions_digest(array), ref_location.longitude.value, ref_location.latitude.value, tuple(figsize), tuple(axes), dpi)  # noqa
+    if key not in _BASE_LAYERS:
+        [arr_names, arr_lat, arr_lon] = build_array(array)
+        [proj, extent] = _array_map(ref_location, arr_lon, arr_lat, figsize=figsize, axes=axes)  # noqa
+        # off screen figure the size of the map axes
+        fig = Figure(figsize=(figsize[0]*axes[2], figsize[1]*axes[3]), dpi=dpi)  # noqa
+        ax = fig.add_axes([0, 0, 1, 1])
+        ax.set_axis_off()
+        _draw_grid(ax, proj, extent)
+        [arr_x, arr_y] = proj(arr_lon, arr_lat)
+        ax.scatter(arr_x, arr_y, 5, marker='o', color='c')
+        ax.set_xlim(extent[0], extent[1])
+        ax.set_ylim(extent[2], extent[3])
+        _BASE_LAYERS[key] = {
+                             'proj': proj,
+                             'extent': extent,
+                             'image': _render(fig),
+                             'figsize': figsize,
+                             'axes': axes,
+                             'dpi': dpi,
+                            }
+    return _BASE_LAYERS[key]
+
+# Figure rendered off screen to an RGBA array, first row at the top
+def _render(fig):
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    canvas = FigureCanvasAgg(fig)
+    canvas.draw()
+    [width, height] = canvas.get_width_height()
+    return numpy.frombuffer(canvas.buffer_rgba(), dtype=numpy.uint8).reshape(height, width, 4).copy()  # noqa
+
+# Map axes of an off screen figure with the layout of a base layer
+def _layer_axes(layer):
+    from matplotlib.figure import Figure
+    fig = Figure(figsize=layer['figsize'], dpi=layer['dpi'])
+    return fig.add_axes(layer['axes'])
+
+# Base layer and graticule labels on the map axes
+def _draw_map(ax, layer):
+    ax.imshow(layer['image'], extent=layer['extent'], origin='upper', interpolation='nearest', aspect='auto')  # noqa
+    _label_grid(ax, layer['proj'], layer['extent'])
+
+# Opaque figure of a base layer with its graticule labels, rendered once as
+# the background that subarray overlays are blended onto
+def _background(layer):
+    if 'background' not in layer:
+        ax = _layer_axes(layer)
+        _draw_map(ax, layer)
+        layer['background'] = _render(ax.figure)
+    return layer['background']
+
+# Alpha blend an RGBA overlay onto an opaque background of the same size
+def _blend(background, overlay):
+    blended = background.copy()
+    pixels = blended.reshape(-1, 4)
+    overlay = overlay.reshape(-1, 4)
+    # only the pixels drawn on, most of the overlay is transparent
+    drawn = numpy.flatnonzero(overlay[:, 3])
+    src = overlay[drawn].astype(numpy.uint16)
+    alpha = src[:, 3:]
+    pixels[drawn, :3] = (src[:, :3]*alpha + pixels[drawn, :3]*(255 - alpha) + 127)//255  # noqa
+    return blended
+
+# Subarray antennas, names and radius circles, title and legend on the map
+def _draw_subarray(
+                   ax,
+                   array_ref,       # array reference location
+                   proj,            # map projection of the base layer
+                   names,           # subarray antenna names
+                   subarr_x,        # projected subarray antenna positions
+                   subarr_y,
+                   subname,
+                   radii,
+                  ):
+    # legend entry of the antennas in the base layer
+    ax.plot([], [], 'o', color='c', markersize=2.2, label='MeerKAT antennas')
+    ax.scatter(subarr_x, subarr_y, 10, marker='o', color='k', label='SubArray')
+    if radii:
+        # all radius circles are computed in one vectorised call
+        radii = [0.5, 1, 2, 3]
+        X, Y = circles(array_ref.longitude.value, array_ref.latitude.value, radii)  # noqa
+        for radius, lon, lat in zip(radii, X, Y):
+            x, y = proj(lon, lat)
+            ax.plot(x, y, lw=1., linestyle='--', label='%s deg' % radius)
+    for name, x, y in zip(names, subarr_x, subarr_y):
+        ax.text(x, y, name, fontsize=6, ha='center', va='baseline', color='k', clip_on=True)  # noqa
+    ax.set_title('SubArray %s' % subname)
+    ax.legend(loc=0, numpoints=1)
+
 # Show simple layout for quick look
 def show_layout(
                 array,              # antenna location array
@@ -97,9 +251,13 @@ def show_layout(
                 savegraph=False,    # output to PNG image
                ):
     [arr_names, arr_lat, arr_lon] = build_array(array)
+    # equal scale east and north around the array centre
+    proj = Mercator(numpy.mean(arr_lon), numpy.mean(arr_lat))
+    arr_x, arr_y = proj(arr_lon, arr_lat)
     plt.figure(facecolor='white')
     ax1 = plt.axes(frameon=False)
-    plt.plot(arr_lon, arr_lat, 'ro', alpha=0.3)
+    plt.plot(arr_x, arr_y, 'ro', alpha=0.3)
+    ax1.set_aspect('equal', adjustable='datalim')
     ax1.axes.get_yaxis().set_visible(False)
     ax1.axes.get_xaxis().set_visible(False)
     plt.title(str(subname))
@@ -114,49 +272,37 @@ def show_subarray(
                   subname=None,    # Name of subarray to display
                   savegraph=False,
                   radii=True,
+                  show=True,       # also draw a pyplot figure for display
                  ):
 # def mkat_subarr(mkat, subarray=None, antennalist=[], savegraph=False):
-    [arr_names, arr_lat, arr_lon] = build_array(array)
     [subarr_names, subarr_lat, subarr_lon] = build_array(subarray)
 
-    # Earth projection
-    m = Basemap(projection='merc',
-                lat_0=array_ref.latitude.value,
-                lon_0=array_ref.longitude.value,
-                llcrnrlon=numpy.min(arr_lon)-0.005,
-                llcrnrlat=numpy.min(arr_lat)-0.005,
-                urcrnrlon=numpy.max(arr_lon)+0.005,
-                urcrnrlat=numpy.max(arr_lat)+0.005)
-    # set regular grid and map projected coordinates
-    arr_x, arr_y = m(arr_lon, arr_lat)
-    subarr_x, subarr_y = m(subarr_lon, subarr_lat)
-    # # Array layout
-    plt.figure(figsize=(20, 13))
-    # draw parallels.
-    parallels = numpy.arange(-30.73, -30.69, .01)
-    m.drawparallels(parallels, labels=[1, 0, 0, 0], fontsize=10)
-    # draw meridians
-    meridians = numpy.arange(21.41, 21.48, .01)
-    m.drawmeridians(meridians, labels=[0, 0, 0, 1], fontsize=10)
-    m.drawmapboundary(fill_color='white')
-    m.scatter(arr_x, arr_y, 5, marker='o', color='c', label='MeerKAT antennas')
-    m.scatter(subarr_x, subarr_y, 10, marker='o', color='k', label='SubArray')
-    if radii:
-        equi(m, array_ref.longitude.value, array_ref.latitude.value, radius=0.5,lw=1., linestyle='--', label='0.5 deg')
-        equi(m, array_ref.longitude.value, array_ref.latitude.value, radius=1,lw=1., linestyle='--', label='1 deg')
-        equi(m, array_ref.longitude.value, array_ref.latitude.value, radius=2,lw=1., linestyle='--', label='2 deg')
-        equi(m, array_ref.longitude.value, array_ref.latitude.value, radius=3,lw=1., linestyle='--', label='3 deg')
-    cntr = 0
-    for x, y in zip(subarr_x, subarr_y):
-        plt.text(x, y, subarray.keys()[cntr], fontsize=6, ha='center', va='baseline', color='k')  # noqa
-        cntr += 1
-    plt.title('SubArray %s' % subname)
-    plt.legend(loc=0, numpoints=1)
+    # full array drawn once, only the subarray is drawn per call
+    layer = base_layer(array_ref, array)
+    [proj, extent] = [layer['proj'], layer['extent']]
+    subarr_x, subarr_y = proj(subarr_lon, subarr_lat)
+    overlay = [array_ref, proj, subarr_names, subarr_x, subarr_y, subname, radii]  # noqa
     if savegraph:
+        from ..common.png import write_rgba_png
+        # only the subarray is rendered, on a transparent figure that is
+        # blended onto the cached background of the array map
+        ax = _layer_axes(layer)
+        ax.figure.patch.set_alpha(0.)
+        ax.set_axis_off()
+        ax.set_xlim(extent[0], extent[1])
+        ax.set_ylim(extent[2], extent[3])
+        _draw_subarray(ax, *overlay)
+        rgba = _blend(_background(layer), _render(ax.figure))
         if subname is None:
-            plt.savefig('SubArrayLayout.png')
+            write_rgba_png(rgba, 'SubArrayLayout.png')
         else:
-            plt.savefig('Sub%sLayout.png' % subname)
+            write_rgba_png(rgba, 'Sub%sLayout.png' % subname)
+    if show:
+        # # Array layout
+        fig = plt.figure(figsize=layer['figsize'], dpi=layer['dpi'])
+        ax = fig.add_axes(layer['axes'])
+        _draw_map(ax, layer)
+        _draw_subarray(ax, *overlay)
 
 # Generate layout map using Mercator projection
 def generate_map(
@@ -166,59 +312,41 @@ def generate_map(
                 savegraph=False,    # output to PNG image
                ):
     [arr_names, arr_lat, arr_lon] = build_array(array)
-    # Earth projection
-    m = Basemap(projection='merc',
-                lat_0=ref_location.latitude.value,
-                lon_0=ref_location.longitude.value,
-                llcrnrlon=numpy.min(arr_lon)-0.005,
-                llcrnrlat=numpy.min(arr_lat)-0.005,
-                urcrnrlon=numpy.max(arr_lon)+0.005,
-                urcrnrlat=numpy.max(arr_lat)+0.005)
     # set regular grid and map projected coordinates
-    ref_x, ref_y = m(ref_location.longitude.value, ref_location.latitude.value)
-    arr_x, arr_y = m(arr_lon, arr_lat)
-    # Array layout
-    plt.figure(figsize=(20, 13), facecolor='white')
-    # draw parallels.
-    parallels = numpy.arange(-30.73, -30.69, .01)
-    m.drawparallels(parallels, labels=[1, 0, 0, 0], fontsize=10)
-    # draw meridians
-    meridians = numpy.arange(21.41, 21.48, .01)
-    m.drawmeridians(meridians, labels=[0, 0, 0, 1], fontsize=10)
-    m.drawmapboundary(fill_color='white')
-    m.scatter(ref_x, ref_y, 1000, marker='+', color='r', label='Array reference')  # noqa
+    [proj, extent] = _array_map(ref_location, arr_lon, arr_lat)
+    ref_x, ref_y = proj(ref_location.longitude.value, ref_location.latitude.value)  # noqa
+    arr_x, arr_y = proj(arr_lon, arr_lat)
+    # Array layout, drawn as vectors for the high resolution output
+    fig = plt.figure(figsize=FIGSIZE, facecolor='white')
+    ax = fig.add_axes(AXES)
+    _draw_grid(ax, proj, extent)
+    ax.scatter(ref_x, ref_y, 1000, marker='+', color='r', label='Array reference')  # noqa
     cntr = 0
     for x, y in zip(arr_x, arr_y):
-        plt.text(x, y, arr_names[cntr], fontsize=6, ha='center', va='baseline', color='k')  # noqa
+        ax.text(x, y, arr_names[cntr], fontsize=6, ha='center', va='baseline', color='k', clip_on=True)  # noqa
         cntr += 1
-    plt.title('Detail Map: %s Layout' % subname)
-    plt.legend(loc=0, numpoints=1, ncol=1, prop={'size': 10}, scatterpoints=1)
+    _label_grid(ax, proj, extent)
+    ax.set_title('Detail Map: %s Layout' % subname)
+    ax.legend(loc=0, numpoints=1, ncol=1, prop={'size': 10}, scatterpoints=1)
     if savegraph:
         plt.savefig('%s_ArrayLayout.png' % subname, dpi=300)
 
 # Utility script to extract antenna (LAT,LON) positions for plotting
 def build_array(
-                array_antennas,  # ENU coordinates from astropy
+                array_antennas,  # AntennaArray or dict of astropy locations
                ):
-    # Get array
-    arr_latitude = []
-    arr_longitude = []
-    arr_names = []
-    for antenna in array_antennas:
-        arr_names.append(antenna)
-        arr_latitude.append(array_antennas[antenna].latitude.value)
-        arr_longitude.append(array_antennas[antenna].longitude.value)
-    return [arr_names, arr_latitude, arr_longitude]
+    # geodetic coordinates of all antennas are converted in one pass
+    array_antennas = as_array(array_antennas)
+    return [array_antennas.keys(), array_antennas.latitude, array_antennas.longitude]  # noqa
 
 # Save subarray in ITRF geo-centric coordinate file
 def save_array(
                subarray,  # Geo-centric coordinates of subarray
               ):
+    subarray = as_array(subarray)
     out_str = 'X Y Z diameter station mount\n'
-    for ant in subarray.keys():
-        itrf = subarray[ant]
-        out_str += ('%f %f %f 13.5 %s ALT-AZ\n' %
-                   (itrf.x.value, itrf.y.value, itrf.z.value, ant))
+    for [x, y, z], diameter, ant, mount in zip(subarray.xyz, subarray.diameters, subarray.names, subarray.mounts):  # noqa
+        out_str += ('%f %f %f %s %s %s\n' % (x, y, z, diameter, ant, mount))
 
     fout = open('subarray.itrf', 'w')
     fout.write(out_str)
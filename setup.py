@@ -34,6 +34,7 @@ setup(
         'console_scripts': [
             'mkspsf=mkatsim.psf.__main__:cli',
             'mksarray=mkatsim.subarray.__main__:cli',
+            'mkspng=mkatsim.psf.fits2png:cli',
             ],
         },
 )